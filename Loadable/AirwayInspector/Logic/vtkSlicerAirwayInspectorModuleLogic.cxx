@@ -11,6 +11,8 @@
 
 // VTK includes
 #include <vtkImageData.h>
+#include <vtkDoubleArray.h>
+#include <vtkPolyData.h>
 #include <vtkObjectFactory.h>
 #include <vtkVersion.h>
 #include <vtkImageEllipsoidSource.h>
@@ -30,9 +32,14 @@
 
 // STD includes
 #include <algorithm>
+#include <atomic>
+#include <condition_variable>
+#include <deque>
+#include <mutex>
 #include <string>
 #include <iostream>
 #include <sstream>
+#include <thread>
 
 #ifdef WIN32
 #define round(x) floor((x)+0.5)
@@ -56,6 +63,8 @@ vtkSlicerAirwayInspectorModuleLogic::vtkSlicerAirwayInspectorModuleLogic()
   this->Reslicer = vtkImageResliceWithPlane::New();
   this->WallSolver = vtkComputeAirwayWall::New();
   this->WallSolver->SetMethod(1);
+  this->SelfTuneSolver = vtkComputeAirwayWall::New();
+  this->NumberOfThreads = 0;
 }
 
 //-----------------------------------------------------------------------------
@@ -63,6 +72,7 @@ vtkSlicerAirwayInspectorModuleLogic::~vtkSlicerAirwayInspectorModuleLogic()
 {
   this->Reslicer->Delete();
   this->WallSolver->Delete();
+  this->SelfTuneSolver->Delete();
 }
 
 //-----------------------------------------------------------------------------
@@ -173,118 +183,80 @@ void vtkSlicerAirwayInspectorModuleLogic::ComputeAirwayWall(vtkImageData* sliceI
     return;
     }
 
-  this->WallSolver->SetMethod(method);
-  this->WallSolver->SetDelta(0.5);
-  this->WallSolver->SetWallThreshold(node->GetThreshold());
-
-  std::string methodTag;
-
-  if (this->WallSolver->GetMethod() == 0)
-  {
-    methodTag = "FWHM";
-  }
-  else if (this->WallSolver->GetMethod() == 1)
-  {
-    methodTag = "Zero Crossing";
-  }
-  else if (this->WallSolver->GetMethod() == 2)
-  {
-    methodTag = "PC-Single Kernel";
-  }
-  else if (this->WallSolver->GetMethod() == 3)
-  {
-    methodTag = "PC-Multiple Kernels";
-  }
-
-  vtkEllipseFitting* ellipseInside = node->GetEllipseInside(method);
-  if (!ellipseInside)
-    {
-    ellipseInside = vtkEllipseFitting::New();
-    node->SetEllipseInside(method, ellipseInside);
-    }
-
-  vtkEllipseFitting* ellipseOutside = node->GetEllipseOutside(method);
-  if (!ellipseOutside)
-    {
-    ellipseOutside = vtkEllipseFitting::New();
-    node->SetEllipseOutside(method, ellipseOutside);
-    }
+  AirwayWallResult result;
+  this->ComputeAirwayWallResult(sliceImage, method, node->GetThreshold(),
+                                node->GetReconstruction(), node->GetResolution(),
+                                this->WallSolver, this->SelfTuneSolver, result);
+  this->ApplyAirwayWallResult(node, result);
+}
 
-  vtkDoubleArray *mean = node->GetMean(method);
-  if (!mean)
-    {
-    mean = vtkDoubleArray::New();
-    node->SetMean(method, mean);
-    }
-  vtkDoubleArray *std = node->GetStd(method);
-  if (!std)
-    {
-    std = vtkDoubleArray::New();
-    node->SetStd(method, std);
-    }
-  vtkDoubleArray *min = node->GetMin(method);
-  if (!min)
-    {
-    min = vtkDoubleArray::New();
-    node->SetMin(method, min);
-    }
-  vtkDoubleArray *max = node->GetMax(method);
-  if (!max)
-    {
-    max = vtkDoubleArray::New();
-    node->SetMax(method, max);
-    }
+////////////////////////////
+void vtkSlicerAirwayInspectorModuleLogic::ComputeAirwayWallResult(vtkImageData* sliceImage, int method,
+                                                                  double threshold, int reconstruction,
+                                                                  double resolution,
+                                                                  vtkComputeAirwayWall *wallSolver,
+                                                                  vtkComputeAirwayWall *selfTuneSolver,
+                                                                  AirwayWallResult &result)
+{
+  // The solvers are reused between airways and methods. Start always from the
+  // default parameters (ex: the self tune method changes the multiplicative
+  // factor), so that the results don't depend on the previous computations
+  vtkNew<vtkComputeAirwayWall> defaultSolver;
+  this->SetWallSolver(defaultSolver.GetPointer(), wallSolver);
+  wallSolver->SetMethod(method);
+  wallSolver->SetDelta(0.5);
+  wallSolver->SetWallThreshold(threshold);
+
+  result.Method = method;
+  result.Mean = vtkSmartPointer<vtkDoubleArray>::New();
+  result.Std = vtkSmartPointer<vtkDoubleArray>::New();
+  result.Min = vtkSmartPointer<vtkDoubleArray>::New();
+  result.Max = vtkSmartPointer<vtkDoubleArray>::New();
+  result.EllipseInside = vtkSmartPointer<vtkEllipseFitting>::New();
+  result.EllipseOutside = vtkSmartPointer<vtkEllipseFitting>::New();
 
   std::stringstream name;
   name << "airwaymetrics-" << method << "-mean";
-  mean->SetName(name.str().c_str());
+  result.Mean->SetName(name.str().c_str());
 
-  name.clear();
+  name.str("");
   name << "airwaymetrics-" << method << "-std";
-  std->SetName(name.str().c_str());
+  result.Std->SetName(name.str().c_str());
 
-  name.clear();
+  name.str("");
   name << "airwaymetrics-" << method << "-min";
-  min->SetName(name.str().c_str());
+  result.Min->SetName(name.str().c_str());
 
-  name.clear();
+  name.str("");
   name << "airwaymetrics-" << method << "-max";
-  max->SetName(name.str().c_str());
+  result.Max->SetName(name.str().c_str());
 
-  name.clear();
-  name << "airwaymetrics-" << method << "-ellips";
-  node->GetEllipse()->SetName(name.str().c_str());
-
-  int nc = this->WallSolver->GetNumberOfQuantities();
+  int nc = wallSolver->GetNumberOfQuantities();
   int np = 1;
 
-  mean->SetNumberOfComponents(nc);
-  mean->SetNumberOfTuples(np);
-  std->SetNumberOfComponents(nc);
-  std->SetNumberOfTuples(np);
-  min->SetNumberOfComponents(nc);
-  min->SetNumberOfTuples(np);
-  max->SetNumberOfComponents(nc);
-  max->SetNumberOfTuples(np);
-  node->GetEllipse()->SetNumberOfComponents(6);
-  node->GetEllipse()->SetNumberOfTuples(np);
+  result.Mean->SetNumberOfComponents(nc);
+  result.Mean->SetNumberOfTuples(np);
+  result.Std->SetNumberOfComponents(nc);
+  result.Std->SetNumberOfTuples(np);
+  result.Min->SetNumberOfComponents(nc);
+  result.Min->SetNumberOfTuples(np);
+  result.Max->SetNumberOfComponents(nc);
+  result.Max->SetNumberOfTuples(np);
 
-  this->WallSolver->SetInputData(sliceImage);
+  wallSolver->SetInputData(sliceImage);
 
-   //this->WallSolver->SetInputData(this->Reslicer->GetOutput());
    //Maybe we have to update the threshold depending on the center value.
-   if (this->WallSolver->GetMethod()==2)
+   if (wallSolver->GetMethod()==2)
    {
-     // Use self tune phase congruency
-     vtkComputeAirwayWall *tmp = vtkComputeAirwayWall::New();
-     this->SetWallSolver(this->WallSolver,tmp);
-     tmp->SetInputData(this->Reslicer->GetOutput());
-     tmp->ActivateSectorOff();
-     tmp->SetBandwidth(1.577154);
-     tmp->SetNumberOfScales(12);
-     tmp->SetMultiplicativeFactor(1.27);
-     tmp->SetMinimumWavelength(2);
-     tmp->UseWeightsOn();
+     // Use self tune phase congruency. The solver is reused between airways
+     this->SetWallSolver(wallSolver, selfTuneSolver);
+     selfTuneSolver->SetInputData(sliceImage);
+     selfTuneSolver->ActivateSectorOff();
+     selfTuneSolver->SetBandwidth(1.577154);
+     selfTuneSolver->SetNumberOfScales(12);
+     selfTuneSolver->SetMultiplicativeFactor(1.27);
+     selfTuneSolver->SetMinimumWavelength(2);
+     selfTuneSolver->UseWeightsOn();
      vtkDoubleArray *weights = vtkDoubleArray::New();
      weights->SetNumberOfTuples(12);
      double tt[12]={1.249966,0.000000,0.000000,0.734692,0.291580,0.048616,0.718651,0.000000,0.620357,0.212188,0.000000,1.094157};
@@ -292,63 +264,249 @@ void vtkSlicerAirwayInspectorModuleLogic::ComputeAirwayWall(vtkImageData* sliceI
      {
        weights->SetValue(i,tt[i]);
      }
-     tmp->SetWeights(weights);
-     tmp->Update();
-     double wt = tmp->GetStatsMean()->GetComponent(2,0);
-     tmp->Delete();
+     selfTuneSolver->SetWeights(weights);
+     selfTuneSolver->Update();
+     double wt = selfTuneSolver->GetStatsMean()->GetComponent(2,0);
      weights->Delete();
      double ml;
-     double *factors;
-     switch (node->GetReconstruction())
+     const double *factors;
+     switch (reconstruction)
      {
-       case vtkMRMLAirwayNode::SMOOTH:
-         factors = this->SelfTuneModelSmooth;
-         break;
        case vtkMRMLAirwayNode::SHARP:
          factors = this->SelfTuneModelSharp;
          break;
+       case vtkMRMLAirwayNode::SMOOTH:
+       default:
+         factors = this->SelfTuneModelSmooth;
+         break;
      }
      ml = exp(factors[0]*pow(log(wt*factors[1]),factors[2]));
-     this->WallSolver->SetMultiplicativeFactor(ml);
+     wallSolver->SetMultiplicativeFactor(ml);
    }
 
-   //cout<<"Update solver"<<endl;
-   this->WallSolver->Update();
-   //cout<<"Done solver"<<endl;
+   wallSolver->Update();
 
-   //cout<<"Ellipse fitting 1: "<<this->WallSolver->GetInnerContour()->GetNumberOfPoints()<<endl;
-   if (this->WallSolver->GetInnerContour()->GetNumberOfPoints() >= 3)
+   if (wallSolver->GetInnerContour()->GetNumberOfPoints() >= 3)
    {
-     ellipseInside->SetInputData(this->WallSolver->GetInnerContour());
-     ellipseInside->Update();
+     vtkPolyData *contour = vtkPolyData::New();
+     contour->DeepCopy(wallSolver->GetInnerContour());
+     result.EllipseInside->SetInputData(contour);
+     result.EllipseInside->Update();
+     contour->Delete();
    }
-   //cout<<"Ellipse fitting 2: "<<this->WallSolver->GetOuterContour()->GetNumberOfPoints()<<endl;
-    if (this->WallSolver->GetOuterContour()->GetNumberOfPoints() >= 3)
+    if (wallSolver->GetOuterContour()->GetNumberOfPoints() >= 3)
     {
-      ellipseOutside->SetInputData(this->WallSolver->GetOuterContour());
-      ellipseOutside->Update();
+      vtkPolyData *contour = vtkPolyData::New();
+      contour->DeepCopy(wallSolver->GetOuterContour());
+      result.EllipseOutside->SetInputData(contour);
+      result.EllipseOutside->Update();
+      contour->Delete();
     }
-   //cout<<"Done ellipse fitting"<<endl;
 
-   // Collect results and assign them to polydata
-   for (int c = 0; c < this->WallSolver->GetNumberOfQuantities();c++)
+   // Collect results
+   for (int c = 0; c < wallSolver->GetNumberOfQuantities();c++)
    {
-     mean->SetComponent(0,c,this->WallSolver->GetStatsMean()->GetComponent(c,0));
-     std->SetComponent(0,c,this->WallSolver->GetStatsStd()->GetComponent(c,0));
-     min->SetComponent(0,c,this->WallSolver->GetStatsMin()->GetComponent(c,0));
-     max->SetComponent(0,c,this->WallSolver->GetStatsMax()->GetComponent(c,0));
+     result.Mean->SetComponent(0,c,wallSolver->GetStatsMean()->GetComponent(c,0));
+     result.Std->SetComponent(0,c,wallSolver->GetStatsStd()->GetComponent(c,0));
+     result.Min->SetComponent(0,c,wallSolver->GetStatsMin()->GetComponent(c,0));
+     result.Max->SetComponent(0,c,wallSolver->GetStatsMax()->GetComponent(c,0));
    }
 
-   double resolution = node->GetResolution();
+   result.Ellipse[0] = result.EllipseInside->GetMinorAxisLength()*resolution;
+   result.Ellipse[1] = result.EllipseInside->GetMajorAxisLength()*resolution;
+   result.Ellipse[2] = result.EllipseInside->GetAngle();
+   result.Ellipse[3] = result.EllipseOutside->GetMinorAxisLength()*resolution;
+   result.Ellipse[4] = result.EllipseOutside->GetMajorAxisLength()*resolution;
+   result.Ellipse[5] = result.EllipseOutside->GetAngle();
+}
+
+////////////////////////////
+namespace
+{
+// The airway node owns (and deletes) the objects stored in it
+template <class T>
+T* TakeOwnership(T* previous, T* value)
+{
+  if (previous && previous != value)
+    {
+    previous->Delete();
+    }
+  if (previous != value)
+    {
+    value->Register(0);
+    }
+  return value;
+}
+}
+
+void vtkSlicerAirwayInspectorModuleLogic::ApplyAirwayWallResult(vtkMRMLAirwayNode *node,
+                                                                AirwayWallResult &result)
+{
+  int method = result.Method;
+  node->SetMean(method, TakeOwnership(node->GetMean(method), result.Mean.GetPointer()));
+  node->SetStd(method, TakeOwnership(node->GetStd(method), result.Std.GetPointer()));
+  node->SetMin(method, TakeOwnership(node->GetMin(method), result.Min.GetPointer()));
+  node->SetMax(method, TakeOwnership(node->GetMax(method), result.Max.GetPointer()));
+  node->SetEllipseInside(method, TakeOwnership(node->GetEllipseInside(method),
+                                               result.EllipseInside.GetPointer()));
+  node->SetEllipseOutside(method, TakeOwnership(node->GetEllipseOutside(method),
+                                                result.EllipseOutside.GetPointer()));
+
+  std::stringstream name;
+  name << "airwaymetrics-" << method << "-ellips";
+  node->GetEllipse()->SetName(name.str().c_str());
+  node->GetEllipse()->SetNumberOfComponents(6);
+  node->GetEllipse()->SetNumberOfTuples(1);
+  for (int c = 0; c < 6; c++)
+    {
+    node->GetEllipse()->SetComponent(0, c, result.Ellipse[c]);
+    }
+}
+
+////////////////////////////
+namespace
+{
+struct AirwayTask
+{
+  vtkMRMLAirwayNode *Node;
+  vtkSmartPointer<vtkImageData> Slice;
+  double Threshold;
+  int Reconstruction;
+  double Resolution;
+  std::vector<int> Methods;
+  std::vector<vtkSlicerAirwayInspectorModuleLogic::AirwayWallResult> Results;
+};
+}
+
+void vtkSlicerAirwayInspectorModuleLogic::AnalyzeAirways(const std::vector<vtkMRMLAirwayNode*>& nodes,
+                                                         bool allMethods,
+                                                         AirwayAnalyzedCallback callback)
+{
+  // Copy everything the threads need from the nodes, so that the scene is
+  // only accessed from this thread
+  std::vector<AirwayTask> tasks;
+  for (size_t i = 0; i < nodes.size(); i++)
+    {
+    vtkMRMLAirwayNode *node = nodes[i];
+    if (node == 0 || node->GetAirwayImage() == 0 ||
+        this->GetMRMLScene()->GetNodeByID(node->GetVolumeNodeID()) == 0)
+      {
+      continue;
+      }
+    AirwayTask task;
+    task.Node = node;
+    task.Slice = vtkSmartPointer<vtkImageData>::New();
+    task.Slice->DeepCopy(node->GetAirwayImage());
+    task.Threshold = node->GetThreshold();
+    task.Reconstruction = node->GetReconstruction();
+    task.Resolution = node->GetResolution();
+    if (allMethods)
+      {
+      for (int method = 0; method < 4; method++)
+        {
+        if (method != node->GetMethod())
+          {
+          task.Methods.push_back(method);
+          }
+        }
+      }
+    // The method of the node is computed the last one (it's the one stored in the ellipse array)
+    task.Methods.push_back(node->GetMethod());
+    tasks.push_back(task);
+    }
+  if (tasks.empty())
+    {
+    return;
+    }
+
+  std::atomic<size_t> nextTask(0);
+  std::mutex mutex;
+  std::condition_variable finishedCondition;
+  std::deque<size_t> finished;
+
+  auto worker = [&]()
+    {
+    // One set of solvers for every thread
+    vtkNew<vtkComputeAirwayWall> wallSolver;
+    vtkNew<vtkComputeAirwayWall> selfTuneSolver;
+    for (size_t i = nextTask++; i < tasks.size(); i = nextTask++)
+      {
+      AirwayTask &task = tasks[i];
+      task.Results.resize(task.Methods.size());
+      try
+        {
+        for (size_t m = 0; m < task.Methods.size(); m++)
+          {
+          this->ComputeAirwayWallResult(task.Slice, task.Methods[m], task.Threshold,
+                                        task.Reconstruction, task.Resolution,
+                                        wallSolver.GetPointer(), selfTuneSolver.GetPointer(),
+                                        task.Results[m]);
+          }
+        }
+      catch (...)
+        {
+        // Reported by the calling thread. The airway is still marked as finished,
+        // otherwise the calling thread would wait forever
+        task.Results.clear();
+        }
+        {
+        std::lock_guard<std::mutex> lock(mutex);
+        finished.push_back(i);
+        }
+      finishedCondition.notify_one();
+      }
+    };
+
+  int numberOfThreads = this->NumberOfThreads;
+  if (numberOfThreads <= 0)
+    {
+    numberOfThreads = std::max(1u, std::thread::hardware_concurrency());
+    }
+  numberOfThreads = std::min(numberOfThreads, static_cast<int>(tasks.size()));
+  std::vector<std::thread> threads;
+  if (numberOfThreads == 1)
+    {
+    // Serial analysis in the calling thread
+    worker();
+    }
+  else
+    {
+    for (int t = 0; t < numberOfThreads; t++)
+      {
+      threads.push_back(std::thread(worker));
+      }
+    }
 
-   node->GetEllipse()->SetComponent(0,0,ellipseInside->GetMinorAxisLength()*resolution);
-   node->GetEllipse()->SetComponent(0,1,ellipseInside->GetMajorAxisLength()*resolution);
-   node->GetEllipse()->SetComponent(0,2,ellipseInside->GetAngle());
-   node->GetEllipse()->SetComponent(0,3,ellipseOutside->GetMinorAxisLength()*resolution);
-   node->GetEllipse()->SetComponent(0,4,ellipseOutside->GetMajorAxisLength()*resolution);
-   node->GetEllipse()->SetComponent(0,5,ellipseOutside->GetAngle());
+  // Store the results in the nodes as soon as every airway is finished
+  for (size_t done = 0; done < tasks.size(); done++)
+    {
+    size_t i;
+      {
+      std::unique_lock<std::mutex> lock(mutex);
+      finishedCondition.wait(lock, [&finished]() { return !finished.empty(); });
+      i = finished.front();
+      finished.pop_front();
+      }
+    AirwayTask &task = tasks[i];
+    if (task.Results.size() != task.Methods.size())
+      {
+      vtkErrorMacro("AnalyzeAirways: the airway wall of " << task.Node->GetID() << " could not be computed");
+      }
+    for (size_t m = 0; m < task.Results.size(); m++)
+      {
+      this->ApplyAirwayWallResult(task.Node, task.Results[m]);
+      }
+    task.Results.clear();
+    if (callback)
+      {
+      callback(task.Node, static_cast<int>(done + 1), static_cast<int>(tasks.size()));
+      }
+    }
 
-  return;
+  for (size_t t = 0; t < threads.size(); t++)
+    {
+    threads[t].join();
+    }
 }
 
 void vtkSlicerAirwayInspectorModuleLogic::CreateColorImage(vtkImageData *resliceCT,
@@ -456,8 +614,8 @@ void vtkSlicerAirwayInspectorModuleLogic::SetWallSolver(vtkComputeAirwayWall *re
   out->SetDelta(ref->GetDelta());
   out->SetScale(ref->GetScale());
   out->SetNumberOfThetaSamples(ref->GetNumberOfThetaSamples());
-  out->SetAlpha(out->GetAlpha());
-  out->SetT(out->GetT());
+  out->SetAlpha(ref->GetAlpha());
+  out->SetT(ref->GetT());
   out->SetActivateSector(ref->GetActivateSector());
 }
 
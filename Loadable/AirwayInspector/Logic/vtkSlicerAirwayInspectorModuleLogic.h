@@ -7,15 +7,20 @@
 
 #include <vtkNew.h>
 #include <vtkObjectFactory.h>
+#include <vtkSmartPointer.h>
 
 // STD includes
+#include <functional>
 #include <string>
+#include <vector>
 
 class vtkRenderWindowInteractor;
 class vtkEllipseFitting;
 class vtkMRMLAirwayNode;
 class vtkComputeAirwayWall;
 class vtkImageResliceWithPlane;
+class vtkDoubleArray;
+class vtkImageData;
 
 /// \ingroup Slicer_QtModules_AirwayInspector
 class VTK_SLICER_AIRWAYINSPECTOR_MODULE_LOGIC_EXPORT vtkSlicerAirwayInspectorModuleLogic
@@ -36,6 +41,38 @@ public:
 
   void ComputeAirwayWall(vtkImageData* slice, vtkMRMLAirwayNode *node, int method);
 
+  /// Airway wall metrics of one airway computed with one method
+  struct AirwayWallResult
+  {
+    int Method;
+    vtkSmartPointer<vtkDoubleArray> Mean;
+    vtkSmartPointer<vtkDoubleArray> Std;
+    vtkSmartPointer<vtkDoubleArray> Min;
+    vtkSmartPointer<vtkDoubleArray> Max;
+    vtkSmartPointer<vtkEllipseFitting> EllipseInside;
+    vtkSmartPointer<vtkEllipseFitting> EllipseOutside;
+    double Ellipse[6];
+  };
+
+  /// Called after the results of one airway have been stored in the airway node
+  /// (airway node, number of airways analyzed, total number of airways)
+  typedef std::function<void(vtkMRMLAirwayNode*, int, int)> AirwayAnalyzedCallback;
+
+  /// Compute the airway wall of a list of airways in parallel (one airway per
+  /// thread at a time, each thread with its own solvers).
+  /// If allMethods is true all the methods are computed (the method of the
+  /// node is computed the last one), otherwise just the method of the node.
+  /// Every (airway, method) is computed only once. The results are stored in
+  /// the nodes and the callback is invoked in the calling thread as soon as
+  /// every airway is finished.
+  void AnalyzeAirways(const std::vector<vtkMRMLAirwayNode*>& nodes, bool allMethods,
+                      AirwayAnalyzedCallback callback = AirwayAnalyzedCallback());
+
+  /// Number of threads used by AnalyzeAirways. 0 (default) means the number
+  /// of cores, and 1 computes the airways serially in the calling thread
+  vtkSetMacro(NumberOfThreads, int);
+  vtkGetMacro(NumberOfThreads, int);
+
   void  AddEllipsesToImage(vtkImageData *sliceRGBImage,
                            vtkMRMLAirwayNode *node,
                            vtkImageData *rgbImage);
@@ -54,6 +91,18 @@ protected:
   void SetWallSolver(vtkComputeAirwayWall *ref,
                      vtkComputeAirwayWall *out);
 
+  /// Compute the airway wall of a slice. It doesn't access the scene or the
+  /// airway node, so it can run in any thread as long as every thread uses
+  /// its own solvers
+  void ComputeAirwayWallResult(vtkImageData* slice, int method, double threshold,
+                               int reconstruction, double resolution,
+                               vtkComputeAirwayWall *wallSolver,
+                               vtkComputeAirwayWall *selfTuneSolver,
+                               AirwayWallResult &result);
+
+  /// Store the result in the airway node (main thread only)
+  void ApplyAirwayWallResult(vtkMRMLAirwayNode *node, AirwayWallResult &result);
+
   virtual ~vtkSlicerAirwayInspectorModuleLogic();
 
 private:
@@ -61,6 +110,8 @@ private:
   double SelfTuneModelSharp[3];
   vtkImageResliceWithPlane *Reslicer;
   vtkComputeAirwayWall     *WallSolver;
+  vtkComputeAirwayWall     *SelfTuneSolver;
+  int NumberOfThreads;
 };
 
 #endif
@@ -48,6 +48,8 @@
 #include "qpainter.h"
 #include "qmainwindow.h"
 #include <QVTKOpenGLNativeWidget.h>
+#include <QApplication>
+#include <QCursor>
 #include <QDebug>
 
 #include "vtkMRMLScene.h"
@@ -519,14 +521,8 @@ void qSlicerAirwayInspectorModuleWidget::analyzeSelected()
     {
     this->updateMRMLFromWidget(airwayNode);
 
-    if (d->ComputeAllMethodsCheckBox->isChecked())
-      {
-      for (int method=0; method < 4; method++)
-        {
-        airwayLogic->ComputeAirwayWall(airwayNode->GetAirwayImage(), airwayNode, method);
-        }
-      }
-    airwayLogic->ComputeAirwayWall(airwayNode->GetAirwayImage(), airwayNode, airwayNode->GetMethod());
+    std::vector<vtkMRMLAirwayNode*> airwayNodes(1, airwayNode);
+    airwayLogic->AnalyzeAirways(airwayNodes, d->ComputeAllMethodsCheckBox->isChecked());
     }
 
   this->updateReport(airwayNode);
@@ -552,36 +548,36 @@ void qSlicerAirwayInspectorModuleWidget::analyzeAll()
   std::vector<vtkMRMLNode *> nodes;
   this->mrmlScene()->GetNodesByClass("vtkMRMLAirwayNode", nodes);
 
+  std::vector<vtkMRMLAirwayNode*> airwayNodes;
   for (size_t i=0; i<nodes.size(); i++)
     {
     vtkMRMLAirwayNode* airwayNode = vtkMRMLAirwayNode::SafeDownCast(nodes[i]);
-
     this->updateMRMLFromWidget(airwayNode);
+    airwayNodes.push_back(airwayNode);
+    }
 
-    if (d->ComputeAllMethodsCheckBox->isChecked())
-      {
-      for (int method=0; method < 4; method++)
-        {
-        airwayLogic->ComputeAirwayWall(airwayNode->GetAirwayImage(), airwayNode, method);
-        }
-      }
-
-    airwayLogic->ComputeAirwayWall(airwayNode->GetAirwayImage(), airwayNode, airwayNode->GetMethod());
+  vtkMRMLAirwayNode* currentAirwayNode = vtkMRMLAirwayNode::SafeDownCast(
+    d->AirwayComboBox->currentNode());
+  bool writeAirways = d->WriteAirwaysCheckBox->isChecked();
 
-    if (d->WriteAirwaysCheckBox->isChecked())
+  // The airways are analyzed in parallel. The results are reported as soon as
+  // every airway is finished
+  QApplication::setOverrideCursor(QCursor(Qt::BusyCursor));
+  airwayLogic->AnalyzeAirways(airwayNodes, d->ComputeAllMethodsCheckBox->isChecked(),
+    [&](vtkMRMLAirwayNode* airwayNode, int, int)
+    {
+    if (writeAirways)
       {
       this->saveAirwayImage(airwayNode);
       }
-    }
-
-  vtkMRMLAirwayNode* airwayNode = vtkMRMLAirwayNode::SafeDownCast(
-    d->AirwayComboBox->currentNode());
-
-  airwayLogic->ComputeAirwayWall(airwayNode->GetAirwayImage(), airwayNode, airwayNode->GetMethod());
-
-  this->updateReport(airwayNode);
-
-  this->updateViewer(airwayNode);
+    if (airwayNode == currentAirwayNode)
+      {
+      this->updateReport(airwayNode);
+      this->updateViewer(airwayNode);
+      }
+    QCoreApplication::processEvents(QEventLoop::ExcludeUserInputEvents);
+    });
+  QApplication::restoreOverrideCursor();
 }
 
 //-----------------------------------------------------------------------------
@@ -24,6 +24,7 @@
 #include <vtkMRMLParticlesNode.h>
 #include <vtkMRMLParticlesDisplayNode.h>
 #include <vtkMRMLModelStorageNode.h>
+#include <vtkMRMLCameraNode.h>
 #include <vtkMRMLScene.h>
 
 // VTK includes
@@ -31,6 +32,9 @@
 #include <vtkNew.h>
 #include <vtkImageData.h>
 #include <vtkImageThreshold.h>
+#include <vtkIntArray.h>
+#include <vtkPolyData.h>
+#include <vtkMath.h>
 #include <vtkSmartPointer.h>
 #include <vtkWeakPointer.h>
 
@@ -38,8 +42,12 @@
 #include <itksys/SystemTools.hxx>
 #include <itksys/Directory.hxx>
 
+#include <algorithm>
 #include <cassert>
+#include <cmath>
 #include <iostream>
+#include <limits>
+#include <vector>
 
 //----------------------------------------------------------------------------
 class vtkSlicerParticlesDisplayLogic::vtkInternal
@@ -100,18 +108,107 @@ void vtkSlicerParticlesDisplayLogic::RegisterNodes()
 void vtkSlicerParticlesDisplayLogic::UpdateFromMRMLScene()
 {
   assert(this->GetMRMLScene() != 0);
+
+  std::vector<vtkMRMLNode*> cameraNodes;
+  this->GetMRMLScene()->GetNodesByClass("vtkMRMLCameraNode", cameraNodes);
+  for (size_t i = 0; i < cameraNodes.size(); i++)
+    {
+    this->ObserveCameraNode(cameraNodes[i]);
+    }
+  this->UpdateLevelOfDetail();
 }
 
 //---------------------------------------------------------------------------
 void vtkSlicerParticlesDisplayLogic
-::OnMRMLSceneNodeAdded(vtkMRMLNode* vtkNotUsed(node))
+::OnMRMLSceneNodeAdded(vtkMRMLNode* node)
 {
+  if (vtkMRMLCameraNode::SafeDownCast(node))
+    {
+    this->ObserveCameraNode(node);
+    }
+  else if (vtkMRMLParticlesDisplayNode::SafeDownCast(node))
+    {
+    this->UpdateLevelOfDetail();
+    }
 }
 
 //---------------------------------------------------------------------------
 void vtkSlicerParticlesDisplayLogic
-::OnMRMLSceneNodeRemoved(vtkMRMLNode* vtkNotUsed(node))
+::OnMRMLSceneNodeRemoved(vtkMRMLNode* node)
+{
+  if (vtkMRMLCameraNode::SafeDownCast(node))
+    {
+    this->GetMRMLNodesObserverManager()->RemoveObjectEvents(node);
+    }
+}
+
+//---------------------------------------------------------------------------
+void vtkSlicerParticlesDisplayLogic::ObserveCameraNode(vtkMRMLNode* node)
+{
+  vtkNew<vtkIntArray> events;
+  events->InsertNextValue(vtkCommand::ModifiedEvent);
+  this->GetMRMLNodesObserverManager()->AddObjectEvents(node, events.GetPointer());
+}
+
+//---------------------------------------------------------------------------
+void vtkSlicerParticlesDisplayLogic::ProcessMRMLNodesEvents(vtkObject* caller,
+                                                            unsigned long event,
+                                                            void* callData)
 {
+  if (vtkMRMLCameraNode::SafeDownCast(caller) && event == vtkCommand::ModifiedEvent)
+    {
+    // Rotations don't change the distance, so the glyphs are only recomputed when zooming
+    this->UpdateLevelOfDetail();
+    return;
+    }
+  this->Superclass::ProcessMRMLNodesEvents(caller, event, callData);
+}
+
+//---------------------------------------------------------------------------
+void vtkSlicerParticlesDisplayLogic::UpdateLevelOfDetail()
+{
+  vtkMRMLScene* scene = this->GetMRMLScene();
+  if (!scene || scene->IsBatchProcessing())
+    {
+    return;
+    }
+
+  std::vector<vtkMRMLNode*> cameraNodes;
+  scene->GetNodesByClass("vtkMRMLCameraNode", cameraNodes);
+  std::vector<vtkMRMLNode*> displayNodes;
+  scene->GetNodesByClass("vtkMRMLParticlesDisplayNode", displayNodes);
+  if (cameraNodes.empty())
+    {
+    return;
+    }
+
+  for (size_t i = 0; i < displayNodes.size(); i++)
+    {
+    vtkMRMLParticlesDisplayNode* displayNode = vtkMRMLParticlesDisplayNode::SafeDownCast(displayNodes[i]);
+    vtkPolyData* particles = displayNode ? displayNode->GetInputPolyData() : 0;
+    if (!particles || particles->GetNumberOfPoints() == 0)
+      {
+      continue;
+      }
+    double bounds[6];
+    particles->GetBounds(bounds);
+    double center[3] = {(bounds[0] + bounds[1]) / 2.0,
+                        (bounds[2] + bounds[3]) / 2.0,
+                        (bounds[4] + bounds[5]) / 2.0};
+
+    // The particles are displayed in all the 3D views, use the closest camera
+    double distance = std::numeric_limits<double>::max();
+    for (size_t j = 0; j < cameraNodes.size(); j++)
+      {
+      vtkMRMLCameraNode* cameraNode = vtkMRMLCameraNode::SafeDownCast(cameraNodes[j]);
+      if (cameraNode)
+        {
+        distance = std::min(distance,
+                            sqrt(vtkMath::Distance2BetweenPoints(cameraNode->GetPosition(), center)));
+        }
+      }
+    displayNode->UpdateLevelOfDetail(distance);
+    }
 }
 
 //----------------------------------------------------------------------------
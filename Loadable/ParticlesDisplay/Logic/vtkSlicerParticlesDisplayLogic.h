@@ -54,6 +54,11 @@ public:
   // Also create the logic object for its display.
   vtkMRMLParticlesNode* AddParticlesNode (const char* filename);
 
+  // Description:
+  // Update the level of detail of all the particles display nodes from the
+  // distance to the closest camera.
+  void UpdateLevelOfDetail();
+
 protected:
   vtkSlicerParticlesDisplayLogic();
   virtual ~vtkSlicerParticlesDisplayLogic();
@@ -64,6 +69,10 @@ protected:
   virtual void UpdateFromMRMLScene() override;
   virtual void OnMRMLSceneNodeAdded(vtkMRMLNode* node) override;
   virtual void OnMRMLSceneNodeRemoved(vtkMRMLNode* node) override;
+  virtual void ProcessMRMLNodesEvents(vtkObject* caller, unsigned long event, void* callData) override;
+
+  /// Observe the camera nodes to update the level of detail of the particles
+  void ObserveCameraNode(vtkMRMLNode* node);
 private:
 
   vtkSlicerParticlesDisplayLogic(const vtkSlicerParticlesDisplayLogic&); // Not implemented
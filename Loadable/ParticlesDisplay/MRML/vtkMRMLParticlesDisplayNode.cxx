@@ -18,6 +18,9 @@ Version:   $Revision: 1.2 $
 #include "vtkMRMLParticlesDisplayNode.h"
 
 // VTK includes
+#include <vtkInformation.h>
+#include <vtkInformationVector.h>
+#include <vtkNew.h>
 #include <vtkObjectFactory.h>
 #include <vtkPointData.h>
 #include <vtkGlyph3DWithScaling.h>
@@ -26,14 +29,86 @@ Version:   $Revision: 1.2 $
 #include <vtkAssignAttribute.h>
 #include <vtkTransformPolyDataFilter.h>
 #include <vtkTransform.h>
+#include <vtkPolyData.h>
+#include <vtkPolyDataAlgorithm.h>
+
+#include "vtkParticlesSubsampler.h"
 
 // STD includes
+#include <algorithm>
 #include <cassert>
 #include <math.h>
 #include <vnl/vnl_math.h>
 
 #include <sstream>
 
+namespace
+{
+// Resolution of the glyphs for every level of detail
+const int CylinderResolution[vtkMRMLParticlesDisplayNode::NumberOfLevelsOfDetail] = {20, 12, 8, 6, 4};
+const int SphereThetaResolution[vtkMRMLParticlesDisplayNode::NumberOfLevelsOfDetail] = {16, 10, 8, 6, 4};
+const int SpherePhiResolution[vtkMRMLParticlesDisplayNode::NumberOfLevelsOfDetail] = {8, 6, 4, 4, 3};
+
+// Camera distance (in diagonals of the particles bounding box) where the
+// coarser levels of detail start. The 3D views are reset to ~1.9 diagonals
+// ((diagonal / 2) / sin(15 degrees)), so the default view is displayed in
+// full detail
+const double LevelOfDetailDistance = 2.5;
+
+// Fraction of a level that the camera distance has to go past a threshold
+// before the level changes, so that small zooms around the threshold don't
+// recompute the glyphs again and again
+const double LevelOfDetailHysteresis = 0.2;
+}
+
+//----------------------------------------------------------------------------
+// Output of the display node. The input particles are connected to it, so
+// the glyphs are updated when the particles change, but the glyphs are taken
+// from the cache of the display node when possible
+class vtkParticlesGlyphsFilter : public vtkPolyDataAlgorithm
+{
+public:
+  static vtkParticlesGlyphsFilter *New();
+  vtkTypeMacro(vtkParticlesGlyphsFilter, vtkPolyDataAlgorithm);
+
+  /// Not reference counted (the display node owns the filter)
+  vtkMRMLParticlesDisplayNode* DisplayNode;
+
+protected:
+  vtkParticlesGlyphsFilter()
+    {
+    this->DisplayNode = 0;
+    }
+  ~vtkParticlesGlyphsFilter() override {}
+
+  int FillInputPortInformation(int port, vtkInformation* info) override
+    {
+    this->Superclass::FillInputPortInformation(port, info);
+    info->Set(vtkAlgorithm::INPUT_IS_OPTIONAL(), 1);
+    return 1;
+    }
+
+  int RequestData(vtkInformation* vtkNotUsed(request),
+                  vtkInformationVector** inputVector,
+                  vtkInformationVector* outputVector) override
+    {
+    vtkPolyData* input = vtkPolyData::GetData(inputVector[0]);
+    vtkPolyData* output = vtkPolyData::GetData(outputVector);
+    // No glyphs for an empty set of particles (the glyph pipeline is not run)
+    if (input && this->DisplayNode && input->GetNumberOfPoints() > 0)
+      {
+      output->ShallowCopy(this->DisplayNode->GetGlyphs(input));
+      }
+    return 1;
+    }
+
+private:
+  vtkParticlesGlyphsFilter(const vtkParticlesGlyphsFilter&); // Not implemented
+  void operator=(const vtkParticlesGlyphsFilter&); // Not implemented
+};
+
+vtkStandardNewMacro(vtkParticlesGlyphsFilter);
+
 //----------------------------------------------------------------------------
 vtkMRMLNodeNewMacro(vtkMRMLParticlesDisplayNode);
 
@@ -41,6 +116,9 @@ vtkMRMLNodeNewMacro(vtkMRMLParticlesDisplayNode);
 vtkMRMLParticlesDisplayNode::vtkMRMLParticlesDisplayNode()
 {
   this->ParticleSize = 0.4;
+  this->LevelOfDetail = 0;
+  this->MaximumNumberOfGlyphs = 0;
+  this->GlyphCacheInputTime = 0;
 
   this->AssignScalar = vtkSmartPointer<vtkAssignAttribute>::New();
   this->AssignVector = vtkSmartPointer<vtkAssignAttribute>::New();
@@ -70,10 +148,16 @@ vtkMRMLParticlesDisplayNode::vtkMRMLParticlesDisplayNode()
   this->GlyphType = 0; //cylinder
   this->GlyphSource = this->CylinderSource;
 
+  this->Subsampler = vtkSmartPointer<vtkParticlesSubsampler>::New();
+  this->AssignScalar->SetInputConnection(this->Subsampler->GetOutputPort());
   this->AssignVector->SetInputConnection(this->AssignScalar->GetOutputPort());
   this->Glypher->SetInputConnection(this->AssignVector->GetOutputPort());
   this->Glypher->SetSourceConnection(this->GlyphSource->GetOutputPort());
 
+  // The glyphs are taken from the cache
+  this->GlyphsFilter = vtkSmartPointer<vtkParticlesGlyphsFilter>::New();
+  this->GlyphsFilter->DisplayNode = this;
+
   this->Glypher->ScalingXOff();
   this->Glypher->ScalingYOn();
   this->Glypher->ScalingZOn();
@@ -88,6 +172,7 @@ vtkMRMLParticlesDisplayNode::vtkMRMLParticlesDisplayNode()
 //----------------------------------------------------------------------------
 vtkMRMLParticlesDisplayNode::~vtkMRMLParticlesDisplayNode()
 {
+  this->GlyphsFilter->DisplayNode = 0;
   this->SetParticlesColorBy(0);
 }
 
@@ -100,13 +185,16 @@ void vtkMRMLParticlesDisplayNode::PrintSelf(ostream& os, vtkIndent indent)
   os << indent << "GlyphType:                 " << this->GlyphType << "\n";
   os << indent << "ScaleFactor:               " << this->ScaleFactor << "\n";
   os << indent << "ParticleSize:              " << this->ParticleSize << "\n";
-  os << indent << "ParticlesColorBy:          " << this->ParticlesColorBy << "\n";
+  os << indent << "ParticlesColorBy:          " << (this->ParticlesColorBy ? this->ParticlesColorBy : "(none)") << "\n";
+  os << indent << "LevelOfDetail:             " << this->LevelOfDetail << "\n";
+  os << indent << "MaximumNumberOfGlyphs:     " << this->MaximumNumberOfGlyphs << "\n";
+  os << indent << "GlyphCacheEntries:         " << this->GlyphCache.size() << "\n";
 }
 
 //----------------------------------------------------------------------------
 vtkAlgorithmOutput* vtkMRMLParticlesDisplayNode::GetOutputPolyDataConnection()
 {
-  return this->Glypher->GetOutputPort();
+  return this->GlyphsFilter->GetOutputPort();
 }
 
 //----------------------------------------------------------------------------
@@ -147,6 +235,12 @@ void vtkMRMLParticlesDisplayNode::ReadXMLAttributes(const char** atts)
       ss << attValue;
       ss >> ParticleSize;
       }
+    else if (!strcmp(attName, "maximumNumberOfGlyphs"))
+      {
+      std::stringstream ss;
+      ss << attValue;
+      ss >> MaximumNumberOfGlyphs;
+      }
 
     else if (!strcmp(attName, "particlesColorBy"))
       {
@@ -173,6 +267,8 @@ void vtkMRMLParticlesDisplayNode::WriteXML(ostream& of, int nIndent)
 
   of << indent << " particleSize=\"" << this->ParticleSize << "\"";
 
+  of << indent << " maximumNumberOfGlyphs=\"" << this->MaximumNumberOfGlyphs << "\"";
+
   of << indent << " particlesColorBy=\"" << this->ParticlesColorBy << "\"";
 
   of << " ";
@@ -195,16 +291,109 @@ void vtkMRMLParticlesDisplayNode::Copy(vtkMRMLNode *anode)
     this->SetGlyphType(node->GlyphType);
     this->SetScaleFactor(node->ScaleFactor);
     this->SetParticleSize(node->ParticleSize);
+    this->SetMaximumNumberOfGlyphs(node->MaximumNumberOfGlyphs);
     }
 
   this->EndModify(disabledModify);
 }
 
+//----------------------------------------------------------------------------
+std::string vtkMRMLParticlesDisplayNode::GetGlyphCacheKey()
+{
+  std::stringstream key;
+  key << this->ParticlesType << "|" << this->GlyphType << "|" << this->ScaleFactor << "|"
+      << this->ParticleSize << "|" << (this->ParticlesColorBy ? this->ParticlesColorBy : "") << "|"
+      << this->LevelOfDetail << "|" << this->MaximumNumberOfGlyphs;
+  return key.str();
+}
+
+//----------------------------------------------------------------------------
+void vtkMRMLParticlesDisplayNode::ClearGlyphCache()
+{
+  this->GlyphCache.clear();
+  this->GlyphCacheOrder.clear();
+  this->GlyphCacheInputTime = 0;
+}
+
+//----------------------------------------------------------------------------
+bool vtkMRMLParticlesDisplayNode::UpdateLevelOfDetail(double cameraDistance)
+{
+  vtkPolyData* input = this->GetInputPolyData();
+  if (input == 0 || input->GetNumberOfPoints() == 0)
+    {
+    return false;
+    }
+  double bounds[6];
+  input->GetBounds(bounds);
+  double diagonal = sqrt((bounds[1]-bounds[0])*(bounds[1]-bounds[0]) +
+                         (bounds[3]-bounds[2])*(bounds[3]-bounds[2]) +
+                         (bounds[5]-bounds[4])*(bounds[5]-bounds[4]));
+  if (diagonal <= 0.0)
+    {
+    return false;
+    }
+
+  // One level coarser every time the distance is doubled
+  double continuousLevel = 0.0;
+  double ratio = cameraDistance / (LevelOfDetailDistance * diagonal);
+  if (ratio > 1.0)
+    {
+    continuousLevel = log(ratio) / log(2.0) + 1.0;
+    }
+  int level = static_cast<int>(floor(continuousLevel));
+  if (level > this->LevelOfDetail)
+    {
+    level = static_cast<int>(floor(continuousLevel - LevelOfDetailHysteresis));
+    }
+  else if (level < this->LevelOfDetail)
+    {
+    level = static_cast<int>(floor(continuousLevel + LevelOfDetailHysteresis));
+    }
+  level = std::min(std::max(level, 0), NumberOfLevelsOfDetail - 1);
+  if (level == this->LevelOfDetail)
+    {
+    return false;
+    }
+  this->SetLevelOfDetail(level);
+  this->UpdatePolyDataPipeline();
+  return true;
+}
+
 //----------------------------------------------------------------------------
 void vtkMRMLParticlesDisplayNode::UpdatePolyDataPipeline()
 {
+  // The glyphs are computed (or taken from the cache) when the output is updated
+  this->GlyphsFilter->SetInputConnection(this->GetInputPolyDataConnection());
+  this->GlyphsFilter->Modified();
+  this->SetScalarVisibility(1);
+}
+
+//----------------------------------------------------------------------------
+vtkPolyData* vtkMRMLParticlesDisplayNode::GetGlyphs(vtkPolyData* particles)
+{
+  // The cached glyphs are not valid anymore if the particles changed
+  vtkMTimeType inputTime = particles->GetMTime();
+  if (inputTime != this->GlyphCacheInputTime)
+    {
+    this->ClearGlyphCache();
+    this->GlyphCacheInputTime = inputTime;
+    }
+
+  std::string key = this->GetGlyphCacheKey();
+  std::map<std::string, vtkSmartPointer<vtkPolyData> >::iterator cached = this->GlyphCache.find(key);
+  if (cached != this->GlyphCache.end())
+    {
+    this->GlyphCacheOrder.remove(key);
+    this->GlyphCacheOrder.push_front(key);
+    return cached->second;
+    }
+
+  int level = this->LevelOfDetail;
   this->SphereSource->SetRadius( this->ParticleSize );
+  this->SphereSource->SetThetaResolution( SphereThetaResolution[level] );
+  this->SphereSource->SetPhiResolution( SpherePhiResolution[level] );
   this->CylinderSource->SetHeight( this->ParticleSize);
+  this->CylinderSource->SetResolution( CylinderResolution[level] );
 
   if (this->GetGlyphType() == 0)
     {
@@ -246,10 +435,13 @@ void vtkMRMLParticlesDisplayNode::UpdatePolyDataPipeline()
       vectorName.c_str() ? vtkDataSetAttributes::VECTORS : -1,
       vtkAssignAttribute::POINT_DATA);
 
-  this->AssignScalar->SetInputConnection(this->GetInputPolyDataConnection());
-
-  this->AssignScalar->Update();
-  this->AssignVector->Update();
+  // Spatial subsampling of the particles (half the glyphs in every coarser level).
+  // The glyphs are computed in a separate pipeline that takes a shallow copy of
+  // the particles (this function is invoked while the output is being updated)
+  vtkNew<vtkPolyData> input;
+  input->ShallowCopy(particles);
+  this->Subsampler->SetInputData(input.GetPointer());
+  this->Subsampler->SetMaximumNumberOfParticles(this->MaximumNumberOfGlyphs >> level);
 
   this->Glypher->SetSourceConnection(this->GlyphSource->GetOutputPort());
   this->Glypher->SetColorModeToColorByScalar();
@@ -257,11 +449,18 @@ void vtkMRMLParticlesDisplayNode::UpdatePolyDataPipeline()
   this->Glypher->SetScaleModeToScaleByScalar();
   this->Glypher->SetVectorModeToUseVector();
   this->Glypher->SetScaleFactor(this->GetScaleFactor());
+  this->Glypher->Update();
 
-  if ( colorByName.c_str() )
+  // Store the glyphs in the cache (the least recently used ones are removed)
+  vtkSmartPointer<vtkPolyData> glyphs = vtkSmartPointer<vtkPolyData>::New();
+  glyphs->ShallowCopy(this->Glypher->GetOutput());
+  this->Subsampler->SetInputData(0);
+  this->GlyphCache[key] = glyphs;
+  this->GlyphCacheOrder.push_front(key);
+  while (this->GlyphCacheOrder.size() > GlyphCacheSize)
     {
-    this->SetScalarVisibility(1);
+    this->GlyphCache.erase(this->GlyphCacheOrder.back());
+    this->GlyphCacheOrder.pop_back();
     }
-  //this->Glypher->Modified();
-  this->Glypher->Update();
+  return glyphs;
 }
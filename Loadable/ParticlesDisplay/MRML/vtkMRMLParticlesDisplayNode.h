@@ -22,6 +22,11 @@
 
 #include "cipChestConventions.h"
 
+// STD includes
+#include <list>
+#include <map>
+#include <string>
+
 //class cip::Conventions;
 class vtkGlyph3DWithScaling;
 class vtkCylinderSource;
@@ -30,6 +35,9 @@ class vtkPolyDataAlgorithm;
 class vtkAssignAttribute;
 class vtkTransformPolyDataFilter;
 class vtkTransform;
+class vtkPolyData;
+class vtkParticlesSubsampler;
+class vtkParticlesGlyphsFilter;
 
 /// \brief MRML node for representing a volume display attributes.
 ///
@@ -58,9 +66,23 @@ class VTK_SLICER_PARTICLESDISPLAY_MODULE_MRML_EXPORT vtkMRMLParticlesDisplayNode
   /// Copy the node's attributes to this object.
   virtual void Copy(vtkMRMLNode *node) override;
 
-  /// Update the pipeline based on this node attributes
+  /// Update the pipeline based on this node attributes.
+  /// The glyphs are only recomputed when the combination of attributes and
+  /// level of detail is not in the cache (or the particles changed)
   virtual void UpdatePolyDataPipeline();
 
+  /// Set the level of detail from the distance of the camera to the particles
+  /// (the coarser levels are used when the particles are far from the camera,
+  /// the default view of the 3D views is displayed in full detail).
+  /// Returns true if the level of detail changed
+  bool UpdateLevelOfDetail(double cameraDistance);
+
+  /// Remove all the glyphs in the cache
+  void ClearGlyphCache();
+
+  /// Number of levels of detail (0 is the finest one)
+  static const int NumberOfLevelsOfDetail = 5;
+
   enum
   {
     ParticlesTypeAirway = 0,
@@ -101,6 +123,19 @@ class VTK_SLICER_PARTICLESDISPLAY_MODULE_MRML_EXPORT vtkMRMLParticlesDisplayNode
   vtkGetStringMacro ( ParticlesColorBy );
   vtkSetStringMacro ( ParticlesColorBy );
 
+  /// Description:
+  /// Level of detail of the glyphs (0 finest). Coarser levels use glyphs with
+  /// less polygons and less particles. It is not saved with the scene.
+  vtkGetMacro ( LevelOfDetail, int );
+  vtkSetClampMacro ( LevelOfDetail, int, 0, NumberOfLevelsOfDetail - 1 );
+
+  /// Description:
+  /// Maximum number of glyphs displayed in the finest level of detail (every
+  /// coarser level halves it). The particles are subsampled spatially when
+  /// there are more. 0 (default) means all the particles are displayed.
+  vtkGetMacro ( MaximumNumberOfGlyphs, int );
+  vtkSetMacro ( MaximumNumberOfGlyphs, int );
+
 protected:
 
   vtkMRMLParticlesDisplayNode();
@@ -118,11 +153,21 @@ protected:
     return  type*256 + region;
   };
 
+  /// Key of the current attributes in the glyph cache
+  std::string GetGlyphCacheKey();
+
+  /// Glyphs of the particles for the current attributes (taken from the cache
+  /// when possible). Invoked when the output is updated
+  vtkPolyData* GetGlyphs(vtkPolyData* particles);
+  friend class vtkParticlesGlyphsFilter;
+
   int     ParticlesType;
   char*   ParticlesColorBy;
   int     GlyphType;
   double  ScaleFactor;
   double  ParticleSize;
+  int     LevelOfDetail;
+  int     MaximumNumberOfGlyphs;
 
   vtkSmartPointer<vtkGlyph3DWithScaling>        Glypher;
   vtkSmartPointer<vtkSphereSource>              SphereSource;
@@ -132,6 +177,14 @@ protected:
   vtkSmartPointer<vtkAssignAttribute>           AssignVector;
   vtkSmartPointer<vtkTransformPolyDataFilter>   TransformPolyData;
   vtkSmartPointer<vtkTransform>                 CylinderRotator;
+  vtkSmartPointer<vtkParticlesSubsampler>       Subsampler;
+  vtkSmartPointer<vtkParticlesGlyphsFilter>     GlyphsFilter;
+
+  /// Glyphs already computed (most recently used first)
+  std::map<std::string, vtkSmartPointer<vtkPolyData> > GlyphCache;
+  std::list<std::string>                        GlyphCacheOrder;
+  vtkMTimeType                                  GlyphCacheInputTime;
+  static const size_t                           GlyphCacheSize = 4;
 };
 
 #endif
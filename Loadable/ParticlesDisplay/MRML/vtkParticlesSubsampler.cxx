@@ -0,0 +1,151 @@
+/*=auto=========================================================================
+
+  Portions (c) Copyright 2005 Brigham and Women's Hospital (BWH) All Rights Reserved.
+
+  See COPYRIGHT.txt
+  or http://www.slicer.org/copyright/copyright.txt for details.
+
+  Program:   3D Slicer
+
+=========================================================================auto=*/
+#include "vtkParticlesSubsampler.h"
+
+// VTK includes
+#include <vtkIdList.h>
+#include <vtkInformation.h>
+#include <vtkInformationVector.h>
+#include <vtkNew.h>
+#include <vtkObjectFactory.h>
+#include <vtkPointData.h>
+#include <vtkPoints.h>
+#include <vtkPolyData.h>
+
+// STD includes
+#include <algorithm>
+#include <cmath>
+#include <unordered_set>
+
+//----------------------------------------------------------------------------
+vtkStandardNewMacro(vtkParticlesSubsampler);
+
+//----------------------------------------------------------------------------
+vtkParticlesSubsampler::vtkParticlesSubsampler()
+{
+  this->MaximumNumberOfParticles = 0;
+  this->BinSize = 0.0;
+}
+
+//----------------------------------------------------------------------------
+vtkParticlesSubsampler::~vtkParticlesSubsampler()
+{
+}
+
+//----------------------------------------------------------------------------
+void vtkParticlesSubsampler::PrintSelf(ostream& os, vtkIndent indent)
+{
+  this->Superclass::PrintSelf(os, indent);
+
+  os << indent << "MaximumNumberOfParticles:  " << this->MaximumNumberOfParticles << "\n";
+  os << indent << "BinSize:                   " << this->BinSize << "\n";
+}
+
+//----------------------------------------------------------------------------
+int vtkParticlesSubsampler::RequestData(vtkInformation* vtkNotUsed(request),
+                                        vtkInformationVector** inputVector,
+                                        vtkInformationVector* outputVector)
+{
+  vtkPolyData* input = vtkPolyData::GetData(inputVector[0]);
+  vtkPolyData* output = vtkPolyData::GetData(outputVector);
+
+  this->BinSize = 0.0;
+  vtkIdType numberOfParticles = input->GetNumberOfPoints();
+  if (this->MaximumNumberOfParticles <= 0 || numberOfParticles <= this->MaximumNumberOfParticles)
+    {
+    output->ShallowCopy(input);
+    return 1;
+    }
+
+  double bounds[6];
+  input->GetBounds(bounds);
+  double size[3];
+  double diagonal = 0.0;
+  for (int i = 0; i < 3; i++)
+    {
+    size[i] = bounds[2*i+1] - bounds[2*i];
+    diagonal += size[i] * size[i];
+    }
+  diagonal = sqrt(diagonal);
+  if (diagonal <= 0.0)
+    {
+    output->ShallowCopy(input);
+    return 1;
+    }
+
+  // Initial guess: bins of the same volume filling the bounding box. Particles
+  // lie on curves and surfaces, so the size is usually increased a few times
+  double volume = std::max(size[0], 1e-3 * diagonal) *
+                  std::max(size[1], 1e-3 * diagonal) *
+                  std::max(size[2], 1e-3 * diagonal);
+  double binSize = pow(volume / this->MaximumNumberOfParticles, 1.0 / 3.0);
+
+  vtkNew<vtkIdList> ids;
+  const double growth = pow(2.0, 1.0 / 3.0);
+  for (int iteration = 0; iteration < 64; iteration++)
+    {
+    this->BinParticles(input->GetPoints(), bounds, binSize, ids.GetPointer());
+    if (ids->GetNumberOfIds() <= this->MaximumNumberOfParticles)
+      {
+      break;
+      }
+    binSize *= growth;
+    }
+  this->BinSize = binSize;
+
+  vtkIdType numberOfIds = ids->GetNumberOfIds();
+  vtkNew<vtkPoints> points;
+  points->SetDataType(input->GetPoints()->GetDataType());
+  points->SetNumberOfPoints(numberOfIds);
+  input->GetPoints()->GetPoints(ids.GetPointer(), points.GetPointer());
+  output->SetPoints(points.GetPointer());
+
+  vtkPointData* inPD = input->GetPointData();
+  vtkPointData* outPD = output->GetPointData();
+  outPD->CopyAllocate(inPD, numberOfIds);
+  for (vtkIdType i = 0; i < numberOfIds; i++)
+    {
+    outPD->CopyData(inPD, ids->GetId(i), i);
+    }
+  outPD->Squeeze();
+
+  return 1;
+}
+
+//----------------------------------------------------------------------------
+void vtkParticlesSubsampler::BinParticles(vtkPoints* points, const double bounds[6],
+                                          double binSize, vtkIdList* ids)
+{
+  ids->Reset();
+  vtkIdType dims[3];
+  for (int i = 0; i < 3; i++)
+    {
+    dims[i] = static_cast<vtkIdType>((bounds[2*i+1] - bounds[2*i]) / binSize) + 1;
+    }
+
+  std::unordered_set<long long> occupied;
+  double p[3];
+  for (vtkIdType id = 0; id < points->GetNumberOfPoints(); id++)
+    {
+    points->GetPoint(id, p);
+    long long bin[3];
+    for (int i = 0; i < 3; i++)
+      {
+      bin[i] = std::min(static_cast<long long>((p[i] - bounds[2*i]) / binSize),
+                        static_cast<long long>(dims[i] - 1));
+      }
+    long long key = (bin[2] * dims[1] + bin[1]) * dims[0] + bin[0];
+    if (occupied.insert(key).second)
+      {
+      ids->InsertNextId(id);
+      }
+    }
+}
@@ -0,0 +1,58 @@
+/*=auto=========================================================================
+
+  Portions (c) Copyright 2005 Brigham and Women's Hospital (BWH) All Rights Reserved.
+
+  See COPYRIGHT.txt
+  or http://www.slicer.org/copyright/copyright.txt for details.
+
+  Program:   3D Slicer
+
+=========================================================================auto=*/
+
+#ifndef __vtkParticlesSubsampler_h
+#define __vtkParticlesSubsampler_h
+
+#include "vtkPolyDataAlgorithm.h"
+#include "vtkSlicerParticlesDisplayModuleMRMLExport.h"
+
+/// \brief Spatially uniform subsampling of a particles set.
+///
+/// The particles are binned in a regular grid and only the first particle
+/// of every bin is kept. The size of the bins is increased until the number
+/// of particles is not greater than MaximumNumberOfParticles, so dense regions
+/// are thinned while isolated particles (small airways, distal vessels) are
+/// preserved. The point data of the kept particles is copied to the output.
+class VTK_SLICER_PARTICLESDISPLAY_MODULE_MRML_EXPORT vtkParticlesSubsampler : public vtkPolyDataAlgorithm
+{
+public:
+  static vtkParticlesSubsampler *New();
+  vtkTypeMacro(vtkParticlesSubsampler, vtkPolyDataAlgorithm);
+  void PrintSelf(ostream& os, vtkIndent indent) override;
+
+  /// Description:
+  /// Maximum number of particles in the output. 0 means no subsampling.
+  vtkSetMacro(MaximumNumberOfParticles, vtkIdType);
+  vtkGetMacro(MaximumNumberOfParticles, vtkIdType);
+
+  /// Description:
+  /// Size of the bins used in the last execution (0 if no subsampling was needed).
+  vtkGetMacro(BinSize, double);
+
+protected:
+  vtkParticlesSubsampler();
+  ~vtkParticlesSubsampler() override;
+
+  int RequestData(vtkInformation*, vtkInformationVector**, vtkInformationVector*) override;
+
+  /// Ids of the first particle of every bin
+  void BinParticles(vtkPoints* points, const double bounds[6], double binSize, vtkIdList* ids);
+
+  vtkIdType MaximumNumberOfParticles;
+  double    BinSize;
+
+private:
+  vtkParticlesSubsampler(const vtkParticlesSubsampler&); // Not implemented
+  void operator=(const vtkParticlesSubsampler&); // Not implemented
+};
+
+#endif
@@ -0,0 +1,142 @@
+""" Benchmark of the import (startup) time of the CIP packages and scripted modules.
+
+Every module is imported in a brand new process (so that nothing is cached between measures) and the measure is
+repeated several times. The median time and the number of new modules loaded by the import are reported.
+
+Example of use (plain python, only for the modules that don't need Slicer):
+python import_benchmark.py CIP.logic CIP.logic.geometry_topology_data
+
+Example of use (all the CIP modules, inside Slicer):
+python import_benchmark.py --slicer /path/to/Slicer --all --repeat 5 --output /tmp/cip_import_times.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Line used to find the results in the output of the child process (Slicer prints a lot of other stuff)
+RESULT_TAG = "CIP_IMPORT_BENCHMARK"
+
+DEFAULT_MODULES = [
+    "CIP.logic",
+    "CIP.ui",
+    "CIP.logic.Util",
+    "CIP.logic.SlicerUtil",
+    "CIP.logic.geometry_topology_data",
+    "CIP.logic.timer",
+    "CIP.ui.CaseReportsWidget",
+    "CIP.ui.PreProcessingWidget",
+    "CIP.ui.MIPViewerWidget",
+    "CIP.ui.PdfReporter",
+]
+
+CHILD_CODE = """
+import sys, time, json
+sys.path[0:0] = {paths!r}
+previous = set(sys.modules)
+t = time.time()
+import {module}
+elapsed = time.time() - t
+print("{tag} " + json.dumps({{"module": "{module}", "time": elapsed, "new_modules": len(set(sys.modules) - previous)}}))
+sys.stdout.flush()
+"""
+
+
+def get_scripted_modules(scripted_dir):
+    """ Get the names of all the CIP scripted modules (folders that contain a python file with the same name)
+    :param scripted_dir: "Scripted" folder of the repository
+    :return: tuple with the list of module names and the list of folders that must be in the python path
+    """
+    modules = []
+    paths = []
+    for name in sorted(os.listdir(scripted_dir)):
+        folder = os.path.join(scripted_dir, name)
+        if name != "CIP_" and os.path.isfile(os.path.join(folder, name + ".py")):
+            modules.append(name)
+            paths.append(folder)
+    return modules, paths
+
+
+def measure_import(module, paths, slicer=None):
+    """ Import a module in a new process and measure the time
+    :param module: full module name
+    :param paths: list of folders that will be added to the python path of the child process
+    :param slicer: path to the Slicer executable. If None, the current python interpreter will be used
+    :return: dictionary with "module", "time" (seconds) and "new_modules" (number of modules loaded)
+    """
+    code = CHILD_CODE.format(paths=list(paths), module=module, tag=RESULT_TAG)
+    if slicer:
+        command = [slicer, "--no-splash", "--no-main-window", "--disable-cli-modules",
+                   "--python-code", code + "\nslicer.app.exit(0)\n"]
+    else:
+        command = [sys.executable, "-c", code]
+    p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = p.communicate()
+    for line in out.decode("utf-8", "replace").splitlines():
+        if line.startswith(RESULT_TAG):
+            return json.loads(line[len(RESULT_TAG):])
+    raise RuntimeError("The module {} could not be imported:\n{}".format(module, err.decode("utf-8", "replace")))
+
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    if n % 2 == 1:
+        return values[n // 2]
+    return (values[n // 2 - 1] + values[n // 2]) / 2.0
+
+
+def run_benchmark(modules, paths, repeat=3, slicer=None):
+    """ Measure the import time of a list of modules
+    :param modules: list of full module names
+    :param paths: list of folders that will be added to the python path of the child processes
+    :param repeat: number of measures for each module
+    :param slicer: path to the Slicer executable (optional)
+    :return: list of dictionaries with "module", "median_time", "min_time", "new_modules" and "error" (if any)
+    """
+    results = []
+    for module in modules:
+        try:
+            measures = [measure_import(module, paths, slicer) for _ in range(repeat)]
+            times = [m["time"] for m in measures]
+            results.append({"module": module, "median_time": median(times), "min_time": min(times),
+                            "new_modules": measures[-1]["new_modules"], "error": None})
+        except RuntimeError as ex:
+            results.append({"module": module, "median_time": None, "min_time": None, "new_modules": None,
+                            "error": str(ex)})
+    return results
+
+
+def print_results(results):
+    print("{:<45} {:>12} {:>12} {:>12}".format("Module", "Median (ms)", "Min (ms)", "New modules"))
+    for r in results:
+        if r["error"]:
+            print("{:<45} {:>12}".format(r["module"], "ERROR"))
+        else:
+            print("{:<45} {:>12.1f} {:>12.1f} {:>12}".format(r["module"], r["median_time"] * 1000,
+                                                            r["min_time"] * 1000, r["new_modules"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the import time of the CIP modules")
+    parser.add_argument("modules", nargs="*", help="Modules to import. Default: CIP packages")
+    parser.add_argument("--all", action="store_true", help="Include all the CIP scripted modules")
+    parser.add_argument("--slicer", help="Path to the Slicer executable (needed for the modules that use slicer)")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of measures for each module")
+    parser.add_argument("--output", help="Save the results to this json file")
+    args = parser.parse_args()
+
+    scripted_dir = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "..", ".."))
+    paths = [os.path.join(scripted_dir, "CIP_")]
+    modules = args.modules or list(DEFAULT_MODULES)
+    if args.all:
+        scripted_modules, scripted_paths = get_scripted_modules(scripted_dir)
+        modules.extend(scripted_modules)
+        paths.extend(scripted_paths)
+
+    results = run_benchmark(modules, paths, repeat=args.repeat, slicer=args.slicer)
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
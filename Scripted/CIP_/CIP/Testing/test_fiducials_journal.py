@@ -0,0 +1,110 @@
+import os
+
+from CIP.logic.geometry_topology_data import *
+from CIP.logic.fiducials_journal import FiducialsJournal
+
+
+def __new_point__(g, coordinate):
+    p = Point(2, 5, 1, coordinate, description="Journal test")
+    g.add_point(p)
+    return p
+
+
+def __coordinates__(g):
+    return sorted((p.id, tuple(p.coordinate)) for p in g.points)
+
+
+def test_fiducials_journal_append_replay(tmpdir):
+    """ The points saved in the journal are restored when it is replayed over the xml file
+    """
+    xml_path = str(tmpdir.join("points.xml"))
+    g = GeometryTopologyData()
+    p1 = __new_point__(g, [1.0, 2.0, 3.0])
+    g.to_xml_file(xml_path)
+
+    journal = FiducialsJournal(xml_path)
+    p2 = __new_point__(g, [4.0, 5.0, 6.0])
+    journal.append([p2], [])
+    g.remove_point(p1)
+    journal.append([], [p1])
+    assert journal.numberOfRecords == 2
+    assert FiducialsJournal(xml_path).numberOfRecords == 2
+
+    g2 = GeometryTopologyData.from_xml_file(xml_path)
+    FiducialsJournal(xml_path).replay(g2)
+    assert __coordinates__(g2) == __coordinates__(g)
+    assert g2.seed_id == g.seed_id
+
+
+def test_fiducials_journal_replay_is_idempotent(tmpdir):
+    """ Replaying twice (or over an xml file that already contains the changes) does not duplicate the points
+    """
+    xml_path = str(tmpdir.join("points.xml"))
+    g = GeometryTopologyData()
+    p1 = __new_point__(g, [1.0, 2.0, 3.0])
+    g.to_xml_file(xml_path)
+
+    journal = FiducialsJournal(xml_path)
+    p2 = __new_point__(g, [4.0, 5.0, 6.0])
+    journal.append([p2], [])
+    # Point moved: removed and added again with the same id
+    g.remove_point(p1)
+    p1.coordinate = [7.0, 8.0, 9.0]
+    g.add_point(p1, fill_auto_fields=False)
+    journal.append([p1], [p1])
+
+    g2 = GeometryTopologyData.from_xml_file(xml_path)
+    journal.replay(g2)
+    journal.replay(g2)
+    assert __coordinates__(g2) == __coordinates__(g)
+
+
+def test_fiducials_journal_compact(tmpdir):
+    """ Compacting rewrites the xml file and moves the journal to the history file
+    """
+    xml_path = str(tmpdir.join("points.xml"))
+    g = GeometryTopologyData()
+    __new_point__(g, [1.0, 2.0, 3.0])
+    g.to_xml_file(xml_path)
+
+    journal = FiducialsJournal(xml_path)
+    p2 = __new_point__(g, [4.0, 5.0, 6.0])
+    journal.append([p2], [])
+    journal.compact(g)
+
+    assert journal.numberOfRecords == 0
+    assert not os.path.isfile(journal.journalFilePath)
+    assert not os.path.isfile(xml_path + ".tmp")
+    assert len(FiducialsJournal(xml_path).readRecords()) == 0
+    with open(journal.historyFilePath, "r") as f:
+        assert len(f.readlines()) == 1
+    assert __coordinates__(GeometryTopologyData.from_xml_file(xml_path)) == __coordinates__(g)
+
+
+def test_fiducials_journal_compact_interrupted(tmpdir):
+    """ If the application stops after the xml file was rewritten but before the journal was moved to the history,
+    replaying the journal over the new xml file gives the same points
+    """
+    xml_path = str(tmpdir.join("points.xml"))
+    g = GeometryTopologyData()
+    p1 = __new_point__(g, [1.0, 2.0, 3.0])
+    g.to_xml_file(xml_path)
+
+    journal = FiducialsJournal(xml_path)
+    p2 = __new_point__(g, [4.0, 5.0, 6.0])
+    journal.append([p2], [])
+    g.remove_point(p1)
+    journal.append([], [p1])
+
+    # First step of the compaction only
+    g.to_xml_file(xml_path + ".tmp")
+    os.replace(xml_path + ".tmp", xml_path)
+
+    g2 = GeometryTopologyData.from_xml_file(xml_path)
+    journal = FiducialsJournal(xml_path)
+    assert journal.numberOfRecords == 2
+    journal.replay(g2)
+    assert __coordinates__(g2) == __coordinates__(g)
+
+    journal.compact(g2)
+    assert __coordinates__(GeometryTopologyData.from_xml_file(xml_path)) == __coordinates__(g)
@@ -89,4 +89,71 @@ def test_geometry_topology_data_write_read():
 
     # Make sure that the seed is set to a right value
     g.update_seed()
-    assert g.seed_id == 5, "Seed in the object should be 5, while the current value is {}".format(g.seed_id)
\ No newline at end of file
+    assert g.seed_id == 5, "Seed in the object should be 5, while the current value is {}".format(g.seed_id)
+
+def test_geometry_topology_data_streaming_read():
+    """ Read the sample xml file incrementally and make sure that the lazy iterators return the same structures
+    """
+    g = GeometryTopologyData.from_xml_file(xml_file)
+    assert g.coordinate_system == g.RAS
+    assert len(g.points) == 2 and len(g.bounding_boxes) == 2
+    assert g.seed_id == 5, "Seed in the object should be 5, while the current value is {}".format(g.seed_id)
+
+    # Parsing the file from a string must produce exactly the same object
+    with open(xml_file, 'r+b') as f:
+        xml = f.read()
+    assert GeometryTopologyData.from_xml(xml).to_xml() == g.to_xml()
+
+    points = list(GeometryTopologyData.iter_points_from_xml_file(xml_file))
+    assert [p.id for p in points] == [1, 2]
+    assert [p.coordinate for p in points] == [p.coordinate for p in g.points]
+    structures = list(GeometryTopologyData.iter_structures_from_xml_file(xml_file))
+    assert [s.id for s in structures] == [1, 2, 3, 4]
+
+
+def test_geometry_topology_data_columnar_file(tmpdir):
+    """ Save the sample object in a binary columnar file and read it back
+    """
+    g = GeometryTopologyData.from_xml_file(xml_file)
+    columns = g.get_points_columns()
+    assert columns["coordinate"].shape == (2, 3)
+    assert columns["chest_region"].tolist() == [2, 3]
+    assert columns["description"].tolist() == ["My desc", None]
+
+    file_path = str(tmpdir.join("geometryTopologyData.npz"))
+    g.to_columnar_file(file_path)
+    g2 = GeometryTopologyData.from_columnar_file(file_path)
+    assert g2.to_xml() == g.to_xml()
+    assert g2.seed_id == g.seed_id
+
+
+def test_geometry_topology_data_points_index():
+    """ Filtered and proximity queries over the points, keeping the index updated when points are added/removed
+    """
+    g = GeometryTopologyData.from_xml_file(xml_file)
+    assert [p.id for p in g.find_points(chest_region=3)] == [2]
+    assert [p.id for p in g.find_points_near([2, 3, 3], 1.0)] == [1]
+
+    p3 = Point(2, 5, 1, [2, 3.4, 3])
+    g.add_point(p3)
+    assert [p.id for p in g.find_points(chest_region=2, chest_type=5, feature_type=1)] == [1, p3.id]
+    assert [(p1.id, p2.id) for p1, p2 in g.find_duplicated_points(0.5)] == [(1, p3.id)]
+
+    g.remove_point(p3)
+    assert [p.id for p in g.find_points_near([2, 3, 3], 1.0, chest_type=5)] == [1]
+    assert g.find_duplicated_points(0.5) == []
+
+
+def test_geometry_topology_data_xml_file_round_trip(tmpdir):
+    """ Write the sample object with the chunked writer and read it back
+    """
+    g = GeometryTopologyData.from_xml_file(xml_file)
+    file_path = str(tmpdir.join("geometryTopologyData.xml"))
+    g.to_xml_file(file_path)
+
+    g2 = GeometryTopologyData.from_xml_file(file_path)
+    assert g2.to_xml() == g.to_xml()
+    assert g2.seed_id == g.seed_id
+    with open(file_path, 'rb') as f:
+        assert f.read().decode("utf-8") == "".join(
+            c.decode("utf-8") if isinstance(c, bytes) else c for c in g.iter_xml())
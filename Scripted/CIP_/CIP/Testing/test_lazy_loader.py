@@ -0,0 +1,34 @@
+import os
+import subprocess
+import sys
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+root_dir = os.path.normpath(os.path.join(this_dir, "..", ".."))
+
+
+def __loaded_modules__(statement):
+    """ CIP.logic submodules loaded by a python statement (in a new process, so that nothing is cached)
+    """
+    code = statement + "\nimport sys\nprint(' '.join(sorted(m for m in sys.modules if m.startswith('CIP.logic.'))))"
+    env = dict(os.environ)
+    env["PYTHONPATH"] = root_dir + os.pathsep + env.get("PYTHONPATH", "")
+    output = subprocess.check_output([sys.executable, "-c", code], env=env, cwd=root_dir)
+    return set(output.decode("utf-8").split())
+
+
+def test_lazy_package_undeclared_submodule():
+    """ Importing a submodule loads just that submodule (and its dependencies), not the whole package
+    """
+    loaded = __loaded_modules__("from CIP.logic import lobe_relabelling")
+    assert loaded == {"CIP.logic.lazy_loader", "CIP.logic.lobe_relabelling"}
+    loaded = __loaded_modules__("from CIP.logic import lung_splitter")
+    assert loaded == {"CIP.logic.lazy_loader", "CIP.logic.lung_splitter"}
+    loaded = __loaded_modules__("import CIP.logic.fiducials_journal")
+    assert "CIP.logic.SlicerUtil" not in loaded and "CIP.logic.Util" not in loaded
+
+
+def test_lazy_package_exports():
+    """ Accessing a declared name loads just the submodule that contains it
+    """
+    loaded = __loaded_modules__("from CIP.logic import GeometryTopologyData")
+    assert loaded == {"CIP.logic.lazy_loader", "CIP.logic.geometry_topology_data"}
@@ -0,0 +1,70 @@
+import numpy as np
+
+from CIP.logic.lobe_relabelling import *
+
+# Identity columns geometry: x = i, y = j, z = k
+geometry = (np.array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]), (1.0, 0.0))
+
+
+def __plane__(height, size=10):
+    """ Fiducials of a horizontal fissure at a given height
+    """
+    return FissureSurface([[0, 0, height], [size, 0, height], [0, size, height], [size, size, height]])
+
+
+def __left_lung__(height, shape=(20, 10, 10), chest_type=3):
+    """ Left lung label map (with chest type) where the oblique fissure is the plane z = height
+    """
+    z = np.arange(shape[0])[:, np.newaxis, np.newaxis] * np.ones(shape)
+    regions = np.where(z > height, LEFT_SUPERIOR_LOBE, LEFT_INFERIOR_LOBE)
+    return ((chest_type << 8) | regions).astype(np.uint16)
+
+
+def test_fissure_surface_interpolation():
+    """ The surface goes through the fiducials and reproduces planes exactly
+    """
+    points = np.array([[0, 0, 1], [10, 0, 2], [0, 10, 3], [10, 10, 5], [5, 5, 0]], dtype=float)
+    surface = FissureSurface(points)
+    assert np.allclose(surface.evaluate(points[:, 0], points[:, 1]), points[:, 2])
+
+    plane = FissureSurface([[0, 0, 1], [10, 0, 6], [0, 10, -4], [10, 10, 1]])
+    x, y = np.meshgrid(np.linspace(-5, 15, 7), np.linspace(-5, 15, 7))
+    assert np.allclose(plane.evaluate(x, y, chunkSize=10), 1 + 0.5 * x.ravel() - 0.5 * y.ravel())
+
+
+def test_relabel_between_surfaces():
+    """ Moving the fissure relabels just the voxels between both surfaces and keeps the chest types
+    """
+    labels = __left_lung__(10)
+    relabelled = relabelBetweenSurfaces(labels, geometry, 'LO', __plane__(10), {'LO': __plane__(12.5)})
+    assert labels.dtype == np.uint16
+    assert relabelled == 2 * 10 * 10
+    assert np.array_equal(labels, __left_lung__(12.5))
+    assert np.all(labels >> 8 == 3)
+
+    # Nothing to relabel when the surface does not change
+    assert relabelBetweenSurfaces(labels, geometry, 'LO', __plane__(12.5), {'LO': __plane__(12.5)}) == 0
+
+
+def test_relabel_between_surfaces_right_lung():
+    """ The middle lobe is between the right oblique and the right horizontal fissures
+    """
+    shape = (20, 10, 10)
+    z = np.arange(shape[0])[:, np.newaxis, np.newaxis] * np.ones(shape)
+
+    def right_lung(oblique, horizontal):
+        return np.where(z <= oblique, RIGHT_INFERIOR_LOBE,
+                        np.where(z > horizontal, RIGHT_SUPERIOR_LOBE, RIGHT_MIDDLE_LOBE)).astype(np.uint16)
+
+    labels = right_lung(5, 15)
+    # Voxels of the other lung and the background must not be modified
+    labels[:, :, 0] = 0
+    labels[:, :, 1] = LEFT_INFERIOR_LOBE
+    expected = right_lung(8, 15)
+    expected[:, :, 0] = 0
+    expected[:, :, 1] = LEFT_INFERIOR_LOBE
+
+    surfaces = {'RO': __plane__(8), 'RH': __plane__(15)}
+    relabelled = relabelBetweenSurfaces(labels, geometry, 'RO', __plane__(5), surfaces)
+    assert relabelled == 3 * 10 * 8
+    assert np.array_equal(labels, expected)
@@ -0,0 +1,47 @@
+import numpy as np
+
+from CIP.logic.timer import Profiler
+
+MB = 1024 * 1024
+
+
+def test_profiler_peak_memory_per_span():
+    """ With tracemalloc, the peak memory of every span is measured between its start and its end
+    """
+    profiler = Profiler()
+    profiler.set_trace_memory(True)
+    try:
+        with profiler.span("run"):
+            with profiler.span("big"):
+                a = np.ones(40 * MB // 8)
+                del a
+            with profiler.span("small"):
+                b = np.ones(MB // 8)
+                del b
+    finally:
+        profiler.set_trace_memory(False)
+    stats = dict((s["path"], s) for s in profiler.summary())
+    assert 39 < stats["run/big"]["peak_memory"] < 41
+    assert 0.9 < stats["run/small"]["peak_memory"] < 2
+    assert stats["run"]["peak_memory"] >= stats["run/big"]["peak_memory"]
+
+
+def test_profiler_profile_run():
+    """ Every run starts with no spans. Nested runs are regular spans
+    """
+    profiler = Profiler()
+
+    @profiler.profile_run("inner")
+    def inner():
+        pass
+
+    @profiler.profile_run("outer")
+    def outer():
+        with profiler.span("step"):
+            inner()
+
+    outer()
+    outer()
+    assert [(s["path"], s["count"]) for s in profiler.summary()] == \
+           [("outer", 1), ("outer/step", 1), ("outer/step/inner", 1)]
+    assert "outer/step/inner" in profiler.summary_text()
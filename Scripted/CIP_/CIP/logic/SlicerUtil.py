@@ -7,6 +7,9 @@ Common functions that can be useful in any Slicer module development
 import os
 import os.path as path
 import logging
+import bisect
+import fnmatch
+from collections import OrderedDict
 from __main__ import slicer, vtk, qt
 from . import Util
 
@@ -51,6 +54,9 @@ class SlicerUtil:
     # Preferred window selection order
     preferredWidgetKeysOrder = ("Red", "Yellow", "Green")
 
+    # MRMLNodeIndex of the current scene (see getNodeIndex)
+    __nodeIndex__ = None
+
 
     #######################################
     #### Environment internals
@@ -404,10 +410,7 @@ class SlicerUtil:
         node = slicer.mrmlScene.GetNodeByID(nodeNameOrID)
         if node:
             return node
-        nodes = slicer.util.getNodes(nodeNameOrID)
-        if len(nodes) == 0:
-            return None
-        return nodes[nodeNameOrID]
+        return SlicerUtil.getNodeIndex().getNodeByName(nodeNameOrID)
 
     @staticmethod
     def getNodes(nodeMask):
@@ -417,8 +420,29 @@ class SlicerUtil:
         :param nodeName: str. "Mask" of the node
         :return: nodeMask or None
         """
-        nodes = slicer.util.getNodes(nodeMask)
-        return list(nodes.keys())
+        return list(SlicerUtil.getNodesByPattern(nodeMask).keys())
+
+    @staticmethod
+    def getNodesByPattern(pattern):
+        """
+        Get a dictionary of name: node for all the nodes whose name matches a glob pattern (ex: "MyVolume_fiducials_*").
+        Equivalent to slicer.util.getNodes, but it does not need to iterate over all the nodes in the scene
+        :param pattern: glob pattern
+        :return: OrderedDict of name: node sorted by name
+        """
+        return SlicerUtil.getNodeIndex().getNodesByPattern(pattern)
+
+    @staticmethod
+    def getNodeIndex():
+        """
+        Get the MRMLNodeIndex that keeps the name and class lookup tables of the nodes in the current scene
+        :return: MRMLNodeIndex
+        """
+        if SlicerUtil.__nodeIndex__ is None or SlicerUtil.__nodeIndex__.scene is not slicer.mrmlScene:
+            if SlicerUtil.__nodeIndex__ is not None:
+                SlicerUtil.__nodeIndex__.cleanup()
+            SlicerUtil.__nodeIndex__ = MRMLNodeIndex(slicer.mrmlScene)
+        return SlicerUtil.__nodeIndex__
 
 
     @staticmethod
@@ -469,6 +493,8 @@ class SlicerUtil:
         @param includeSubclasses: include also the subclasses
         @return:
         """
+        if not includeSubclasses:
+            return SlicerUtil.getNodeIndex().getNodesByClass(className)
         l = []
         col = slicer.mrmlScene.GetNodesByClass(className)
         for i in range(col.GetNumberOfItems()):
@@ -649,7 +675,7 @@ class SlicerUtil:
         :param window: size of the window
         :param level: center of the window
         """
-        compNodes = slicer.util.getNodes("vtkMRMLSliceCompositeNode*")
+        compNodes = SlicerUtil.getNodesByPattern("vtkMRMLSliceCompositeNode*")
         for compNode in compNodes.values():
             v = compNode.GetBackgroundVolumeID()
             if v is not None and v != "":
@@ -680,7 +706,7 @@ class SlicerUtil:
         """ Position all the 2D windows in a RAS coordinate, and also centers the windows around
         :param coord: array/list/tuple that contains a RAS coordinate
         """
-        sliceNodes = slicer.util.getNodes('vtkMRMLSliceNode*')
+        sliceNodes = SlicerUtil.getNodesByPattern('vtkMRMLSliceNode*')
         for sliceNode in sliceNodes.values():
             sliceNode.JumpSliceByCentering(coords[0], coords[1], coords[2])
 
@@ -698,7 +724,7 @@ class SlicerUtil:
         Set an active scalar volume in the background
         :param volumeNodeId:
         """
-        compNodes = slicer.util.getNodes("vtkMRMLSliceCompositeNode*")
+        compNodes = SlicerUtil.getNodesByPattern("vtkMRMLSliceCompositeNode*")
         for compNode in compNodes.values():
             compNode.SetBackgroundVolumeID(volumeNodeId)
 
@@ -708,7 +734,7 @@ class SlicerUtil:
         :param volumeNodeId: scalar node or labelmap id
         :param opacity: 0.0-1.0 value
         """
-        compNodes = slicer.util.getNodes("vtkMRMLSliceCompositeNode*")
+        compNodes = SlicerUtil.getNodesByPattern("vtkMRMLSliceCompositeNode*")
         for compNode in compNodes.values():
             compNode.SetForegroundVolumeID(volumeNodeId)
             compNode.SetForegroundOpacity(opacity)
@@ -718,7 +744,7 @@ class SlicerUtil:
         """ Display a labelmap in all the 2D windows with an optional opacity
         :param volumeNodeId: labelmap id
         """
-        compNodes = slicer.util.getNodes("vtkMRMLSliceCompositeNode*")
+        compNodes = SlicerUtil.getNodesByPattern("vtkMRMLSliceCompositeNode*")
         for compNode in compNodes.values():
             compNode.SetLabelVolumeID(labelmapNodeId)
 
@@ -729,7 +755,7 @@ class SlicerUtil:
         @param opacity:
         @return:
         """
-        compNodes = slicer.util.getNodes("vtkMRMLSliceCompositeNode*")
+        compNodes = SlicerUtil.getNodesByPattern("vtkMRMLSliceCompositeNode*")
         for compNode in compNodes.values():
             compNode.SetLabelOpacity(opacity)
 
@@ -963,3 +989,209 @@ class SlicerUtil:
             raise Exception("There is more than one widget that matches the given conditions")
         return results[0]
 
+
+class MRMLNodeIndex(object):
+    """ Lookup tables (name: nodes, class: nodes and a sorted list of names for pattern searches) of all the nodes
+    in a MRML scene.
+    The tables are updated with observers on the scene (nodes added/removed), so that the lookups do not need to
+    iterate over the whole scene. The nodes are not observed, so the names are verified lazily: the names of the
+    nodes added since the last lookup and the names of the nodes found are checked, and all the names are checked
+    again when a lookup does not find anything (ex: a node renamed a while after being added to the scene)
+    """
+    def __init__(self, scene):
+        self.scene = scene
+        self.__nodesByName__ = {}      # name: OrderedDict of id: node
+        self.__nodesByClass__ = {}     # class name: OrderedDict of id: node
+        self.__sortedNames__ = []      # sorted list of the names in __nodesByName__
+        self.__sortedIds__ = []        # sorted list of the ids of the nodes
+        self.__nodes__ = {}            # id: (node, indexed name, class name)
+        self.__addedIds__ = set()      # ids of the nodes added since the last lookup (names not verified yet)
+
+        def onNodeAdded(caller, event, node):
+            self.__addNode__(node)
+        onNodeAdded.CallDataType = vtk.VTK_OBJECT
+
+        def onNodeRemoved(caller, event, node):
+            self.__removeNode__(node)
+        onNodeRemoved.CallDataType = vtk.VTK_OBJECT
+
+        self.__sceneObservers__ = [
+            scene.AddObserver(scene.NodeAddedEvent, onNodeAdded),
+            scene.AddObserver(scene.NodeRemovedEvent, onNodeRemoved),
+            # Resynchronize after operations that may change many nodes at once
+            scene.AddObserver(scene.EndCloseEvent, lambda caller, event: self.rebuild()),
+            scene.AddObserver(scene.EndImportEvent, lambda caller, event: self.rebuild()),
+        ]
+        self.rebuild()
+
+    def rebuild(self):
+        """ Rebuild all the tables iterating over all the nodes in the scene
+        """
+        self.__nodesByName__ = {}
+        self.__nodesByClass__ = {}
+        self.__sortedNames__ = []
+        self.__sortedIds__ = []
+        self.__nodes__ = {}
+        self.__addedIds__ = set()
+        for i in range(self.scene.GetNumberOfNodes()):
+            self.__addNode__(self.scene.GetNthNode(i))
+
+    def cleanup(self):
+        """ Remove all the observers
+        """
+        for tag in self.__sceneObservers__:
+            self.scene.RemoveObserver(tag)
+        self.__sceneObservers__ = []
+
+    def getNodeByName(self, name):
+        """ Get a node given its name (the last one added to the scene if there are several with the same name)
+        :param name: node name
+        :return: node or None
+        """
+        self.__verifyAddedNames__()
+        node = self.__findByName__(name)
+        if node is None and self.__verifyAllNames__():
+            node = self.__findByName__(name)
+        return node
+
+    def getNodesByPattern(self, pattern):
+        """ Get all the nodes whose name or id matches a glob pattern (same criteria as slicer.util.getNodes).
+        Only the names/ids that start with the literal prefix of the pattern are checked
+        :param pattern: glob pattern
+        :return: OrderedDict of name: node sorted by name
+        """
+        self.__verifyAddedNames__()
+        nodes = self.__findByPattern__(pattern)
+        if not nodes and self.__verifyAllNames__():
+            nodes = self.__findByPattern__(pattern)
+        return nodes
+
+    def __findByName__(self, name):
+        nodes = self.__nodesByName__.get(name)
+        if not nodes:
+            return None
+        for nodeId, node in reversed(list(nodes.items())):
+            if node.GetName() == name:
+                return node
+            # The node was renamed
+            self.__updateNodeName__(node)
+        return None
+
+    def __findByPattern__(self, pattern):
+        prefix = pattern
+        for i, c in enumerate(pattern):
+            if c in "*?[":
+                prefix = pattern[:i]
+                break
+        nodes = {}
+        renamed = []
+        for name in list(self.__matchSorted__(self.__sortedNames__, prefix, pattern)):
+            for node in self.__nodesByName__[name].values():
+                if node.GetName() == name:
+                    nodes[name] = node
+                else:
+                    renamed.append(node)
+        for node in renamed:
+            self.__updateNodeName__(node)
+            # The node may have been renamed to another name that matches the pattern
+            name = node.GetName()
+            if name is not None and fnmatch.fnmatchcase(name, pattern):
+                nodes[name] = self.__findByName__(name)
+        for nodeId in self.__matchSorted__(self.__sortedIds__, prefix, pattern):
+            node = self.__nodes__[nodeId][0]
+            if node.GetName() not in nodes:
+                nodes[node.GetName()] = node
+        return OrderedDict((name, nodes[name]) for name in sorted(nodes))
+
+    @staticmethod
+    def __matchSorted__(sortedKeys, prefix, pattern):
+        """ Generator of the keys in a sorted list that start with prefix and match the glob pattern
+        """
+        i = bisect.bisect_left(sortedKeys, prefix)
+        while i < len(sortedKeys) and sortedKeys[i].startswith(prefix):
+            if fnmatch.fnmatchcase(sortedKeys[i], pattern):
+                yield sortedKeys[i]
+            i += 1
+
+    def getNodesByClass(self, className):
+        """ Get all the nodes of a class (subclasses not included)
+        :param className: class name
+        :return: list of nodes in the order they were added to the scene
+        """
+        return list(self.__nodesByClass__.get(className, {}).values())
+
+    def __addNode__(self, node):
+        if node is None or node.GetID() in self.__nodes__:
+            return
+        nodeId = node.GetID()
+        name = node.GetName()
+        className = node.GetClassName()
+        self.__nodes__[nodeId] = (node, name, className)
+        self.__addedIds__.add(nodeId)
+        bisect.insort(self.__sortedIds__, nodeId)
+        self.__nodesByClass__.setdefault(className, OrderedDict())[nodeId] = node
+        self.__indexName__(nodeId, node, name)
+
+    def __removeNode__(self, node):
+        if node is None:
+            return
+        item = self.__nodes__.pop(node.GetID(), None)
+        if item is None:
+            return
+        node, name, className = item
+        self.__addedIds__.discard(node.GetID())
+        del self.__sortedIds__[bisect.bisect_left(self.__sortedIds__, node.GetID())]
+        self.__nodesByClass__[className].pop(node.GetID(), None)
+        self.__unindexName__(node.GetID(), name)
+
+    def __verifyAddedNames__(self):
+        """ Update the names of the nodes added since the last lookup (the nodes are usually renamed just after
+        being added to the scene)
+        """
+        for nodeId in self.__addedIds__:
+            item = self.__nodes__.get(nodeId)
+            if item is not None:
+                self.__updateNodeName__(item[0])
+        self.__addedIds__ = set()
+
+    def __verifyAllNames__(self):
+        """ Update the names of all the nodes
+        :return: True if any node was renamed
+        """
+        renamed = False
+        for node, name, className in list(self.__nodes__.values()):
+            renamed = self.__updateNodeName__(node) or renamed
+        return renamed
+
+    def __updateNodeName__(self, node):
+        """ Index the current name of a node
+        :return: True if the node had been renamed
+        """
+        item = self.__nodes__.get(node.GetID())
+        if item is None:
+            return False
+        name = node.GetName()
+        if name == item[1]:
+            return False
+        self.__unindexName__(node.GetID(), item[1])
+        self.__nodes__[node.GetID()] = (item[0], name, item[2])
+        self.__indexName__(node.GetID(), node, name)
+        return True
+
+    def __indexName__(self, nodeId, node, name):
+        if name is None:
+            return
+        nodes = self.__nodesByName__.get(name)
+        if nodes is None:
+            nodes = self.__nodesByName__[name] = OrderedDict()
+            bisect.insort(self.__sortedNames__, name)
+        nodes[nodeId] = node
+
+    def __unindexName__(self, nodeId, name):
+        nodes = self.__nodesByName__.get(name)
+        if nodes is None:
+            return
+        nodes.pop(nodeId, None)
+        if not nodes:
+            del self.__nodesByName__[name]
+            del self.__sortedNames__[bisect.bisect_left(self.__sortedNames__, name)]
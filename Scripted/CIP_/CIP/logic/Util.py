@@ -7,12 +7,16 @@ import vtk
 import sys
 import traceback
 import numpy as np
-import SimpleITK as sitk
 import subprocess
+from collections import OrderedDict
 
 from . import file_conventions
+from .lazy_loader import lazy_import
 from .geometry_topology_data import *
 
+# SimpleITK is only needed by a few methods and it takes a while to load
+sitk = lazy_import("SimpleITK")
+
 class Util: 
     # Constants
     OK = 0
@@ -20,6 +24,12 @@ class Util:
 
     file_conventions_extensions = file_conventions.file_conventions_extensions
 
+    # Label extents/moments caches (see get_label_extents_from_node, get_label_moments_from_node).
+    # Node id: (key, result) for the LABEL_CACHE_SIZE nodes used most recently
+    LABEL_CACHE_SIZE = 8
+    __label_extents_cache__ = OrderedDict()
+    __label_moments_cache__ = OrderedDict()
+
     ###########
     # GENERAL SYSTEM FUNCTIONS
     @staticmethod
@@ -128,6 +138,29 @@ class Util:
         # origin.reverse()
         # return arr, spacing, origin
 
+    @staticmethod
+    def png_from_numpy_array(image_array):
+        """ Encode a 2D image as PNG in memory (no files involved)
+        :param image_array: uint8 numpy array with shape (rows, cols) or (rows, cols, channels). The first row is the
+            top of the image
+        :return: bytes with the PNG file content
+        """
+        image_array = np.asarray(image_array, dtype=np.uint8)
+        if image_array.ndim == 2:
+            image_array = image_array[:, :, np.newaxis]
+        rows, cols, channels = image_array.shape
+        image = vtk.vtkImageData()
+        image.SetDimensions(cols, rows, 1)
+        # vtk images start in the bottom row
+        flat = np.ascontiguousarray(image_array[::-1]).reshape(rows * cols, channels)
+        scalars = vtk.util.numpy_support.numpy_to_vtk(flat, deep=True, array_type=vtk.VTK_UNSIGNED_CHAR)
+        image.GetPointData().SetScalars(scalars)
+        writer = vtk.vtkPNGWriter()
+        writer.WriteToMemoryOn()
+        writer.SetInputData(image)
+        writer.Write()
+        return vtk.util.numpy_support.vtk_to_numpy(writer.GetResult()).tobytes()
+
     ##################
     # COORDINATE SYSTEMS
     @staticmethod
@@ -288,89 +321,213 @@ class Util:
     #########
     # OTHER FUNCTIONS
     @staticmethod
-    def get_labelmap_slices(npArray):
-        """ Get a dictionary with the slices where all the label data are contained in a numpy array
-        representing a labelmap.
-        The output will be a dictionary of [label_Code: array of slices]
-        :param npArray: numpy array representing the image
-        :return: dictionary of [label_Code: numpy array of slices]
+    def get_label_extents(np_array, slab_size=16):
+        """ Get the extent (slices, bounding box, number of voxels and centroid) of every label in a numpy array
+        representing a labelmap (z, y, x).
+        The array is read just once, slab by slab, accumulating for every label the histogram of its voxels
+        along each one of the axes with "bincount". All the extents are derived from those histograms.
+        :param np_array: numpy array representing the labelmap
+        :param slab_size: number of slices that are processed at once
+        :return: OrderedDict of [label_Code: LabelExtent] sorted by label
+        """
+        shape = np_array.shape
+        histograms = {}     # label: [z histogram, y histogram, x histogram]
+        for z0, slab, labels, indexes, coords in Util.__iterate_label_slabs__(np_array, slab_size):
+            num_labels = len(labels)
+            slab_histograms = [np.bincount(indexes * slab.shape[axis] + coords[axis],
+                                           minlength=num_labels * slab.shape[axis]).reshape(num_labels, -1)
+                               for axis in range(3)]
+            for i, label in enumerate(labels.tolist()):
+                if label not in histograms:
+                    histograms[label] = [np.zeros(n, np.int64) for n in shape]
+                h = histograms[label]
+                h[0][z0:z0 + slab.shape[0]] += slab_histograms[0][i]
+                h[1] += slab_histograms[1][i]
+                h[2] += slab_histograms[2][i]
+
+        result = OrderedDict()
+        for label in sorted(histograms):
+            result[label] = LabelExtent.from_histograms(label, histograms[label])
+        return result
+
+    @staticmethod
+    def get_label_moments(np_array, ijk_to_physical=None, labels=None, slab_size=16):
+        """ Get the zeroth, first and second order moments of every label in a numpy array representing a labelmap
+        (z, y, x), and derive from them the centroid, principal axes and equivalent ellipsoid of each label.
+        All the labels are computed at once, reading the array slab by slab and accumulating the moments with
+        weighted "bincount" operations.
+        :param np_array: numpy array representing the labelmap
+        :param ijk_to_physical: 4x4 matrix (numpy array or list) to convert ijk (x, y, z) coordinates to physical
+            space (ex: IJKToRAS matrix of the node). If None, the physical space will be the ijk space
+        :param labels: list of labels to analyze (default: all of them)
+        :param slab_size: number of slices that are processed at once
+        :return: OrderedDict of [label_Code: LabelMoments] sorted by label
+        """
+        sums = {}   # label: [n, sum(z), sum(y), sum(x), sum(z*z), sum(z*y), sum(z*x), sum(y*y), sum(y*x), sum(x*x)]
+        pairs = [(0, 0), (0, 1), (0, 2), (1, 1), (1, 2), (2, 2)]
+        for z0, slab, slab_labels, indexes, coords in Util.__iterate_label_slabs__(np_array, slab_size):
+            if labels is not None:
+                selected = np.isin(slab_labels, labels)
+                if not selected.any():
+                    continue
+                mask = selected[indexes]
+                indexes = indexes[mask]
+                coords = [c[mask] for c in coords]
+            num_labels = len(slab_labels)
+            coords = [coords[0].astype(np.float64) + z0, coords[1].astype(np.float64), coords[2].astype(np.float64)]
+            slab_sums = [np.bincount(indexes, minlength=num_labels)]
+            slab_sums.extend(np.bincount(indexes, weights=c, minlength=num_labels) for c in coords)
+            slab_sums.extend(np.bincount(indexes, weights=coords[i] * coords[j], minlength=num_labels)
+                             for i, j in pairs)
+            slab_sums = np.array(slab_sums, dtype=np.float64)
+            for i, label in enumerate(slab_labels.tolist()):
+                if slab_sums[0, i] == 0:
+                    continue
+                if label not in sums:
+                    sums[label] = np.zeros(len(slab_sums))
+                sums[label] += slab_sums[:, i]
+
+        result = OrderedDict()
+        for label in sorted(sums):
+            result[label] = LabelMoments.from_sums(label, sums[label], ijk_to_physical)
+        return result
+
+    @staticmethod
+    def get_label_moments_from_node(labelmap_node, labels=None):
+        """ Get the moments of every label in a labelmap node in RAS space (see "get_label_moments").
+        The result for all the labels is cached until the image data or the geometry of the node are modified
+        :param labelmap_node: vtkMRMLLabelMapVolumeNode
+        :param labels: list of labels to return (default: all of them)
+        :return: OrderedDict of [label_Code: LabelMoments] sorted by label
         """
-        # Extract labelmaps
-        return Util.get_labelmap_slices_from_numpy_array(npArray)
-    
+        image_data = labelmap_node.GetImageData()
+        ijk_to_ras = vtk.vtkMatrix4x4()
+        labelmap_node.GetIJKToRASMatrix(ijk_to_ras)
+        matrix = Util.convert_vtk_matrix_to_list(ijk_to_ras)
+        key = (image_data.GetMTime(), image_data.GetPointData().GetScalars().GetMTime(), str(matrix))
+        moments = Util.__get_cached_label_result__(Util.__label_moments_cache__, labelmap_node.GetID(), key)
+        if moments is None:
+            moments = Util.get_label_moments(Util.vtkImageData_numpy_array(image_data), ijk_to_physical=matrix)
+            Util.__cache_label_result__(Util.__label_moments_cache__, labelmap_node.GetID(), key, moments)
+        if labels is None:
+            return moments
+        return OrderedDict((label, moments[label]) for label in labels if label in moments)
+
+    @staticmethod
+    def __iterate_label_slabs__(np_array, slab_size):
+        """ Iterate over the labelled voxels of a labelmap slab by slab
+        :param np_array: numpy array representing the labelmap (z, y, x)
+        :param slab_size: number of slices in every slab
+        :return: generator of (first slice, slab, labels, indexes, coords) tuples, where "labels" is the array of
+            labels in the slab, "indexes" the position in "labels" for every labelled voxel and "coords" the (z, y, x)
+            coordinates of the voxels in the slab
+        """
+        for z0 in range(0, np_array.shape[0], slab_size):
+            slab = np_array[z0:z0 + slab_size]
+            flat = slab.ravel()
+            positions = np.flatnonzero(flat)
+            if len(positions) == 0:
+                continue
+            values = flat[positions]
+            max_value = int(values.max())
+            if values.dtype.kind in "ui" and int(values.min()) > 0 and max_value < 2**20:
+                # Small integer labels. Use a lookup table instead of sorting the values
+                labels = np.flatnonzero(np.bincount(values))
+                lut = np.zeros(max_value + 1, np.intp)
+                lut[labels] = np.arange(len(labels))
+                indexes = lut[values]
+            else:
+                labels, indexes = np.unique(values, return_inverse=True)
+            yield z0, slab, labels, indexes, np.unravel_index(positions, slab.shape)
+
+    @staticmethod
+    def get_label_extents_from_node(labelmap_node):
+        """ Get the extent of every label in a labelmap node (see "get_label_extents").
+        The result is cached until the image data of the node is modified.
+        Note that the image data must be marked as modified after changing its content through a numpy array!
+        :param labelmap_node: vtkMRMLLabelMapVolumeNode
+        :return: OrderedDict of [label_Code: LabelExtent] sorted by label
+        """
+        image_data = labelmap_node.GetImageData()
+        key = (image_data.GetMTime(), image_data.GetPointData().GetScalars().GetMTime())
+        extents = Util.__get_cached_label_result__(Util.__label_extents_cache__, labelmap_node.GetID(), key)
+        if extents is None:
+            extents = Util.get_label_extents(Util.vtkImageData_numpy_array(image_data))
+            Util.__cache_label_result__(Util.__label_extents_cache__, labelmap_node.GetID(), key, extents)
+        return extents
+
+    @staticmethod
+    def __get_cached_label_result__(cache, node_id, key):
+        """ Get a result from a label cache if it was computed for the same key (modification times of the node)
+        :return: cached result or None
+        """
+        cached = cache.get(node_id)
+        if cached is None:
+            return None
+        if cached[0] != key:
+            # Outdated
+            del cache[node_id]
+            return None
+        # Most recently used
+        cache.move_to_end(node_id)
+        return cached[1]
+
+    @staticmethod
+    def __cache_label_result__(cache, node_id, key, result):
+        """ Store a result in a label cache, discarding the least recently used nodes over LABEL_CACHE_SIZE
+        """
+        cache[node_id] = (key, result)
+        cache.move_to_end(node_id)
+        while len(cache) > Util.LABEL_CACHE_SIZE:
+            cache.popitem(last=False)
+
+    @staticmethod
+    def clear_label_caches():
+        """ Release the cached label extents and moments (ex: when the scene is closed)
+        """
+        Util.__label_extents_cache__.clear()
+        Util.__label_moments_cache__.clear()
+
+    @staticmethod
+    def bounding_box_slices(bbox, padding=0, shape=None):
+        """ Numpy slices for a bounding box
+        :param bbox: bounding box (z_min, z_max, y_min, y_max, x_min, x_max). Max values are inclusive
+        :param padding: number of voxels to add at each side (clipped to shape when it is provided)
+        :param shape: shape of the array that is going to be sliced
+        :return: tuple of slices (z, y, x)
+        """
+        result = []
+        for axis in range(3):
+            lower = max(bbox[2 * axis] - padding, 0)
+            upper = bbox[2 * axis + 1] + padding + 1
+            if shape is not None:
+                upper = min(upper, shape[axis])
+            result.append(slice(lower, upper))
+        return tuple(result)
+
     @staticmethod
     def get_labelmap_slices(np_array):
         """ Get a dictionary with the slices where all the label data are contained in a numpy array
         representing a labelmap.
         The output will be a dictionary of [label_Code: array of slices]
-        Method 1: "2 steps" process compressing the array. It works much better when there are few slices with data
         :param np_array: numpy array representing the image
         :return: dictionary of [label_Code: numpy array of slices]
         """
-        #start = time.clock()
-        # Get an array with the slices that contain any data
-        positions = np.where(np_array > 0)
-        slices = np.unique(positions[0])
-         
-        # Build a new array just with the slices that contain data
-        boundArray = np_array[slices,:,:]
-         
-        # Search for all the different label maps
-        labelMaps = np.unique(boundArray)
-         
-        result = {}    
-        for label in (label for label in labelMaps if label>0):
-            # Get the slices that contain the label
-            s = np.where(boundArray == label)
-            # "Translate" to the true slice numbers and store the result
-            result[label] = slices[np.unique(s[0])] 
-        
-    #     end = time.clock()
-    #     print ("get_labelmap_slices_from_numpy_array took {0} seconds".format(end-start))
-         
-        return result
-    
-    @staticmethod 
+        return dict((label, extent.slices) for label, extent in Util.get_label_extents(np_array).items()
+                    if label > 0)
+
+    @staticmethod
     def get_labelmap_slices_2(np_array):
-        """Get a dictionary with the slices where all the label data are contained. The origin is a numpy array.
-        Recall that the array will be read with Z,Y,X coordinates (because of the VTK conversion)
-        Method 2: without compressing the array using projections"""
-        #start = time.clock()     
-        # Search for all the different label maps
-        labelMaps = np.unique(np_array)
-         
-        result = {}    
-        for label in (label for label in labelMaps if label>0):
-            # Get the labelmaps with projections
-            result[label] = Util.get_slices_for_label_from_numpy_array(np_array, label)
-        
-    #     end = time.clock()
-    #     print ("get_labelmap_slices_from_numpy_array (method2) took {0} seconds".format(end-start))
-         
-        return result
-    
-    @staticmethod 
+        """ DEPRECATED. Equivalent to get_labelmap_slices
+        """
+        return Util.get_labelmap_slices(np_array)
+
+    @staticmethod
     def get_labelmap_slices_3(np_array):
-        """Get a dictionary with the slices where all the label data are contained. The origin is a numpy array.
-        Recall that the array will be read with Z,Y,X coordinates (because of the VTK conversion)
-        Method 3: without compressing the array using where (VERY SLOW!)"""
-        #start = time.clock() 
-         
-        # Search for all the different label maps
-        labelMaps = np.unique(np_array)
-         
-        result = {}    
-        for label in (label for label in labelMaps if label>0):
-            # Get the slices that contain the label
-            s = np.where(np_array == label)
-            # "Translate" to the true slice numbers and store the result
-            result[label] = np.unique(s[0]) 
-        
-    #     end = time.clock()
-    #     print ("get_labelmap_slices_from_numpy_array (method2) took {0} seconds".format(end-start))
-         
-        return result
-    
+        """ DEPRECATED. Equivalent to get_labelmap_slices
+        """
+        return Util.get_labelmap_slices(np_array)
+
     @staticmethod 
     def get_slices_for_label_from_numpy_array(np_array, label):
         """Get a numpyArray with the slices where label appears. The origin is a numpy array.
@@ -392,8 +549,15 @@ class Util:
         :param labelId: label id (default = 1)
         :return: numpy array with the coordinates (int format)
         """
-        mean = np.mean(np.where(np_array == labelId), axis=1)
-        return np.asarray(np.round(mean, 0), np.int)
+        if labelId == 0:
+            # Zero voxels are not considered labelled
+            labelId = 1
+            np_array = (np_array == 0).view(np.uint8)
+        moments = Util.get_label_moments(np_array, labels=[labelId])
+        if labelId not in moments:
+            # Keep the behaviour of the mean of an empty array
+            return np.full(np_array.ndim, np.nan)
+        return np.asarray(np.round(moments[labelId].centroid, 0), int)
 
 
     @staticmethod
@@ -420,3 +584,108 @@ class Util:
         else:
             # Linux
             subprocess.call(["xdg-open", filePath])
+
+
+class LabelExtent(object):
+    """ Extent of a label in a labelmap.
+    All the coordinates are in numpy (z, y, x) order, in the ijk space of the labelmap
+    """
+    def __init__(self, label, slices, bbox, count, centroid):
+        """
+        :param label: label code
+        :param slices: numpy array with the slices that contain the label
+        :param bbox: bounding box (z_min, z_max, y_min, y_max, x_min, x_max). Max values are inclusive
+        :param count: number of voxels
+        :param centroid: numpy array (z, y, x) with the mean position of the voxels
+        """
+        self.label = label
+        self.slices = slices
+        self.bbox = bbox
+        self.count = count
+        self.centroid = centroid
+
+    @staticmethod
+    def from_histograms(label, histograms):
+        """ Build the extent from the histograms of the voxels of the label along each one of the axes
+        :param label: label code
+        :param histograms: list of 3 numpy arrays (z, y, x) with the number of voxels at each position of the axis
+        :return: LabelExtent
+        """
+        slices = np.flatnonzero(histograms[0])
+        bbox = []
+        centroid = np.zeros(3)
+        count = int(histograms[0].sum())
+        for axis in range(3):
+            positions = np.flatnonzero(histograms[axis])
+            bbox.extend([int(positions[0]), int(positions[-1])])
+            centroid[axis] = np.dot(histograms[axis], np.arange(len(histograms[axis]))) / float(count)
+        return LabelExtent(label, slices, tuple(bbox), count, centroid)
+
+    def crop_slices(self, padding=0, shape=None):
+        """ Numpy slices that contain the label
+        :param padding: number of voxels to add at each side (clipped to shape when it is provided)
+        :param shape: shape of the array that is going to be sliced
+        :return: tuple of slices (z, y, x)
+        """
+        return Util.bounding_box_slices(self.bbox, padding, shape)
+
+
+class LabelMoments(object):
+    """ Moments of a label in a labelmap.
+    "centroid" and "covariance" are in numpy (z, y, x) order, in the ijk space of the labelmap.
+    The physical properties are in (x, y, z) order
+    """
+    def __init__(self, label, count, centroid, covariance, physical_centroid, physical_covariance):
+        """
+        :param label: label code
+        :param count: number of voxels
+        :param centroid: numpy array (z, y, x)
+        :param covariance: 3x3 numpy array (z, y, x)
+        :param physical_centroid: numpy array (x, y, z) in physical space
+        :param physical_covariance: 3x3 numpy array (x, y, z) in physical space
+        """
+        self.label = label
+        self.count = count
+        self.centroid = centroid
+        self.covariance = covariance
+        self.physical_centroid = physical_centroid
+        self.physical_covariance = physical_covariance
+        # Principal axes (columns) sorted by decreasing variance
+        eigenvalues, eigenvectors = np.linalg.eigh(physical_covariance)
+        order = np.argsort(eigenvalues)[::-1]
+        self.principal_moments = np.maximum(eigenvalues[order], 0)
+        self.principal_axes = eigenvectors[:, order]
+
+    @property
+    def ellipsoid_radii(self):
+        """ Semi-axes (sorted like the principal axes) of the solid ellipsoid that has the same second order
+        moments as the label
+        """
+        return np.sqrt(5 * self.principal_moments)
+
+    @staticmethod
+    def from_sums(label, sums, ijk_to_physical=None):
+        """ Build the moments from the raw sums of the voxel coordinates
+        :param label: label code
+        :param sums: [n, sum(z), sum(y), sum(x), sum(z*z), sum(z*y), sum(z*x), sum(y*y), sum(y*x), sum(x*x)]
+        :param ijk_to_physical: 4x4 ijk (x, y, z) to physical matrix (None for the identity)
+        :return: LabelMoments
+        """
+        n = sums[0]
+        centroid = sums[1:4] / n
+        second = np.array([[sums[4], sums[5], sums[6]],
+                           [sums[5], sums[7], sums[8]],
+                           [sums[6], sums[8], sums[9]]]) / n
+        covariance = second - np.outer(centroid, centroid)
+
+        # Switch to (x, y, z) order and transform to the physical space
+        ijk_centroid = centroid[::-1]
+        ijk_covariance = covariance[::-1, ::-1]
+        if ijk_to_physical is None:
+            physical_centroid = ijk_centroid
+            physical_covariance = ijk_covariance
+        else:
+            m = np.asarray(ijk_to_physical, dtype=np.float64)
+            physical_centroid = m[:3, :3].dot(ijk_centroid) + m[:3, 3]
+            physical_covariance = m[:3, :3].dot(ijk_covariance).dot(m[:3, :3].T)
+        return LabelMoments(label, int(n), centroid, covariance, physical_centroid, physical_covariance)
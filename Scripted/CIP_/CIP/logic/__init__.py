@@ -1,9 +1,36 @@
-from .Util import *
-from .SlicerUtil import *
-from .geometry_topology_data import *
-from .EventsTrigger import *
-from . import file_conventions
+# The submodules are loaded on demand (first access to any of their public names) to reduce the startup time
+# of the CIP modules. See lazy_loader.py
+from .lazy_loader import LazyPackage
+
+LazyPackage.install(__name__,
+    exports={
+        "Util": "Util",
+        "LabelExtent": "Util",
+        "LabelMoments": "Util",
+        "SlicerUtil": "SlicerUtil",
+        "MRMLNodeIndex": "SlicerUtil",
+        "GeometryTopologyData": "geometry_topology_data",
+        "PointsIndex": "geometry_topology_data",
+        "Structure": "geometry_topology_data",
+        "Point": "geometry_topology_data",
+        "BoundingBox": "geometry_topology_data",
+        "EventsTrigger": "EventsTrigger",
+        "FiducialsJournal": "fiducials_journal",
+        "CliPipeline": "cli_pipeline",
+        "CliPipelineStage": "cli_pipeline",
+        "Timer": "timer",
+        "GlobalTimer": "timer",
+        "ProfilingSpan": "timer",
+        "Profiler": "timer",
+        "GlobalProfiler": "timer",
+        "FissureSurface": "lobe_relabelling",
+        "VolumePyramid": "volume_pyramid",
+        "SlabProjection": "slab_projection",
+        "SlabProjectionCache": "slab_projection",
+    },
+    submodules=["Util", "SlicerUtil", "geometry_topology_data", "EventsTrigger", "file_conventions", "timer"],
+    extra_submodules=["cli_pipeline", "fiducials_journal", "lobe_relabelling", "lung_splitter", "slab_projection",
+                      "volume_pyramid"]
+)
 #from StructuresParameters import *
 #from Colors import *
-from .timer import *
-
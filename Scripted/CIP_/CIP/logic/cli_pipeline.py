@@ -0,0 +1,255 @@
+""" Asynchronous runner for chains of CLI modules (and small python steps between them).
+
+The CLIs are launched with wait_for_completion=False and the next stage is started from the status observer of the
+CLI node, so Slicer keeps responding while a long pipeline is running and the user can cancel it.
+
+Example of use:
+pipeline = CliPipeline("My pipeline")
+pipeline.addCliStage("Filtering", slicer.modules.medianimagefilter, {"inputVolume": ..., "outputVolume": ...})
+pipeline.addFunctionStage("Prepare label map", prepareLabelMap)
+pipeline.addCliStage("Label map", slicer.modules.generatepartiallunglabelmap, getParametersFunction)
+pipeline.addObservable(pipeline.EVENT_STAGE_PROGRESS, onProgress)
+pipeline.addObservable(pipeline.EVENT_PIPELINE_FINISHED, onFinished)
+pipeline.run()
+...
+pipeline.cancel()
+"""
+import logging
+import time
+from collections import OrderedDict
+
+import qt, slicer
+
+from .EventsTrigger import EventsTrigger
+
+
+class CliPipelineStage(object):
+    def __init__(self, name, cliModule=None, parameters=None, function=None, onCompleted=None):
+        """ Stage of a CliPipeline. It runs a CLI module or a python function
+        :param name: name of the stage (it will be displayed in the progress messages and timings)
+        :param cliModule: CLI module (ex: slicer.modules.segmentlunglobes)
+        :param parameters: dictionary of CLI parameters, or function with no parameters that returns that dictionary.
+                           The function is evaluated when the stage starts, so it can use the results of the
+                           previous stages
+        :param function: python function with no parameters (for non CLI stages)
+        :param onCompleted: optional function that will be invoked with the stage when it is successfully completed
+        """
+        self.name = name
+        self.cliModule = cliModule
+        self.parameters = parameters
+        self.function = function
+        self.onCompleted = onCompleted
+        self.cliNode = None
+        self.progress = 0.0
+        self.elapsedTime = None
+
+    @property
+    def isCli(self):
+        return self.cliModule is not None
+
+    def getParameters(self):
+        """ Get the dictionary of parameters for the CLI module
+        :return: dictionary of parameters
+        """
+        if callable(self.parameters):
+            return self.parameters()
+        return self.parameters if self.parameters is not None else {}
+
+
+class CliPipeline(EventsTrigger):
+    # Events triggered by the pipeline
+    EVENT_STAGE_STARTED = 1     # Params: stage, stage index, number of stages
+    EVENT_STAGE_PROGRESS = 2    # Params: stage, stage progress (0-100), global progress (0-100)
+    EVENT_STAGE_FINISHED = 3    # Params: stage, elapsed time (seconds)
+    EVENT_PIPELINE_FINISHED = 4 # Params: final status, timings (OrderedDict of stage name-seconds)
+
+    # Pipeline status
+    STATUS_IDLE = "Idle"
+    STATUS_RUNNING = "Running"
+    STATUS_COMPLETED = "Completed"
+    STATUS_FAILED = "Failed"
+    STATUS_CANCELLED = "Cancelled"
+
+    def __init__(self, name="CLI pipeline"):
+        EventsTrigger.__init__(self)
+        self.setEvents([self.EVENT_STAGE_STARTED, self.EVENT_STAGE_PROGRESS, self.EVENT_STAGE_FINISHED,
+                        self.EVENT_PIPELINE_FINISHED])
+        self.name = name
+        self.stages = []
+        self.status = self.STATUS_IDLE
+        self.errorMessage = None
+        self.timings = OrderedDict()
+        self.__currentStageIndex__ = -1
+        self.__cancelRequested__ = False
+        self.__stageStartTime__ = None
+        self.__observedNode__ = None
+        self.__observerTag__ = None
+
+    @property
+    def currentStage(self):
+        """ Stage that is currently running (or None) """
+        if 0 <= self.__currentStageIndex__ < len(self.stages):
+            return self.stages[self.__currentStageIndex__]
+        return None
+
+    @property
+    def isRunning(self):
+        return self.status == self.STATUS_RUNNING
+
+    @property
+    def totalTime(self):
+        return sum(self.timings.values())
+
+    def addCliStage(self, name, cliModule, parameters, onCompleted=None):
+        """ Add a stage that runs a CLI module. See CliPipelineStage
+        :return: new stage
+        """
+        stage = CliPipelineStage(name, cliModule=cliModule, parameters=parameters, onCompleted=onCompleted)
+        self.stages.append(stage)
+        return stage
+
+    def addFunctionStage(self, name, function, onCompleted=None):
+        """ Add a stage that runs a (short) python function in the main thread. See CliPipelineStage
+        :return: new stage
+        """
+        stage = CliPipelineStage(name, function=function, onCompleted=onCompleted)
+        self.stages.append(stage)
+        return stage
+
+    def run(self):
+        """ Start the pipeline. The function returns immediately. Use the events to know the progress of the stages
+        """
+        if self.isRunning:
+            raise Exception("The pipeline '{}' is already running".format(self.name))
+        self.status = self.STATUS_RUNNING
+        self.errorMessage = None
+        self.timings.clear()
+        self.__cancelRequested__ = False
+        self.__currentStageIndex__ = -1
+        self.__startNextStage__()
+
+    def cancel(self):
+        """ Cancel the pipeline. The current CLI (if any) will be cancelled and no more stages will be started.
+        EVENT_PIPELINE_FINISHED will be triggered with STATUS_CANCELLED status
+        """
+        if not self.isRunning:
+            return
+        self.__cancelRequested__ = True
+        stage = self.currentStage
+        if stage is not None and stage.cliNode is not None and stage.cliNode.IsBusy():
+            # The pipeline will be finished in the status observer
+            stage.cliNode.Cancel()
+        else:
+            self.__finish__(self.STATUS_CANCELLED)
+
+    def getTimingsSummary(self):
+        """ Get a human readable text with the time spent in every stage
+        :return: string
+        """
+        lines = ["{}: {:.1f} s".format(name, seconds) for name, seconds in self.timings.items()]
+        lines.append("Total: {:.1f} s".format(self.totalTime))
+        return "\n".join(lines)
+
+    def cleanup(self):
+        """ Remove the observers of the pipeline (cancel it first if it's running)
+        """
+        self.cancel()
+        self.__removeCliObserver__()
+        self.removeAllObservables()
+
+    def __startNextStage__(self):
+        if not self.isRunning:
+            return
+        if self.__cancelRequested__:
+            self.__finish__(self.STATUS_CANCELLED)
+            return
+        self.__currentStageIndex__ += 1
+        stage = self.currentStage
+        if stage is None:
+            self.__finish__(self.STATUS_COMPLETED)
+            return
+
+        logging.info("{}: starting stage '{}' ({}/{})".format(self.name, stage.name, self.__currentStageIndex__ + 1,
+                                                             len(self.stages)))
+        stage.progress = 0.0
+        stage.elapsedTime = None
+        self.__stageStartTime__ = time.time()
+        self.triggerEvent(self.EVENT_STAGE_STARTED, stage, self.__currentStageIndex__, len(self.stages))
+        try:
+            if stage.isCli:
+                stage.cliNode = slicer.cli.run(stage.cliModule, None, stage.getParameters(),
+                                               wait_for_completion=False)
+                self.__observedNode__ = stage.cliNode
+                # Status and progress changes modify the node
+                self.__observerTag__ = stage.cliNode.AddObserver("ModifiedEvent", self.__onCliNodeModified__)
+            else:
+                stage.function()
+                self.__completeStage__(stage)
+        except Exception as ex:
+            logging.exception("{}: stage '{}' failed".format(self.name, stage.name))
+            self.errorMessage = "{}: {}".format(stage.name, ex)
+            self.__finish__(self.STATUS_FAILED)
+
+    def __onCliNodeModified__(self, cliNode, event):
+        stage = self.currentStage
+        if stage is None or stage.cliNode is not cliNode:
+            return
+        progress = cliNode.GetProgress()
+        if progress != stage.progress:
+            stage.progress = progress
+            globalProgress = (self.__currentStageIndex__ + progress / 100.0) * 100.0 / len(self.stages)
+            self.triggerEvent(self.EVENT_STAGE_PROGRESS, stage, progress, globalProgress)
+
+        # Compare the status codes, not the display strings (CompletedWithErrors = Completed | ErrorsMask)
+        status = cliNode.GetStatus()
+        if status & cliNode.ErrorsMask:
+            self.__removeCliObserver__()
+            errorText = cliNode.GetErrorText() if hasattr(cliNode, "GetErrorText") else ""
+            self.errorMessage = "{} completed with errors. {}".format(stage.name, errorText).strip()
+            self.__finish__(self.STATUS_FAILED)
+        elif status == cliNode.Completed:
+            self.__removeCliObserver__()
+            # Start the next stage once the CLI node has finished updating the output nodes
+            qt.QTimer.singleShot(0, lambda: self.__completeStage__(stage))
+        elif status == cliNode.Cancelled:
+            self.__removeCliObserver__()
+            self.__finish__(self.STATUS_CANCELLED)
+
+    def __completeStage__(self, stage):
+        if not self.isRunning:
+            # The pipeline was cancelled meanwhile
+            return
+        stage.progress = 100.0
+        stage.elapsedTime = time.time() - self.__stageStartTime__
+        self.timings[stage.name] = stage.elapsedTime
+        logging.info("{}: stage '{}' completed in {:.2f} seconds".format(self.name, stage.name, stage.elapsedTime))
+        try:
+            if stage.onCompleted is not None:
+                stage.onCompleted(stage)
+        except Exception as ex:
+            logging.exception("{}: stage '{}' failed".format(self.name, stage.name))
+            self.errorMessage = "{}: {}".format(stage.name, ex)
+            self.__finish__(self.STATUS_FAILED)
+            return
+        self.triggerEvent(self.EVENT_STAGE_FINISHED, stage, stage.elapsedTime)
+        # Give the UI the chance to refresh between stages
+        qt.QTimer.singleShot(0, self.__startNextStage__)
+
+    def __removeCliObserver__(self):
+        if self.__observedNode__ is not None:
+            self.__observedNode__.RemoveObserver(self.__observerTag__)
+        self.__observedNode__ = None
+        self.__observerTag__ = None
+
+    def __finish__(self, status):
+        if not self.isRunning:
+            return
+        self.__removeCliObserver__()
+        stage = self.currentStage
+        if stage is not None and status != self.STATUS_COMPLETED and stage.name not in self.timings \
+                and self.__stageStartTime__ is not None:
+            # Time spent in the interrupted stage
+            self.timings[stage.name] = time.time() - self.__stageStartTime__
+        self.status = status
+        logging.info("{} finished with status {}.\n{}".format(self.name, status, self.getTimingsSummary()))
+        self.triggerEvent(self.EVENT_PIPELINE_FINISHED, status, self.timings)
@@ -0,0 +1,106 @@
+""" Append-only journal of the changes made to a GeometryTopologyData xml file, so that saving a few points does not
+require rewriting the whole file
+"""
+import os
+import json
+import logging
+
+from . import geometry_topology_data as gtd
+
+
+class FiducialsJournal(object):
+    """ Append-only log of the points added/removed to a GeometryTopologyData xml file since the last time it was
+    written. Every line of the journal is a json record. When the journal is compacted, its content is appended to
+    a history file (so that the full history of the case is kept) and the journal is emptied
+    """
+    JOURNAL_EXTENSION = ".journal"
+    HISTORY_EXTENSION = ".history"
+
+    def __init__(self, xmlFilePath):
+        """
+        :param xmlFilePath: path of the canonical GeometryTopologyData xml file
+        """
+        self.xmlFilePath = xmlFilePath
+        self.journalFilePath = xmlFilePath + self.JOURNAL_EXTENSION
+        self.historyFilePath = xmlFilePath + self.HISTORY_EXTENSION
+        self.numberOfRecords = len(self.readRecords())
+
+    def append(self, addedPoints, removedPoints):
+        """ Append the changes of a save operation to the journal
+        :param addedPoints: list of GeometryTopologyData.Point objects
+        :param removedPoints: list of GeometryTopologyData.Point objects
+        """
+        if not addedPoints and not removedPoints:
+            return
+        timestamp = gtd.GeometryTopologyData.get_timestamp()
+        lines = []
+        for p in removedPoints:
+            lines.append(json.dumps({"op": "remove", "id": p.id, "timestamp": timestamp}))
+        for p in addedPoints:
+            lines.append(json.dumps({"op": "add", "id": p.id, "chest_region": p.chest_region,
+                                     "chest_type": p.chest_type, "feature_type": p.feature_type,
+                                     "coordinate": [float(c) for c in p.coordinate], "description": p.description,
+                                     "timestamp": p.timestamp, "user_name": p.user_name,
+                                     "machine_name": p.machine_name}))
+        with open(self.journalFilePath, "a") as f:
+            f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.numberOfRecords += len(lines)
+
+    def readRecords(self):
+        """ Read all the records in the journal. An incomplete last line (interrupted write) is ignored
+        :return: list of dictionaries
+        """
+        if not os.path.isfile(self.journalFilePath):
+            return []
+        records = []
+        with open(self.journalFilePath, "r") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    logging.warning("Corrupted record in {}: {}".format(self.journalFilePath, line))
+        return records
+
+    def replay(self, geometryTopologyData):
+        """ Apply all the changes in the journal to a GeometryTopologyData object
+        :param geometryTopologyData: GeometryTopologyData object read from the xml file
+        """
+        # The xml file may already contain some of the changes (ex: the application was closed after the xml file was
+        # rewritten but before the journal was moved to the history), so replaying must be idempotent: adding a point
+        # that already exists or removing a point that does not exist are no-ops
+        existingIds = set(p.id for p in geometryTopologyData.points)
+        for record in self.readRecords():
+            if record["op"] == "remove":
+                if record["id"] not in existingIds:
+                    continue
+                for p in [p for p in geometryTopologyData.points if p.id == record["id"]]:
+                    geometryTopologyData.remove_point(p)
+                existingIds.discard(record["id"])
+            elif record["op"] == "add":
+                if record["id"] in existingIds:
+                    continue
+                p = gtd.Point(record["chest_region"], record["chest_type"], record["feature_type"],
+                              record["coordinate"], description=record["description"],
+                              timestamp=record["timestamp"], user_name=record["user_name"],
+                              machine_name=record["machine_name"])
+                p.__id__ = record["id"]
+                geometryTopologyData.add_point(p, fill_auto_fields=False)
+                existingIds.add(record["id"])
+        geometryTopologyData.update_seed()
+
+    def compact(self, geometryTopologyData):
+        """ Write the canonical xml file with the current state of the points and move the journal to the history
+        :param geometryTopologyData: GeometryTopologyData object that contains all the changes in the journal
+        """
+        # Write first to a temp file and replace atomically so that the xml file is never left in an inconsistent state
+        tempFilePath = self.xmlFilePath + ".tmp"
+        geometryTopologyData.to_xml_file(tempFilePath)
+        os.replace(tempFilePath, self.xmlFilePath)
+        if os.path.isfile(self.journalFilePath):
+            with open(self.journalFilePath, "r") as journal:
+                with open(self.historyFilePath, "a") as history:
+                    history.write(journal.read())
+            os.remove(self.journalFilePath)
+        self.numberOfRecords = 0
@@ -9,6 +9,8 @@ Created on Apr 6, 2015
 
 import xml.etree.ElementTree as et
 
+import collections
+import io
 import os
 import platform
 import time
@@ -22,6 +24,11 @@ class GeometryTopologyData(object):
     RAS = 2
     LPS = 3
 
+    # Size of the buffer used to write xml files
+    XML_BUFFER_SIZE = 2**20
+    # Text fields of the structures in the columnar representation
+    COLUMNAR_STRING_FIELDS = ("description", "timestamp", "user_name", "machine_name")
+
     def __init__(self):
         self.coordinate_system = self.UNKNOWN
         self.lps_to_ijk_transformation_matrix = None    # Transformation matrix to go from LPS to IJK (in the shape of a 4x4 list)
@@ -36,6 +43,7 @@ class GeometryTopologyData(object):
 
         self.__seed_id__ = 1    # Seed. The structures added with "add_point", etc. will have an id = seed_id + 1
         self.__print_separator__ = "  "     # Each level of the xml will be "tabulated" this number of spaces
+        self.__points_index__ = None    # PointsIndex over the points (built on demand)
 
     @property
     def seed_id(self):
@@ -74,6 +82,16 @@ class GeometryTopologyData(object):
             self.fill_auto_fields(point)
         if timestamp:
             point.timestamp = timestamp
+        if self.__points_index__ is not None:
+            self.__points_index__.add(point)
+
+    def remove_point(self, point):
+        """ Remove a Point from the structure
+        :param point: Point object
+        """
+        self.points.remove(point)
+        if self.__points_index__ is not None:
+            self.__points_index__.remove(point)
 
     def add_bounding_box(self, bounding_box, fill_auto_fields=True, timestamp=None):
         """ Add a new BoundingBox to the structure
@@ -130,65 +148,73 @@ class GeometryTopologyData(object):
         Returns:
             XML string representation of the object
         """
-        header = '<?xml version="1.0" encoding="UTF-8"?>\r\n'
+        return "".join(self.iter_xml())
 
-        output = header + "<GeometryTopologyData>\r\n"
-
-        output += ("{0}<CoordinateSystem>{1}</CoordinateSystem>\r\n".format(self.__print_separator__,
-                                                          self.__coordinate_system_to_str__(self.coordinate_system)))
+    def iter_xml(self):
+        """
+        Generate the XML representation of this object chunk by chunk (header, one chunk per structure and footer),
+        so that big objects can be written to a stream without building the whole document in memory.
+        The concatenation of all the chunks is exactly the output of "to_xml"
+        Returns:
+            generator of xml strings
+        """
+        yield '<?xml version="1.0" encoding="UTF-8"?>\r\n'
+        yield "<GeometryTopologyData>\r\n"
+        yield "{0}<CoordinateSystem>{1}</CoordinateSystem>\r\n".format(self.__print_separator__,
+                                                          self.__coordinate_system_to_str__(self.coordinate_system))
 
         if self.lps_to_ijk_transformation_matrix is not None:
-            output += self.__write_transformation_matrix__(self.lps_to_ijk_transformation_matrix)
+            yield self.__write_transformation_matrix__(self.lps_to_ijk_transformation_matrix)
 
         if self.spacing is not None:
-            output += "{0}<Spacing>\r\n{1}{0}</Spacing>\r\n".format(self.__print_separator__,
+            yield "{0}<Spacing>\r\n{1}{0}</Spacing>\r\n".format(self.__print_separator__,
                                                                 GeometryTopologyData.to_xml_vector(
                                                                     self.spacing, separator=self.__print_separator__,
                                                                     level=2)
                                                                 )
         if self.origin is not None:
-            output += "{0}<Origin>\r\n{1}{0}</Origin>\r\n".format(self.__print_separator__,
+            yield "{0}<Origin>\r\n{1}{0}</Origin>\r\n".format(self.__print_separator__,
                                                                 GeometryTopologyData.to_xml_vector(
                                                                     self.origin, separator=self.__print_separator__,
                                                                     level=2)
                                                                 )
         if self.dimensions is not None:
-            output += "{0}<Dimensions>\r\n{1}{0}</Dimensions>\r\n".format(self.__print_separator__,
+            yield "{0}<Dimensions>\r\n{1}{0}</Dimensions>\r\n".format(self.__print_separator__,
                                                                 GeometryTopologyData.to_xml_vector(
                                                                     self.dimensions, separator=self.__print_separator__,
                                                                     level=2)
                                                                 )
 
-        # Concatenate points (sort first)
+        # Points (sort first)
         self.points.sort(key=lambda p: p.__id__)
-        points = "".join([i.to_xml() for i in self.points])
-        # Concatenate bounding boxes
-        bounding_boxes = "".join([i.to_xml() for i in self.bounding_boxes])
+        for p in self.points:
+            yield p.to_xml()
+        # Bounding boxes
+        for bb in self.bounding_boxes:
+            yield bb.to_xml()
 
-        # Final result
-        s = output + points + bounding_boxes + "</GeometryTopologyData>\r\n"
-        return s
+        yield "</GeometryTopologyData>\r\n"
 
     def to_xml_file(self, xml_file_path):
         """
-        Save this object to an xml file
+        Save this object to an xml file.
+        The xml is written chunk by chunk through a buffered stream (see "iter_xml")
         Args:
             xml_file_path: file path
-            pretty_print: write the xml in a nice format (requires lxml)
         """
-        s = self.to_xml()
-        with open(xml_file_path, "w+b") as f:
-            f.write(s)
+        with open(xml_file_path, "w+b", self.XML_BUFFER_SIZE) as f:
+            for chunk in self.iter_xml():
+                f.write(chunk if isinstance(chunk, bytes) else chunk.encode("utf-8"))
 
     @staticmethod
     def from_xml_file(xml_file_path):
-        """ Get a GeometryTopologyObject from a file
+        """ Get a GeometryTopologyObject from a file.
+        The file is parsed incrementally, so the whole xml tree is never loaded in memory
         @param xml_file_path: file path
         @return: GeometryTopologyData object
         """
-        with open(xml_file_path, 'r+b') as f:
-            xml = f.read()
-            return GeometryTopologyData.from_xml(xml)
+        with open(xml_file_path, 'rb') as f:
+            return GeometryTopologyData.__from_xml_stream__(f)
 
     @staticmethod
     def from_xml(xml):
@@ -198,51 +224,81 @@ class GeometryTopologyData(object):
         :param xml: xml string
         :return: new GeometryTopologyData object
         """
-        root = et.fromstring(xml)
-        geometry_topology = GeometryTopologyData()
+        if not isinstance(xml, bytes):
+            xml = xml.encode("utf-8")
+        return GeometryTopologyData.__from_xml_stream__(io.BytesIO(xml))
 
-        # NumDimensions. DEPRECATED
-        # node = root.find("NumDimensions")
-        # if node is not None:
-        #     geometry_topology.__num_dimensions__ = int(node.text)
-
-        # Coordinate System
-        node = root.find("CoordinateSystem")
-        if node is not None:
-            geometry_topology.coordinate_system = geometry_topology.__coordinate_system_from_str__(node.text)
-
-        geometry_topology.lps_to_ijk_transformation_matrix = geometry_topology.__read_transformation_matrix__(root)
-
-        node = root.find("Spacing")
-        if node is not None:
-            val = []
-            for node_val in node.findall("value"):
-                val.append(float(node_val.text))
-            geometry_topology.spacing = np.array(val)
-
-        node = root.find("Origin")
-        if node is not None:
-            val = []
-            for node_val in node.findall("value"):
-                val.append(float(node_val.text))
-            geometry_topology.origin = np.array(val)
-
-        node = root.find("Dimensions")
-        if node is not None:
-            val = []
-            for node_val in node.findall("value"):
-                val.append(float(node_val.text))
-            geometry_topology.dimensions = np.array(val)
-
-        # Points
-        for xml_point_node in root.findall("Point"):
-            point = Point.from_xml_node(xml_point_node)
-            geometry_topology.add_point(point, fill_auto_fields=False)
-
-        # BoundingBoxes
-        for xml_bb_node in root.findall("BoundingBox"):
-            bb = BoundingBox.from_xml_node(xml_bb_node)
-            geometry_topology.add_bounding_box(BoundingBox.from_xml_node(xml_bb_node), fill_auto_fields=False)
+    @staticmethod
+    def iter_structures_from_xml_file(xml_file_path):
+        """ Lazily iterate over all the structures (Point and BoundingBox objects) stored in a xml file, without
+        building a GeometryTopologyData object
+        :param xml_file_path: file path
+        :return: generator of Point/BoundingBox objects, in the same order they are stored in the file
+        """
+        with open(xml_file_path, 'rb') as f:
+            for tag, node in GeometryTopologyData.__iterparse__(f):
+                if tag == "Point":
+                    yield Point.from_xml_node(node)
+                elif tag == "BoundingBox":
+                    yield BoundingBox.from_xml_node(node)
+
+    @staticmethod
+    def iter_points_from_xml_file(xml_file_path):
+        """ Lazily iterate over the Point objects stored in a xml file, without building a GeometryTopologyData object
+        :param xml_file_path: file path
+        :return: generator of Point objects
+        """
+        for structure in GeometryTopologyData.iter_structures_from_xml_file(xml_file_path):
+            if isinstance(structure, Point):
+                yield structure
+
+    @staticmethod
+    def __iterparse__(stream):
+        """ Parse incrementally a GeometryTopologyData xml document.
+        Every first level node (CoordinateSystem, Spacing, Point...) is yielded once it has been completely read,
+        and it's released right after, so that the memory used does not depend on the number of structures
+        :param stream: file object (binary)
+        :return: generator of (tag, xml_node) tuples
+        """
+        depth = 0
+        root = None
+        for event, node in et.iterparse(stream, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = node
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 1:
+                yield node.tag, node
+                # Free the node (and any reference to it from the root) once it was consumed
+                node.clear()
+                root.clear()
+
+    @staticmethod
+    def __from_xml_stream__(stream):
+        """ Build a GeometryTopologyData object parsing incrementally a xml stream
+        :param stream: file object (binary)
+        :return: new GeometryTopologyData object
+        """
+        geometry_topology = GeometryTopologyData()
+        for tag, node in GeometryTopologyData.__iterparse__(stream):
+            if tag == "Point":
+                geometry_topology.add_point(Point.from_xml_node(node), fill_auto_fields=False)
+            elif tag == "BoundingBox":
+                geometry_topology.add_bounding_box(BoundingBox.from_xml_node(node), fill_auto_fields=False)
+            elif tag == "CoordinateSystem":
+                geometry_topology.coordinate_system = geometry_topology.__coordinate_system_from_str__(node.text)
+            elif tag == "LPStoIJKTransformationMatrix":
+                geometry_topology.lps_to_ijk_transformation_matrix = \
+                    geometry_topology.__read_transformation_matrix__(node)
+            elif tag == "Spacing":
+                geometry_topology.spacing = GeometryTopologyData.__read_xml_vector__(node)
+            elif tag == "Origin":
+                geometry_topology.origin = GeometryTopologyData.__read_xml_vector__(node)
+            elif tag == "Dimensions":
+                geometry_topology.dimensions = GeometryTopologyData.__read_xml_vector__(node)
+            # NumDimensions. DEPRECATED
 
         # Set the new seed so that every point (or bounding box) added with "add_point" has a bigger id
         geometry_topology.update_seed()
@@ -261,6 +317,42 @@ class GeometryTopologyData(object):
             hash[bb.get_hash()] = bb
         return hash
 
+    @property
+    def points_index(self):
+        """ PointsIndex over the current points (spatial and chest region/type/feature type lookups).
+        The index is built the first time it's requested, and it's kept updated by "add_point" and "remove_point".
+        If the points list or the points coordinates are modified in any other way, call "invalidate_points_index"
+        """
+        if self.__points_index__ is None or len(self.__points_index__) != len(self.points):
+            self.__points_index__ = PointsIndex(self.points)
+        return self.__points_index__
+
+    def invalidate_points_index(self):
+        """ Discard the current points index, so that it's rebuilt the next time it's needed
+        """
+        self.__points_index__ = None
+
+    def find_points(self, chest_region=None, chest_type=None, feature_type=None):
+        """ Get all the points that match the specified chest region/type/feature type (None = any value)
+        :return: list of Point objects sorted by id
+        """
+        return self.points_index.find(chest_region=chest_region, chest_type=chest_type, feature_type=feature_type)
+
+    def find_points_near(self, coordinate, radius, chest_region=None, chest_type=None, feature_type=None):
+        """ Get all the points within a distance of a coordinate (in the object coordinate system units) that
+        match the specified chest region/type/feature type (None = any value)
+        :return: list of Point objects sorted by id
+        """
+        return self.points_index.find_near(coordinate, radius, chest_region=chest_region, chest_type=chest_type,
+                                           feature_type=feature_type)
+
+    def find_duplicated_points(self, tolerance):
+        """ Get all the pairs of points that are closer than a tolerance
+        :param tolerance: maximum distance between two points to be considered duplicated
+        :return: list of (Point, Point) tuples, where the id of the first point is lower than the second one
+        """
+        return self.points_index.find_duplicates(tolerance)
+
     def convert_coordinates_to_array(self, type_=np.float32):
         """
         Convert the coordinates of all the Points/Bounding_Boxes to numpy arrays of the specific type (default: float32)
@@ -286,6 +378,109 @@ class GeometryTopologyData(object):
         return "UNKNOWN"
 
 
+    def get_points_columns(self):
+        """
+        Columnar representation of the points: a dictionary of parallel arrays where the i-th element of every array
+        belongs to the i-th point.
+        :return: dictionary with the keys "id", "coordinate" (Nx3 float array), "chest_region", "chest_type",
+                 "feature_type" (int arrays) and "description", "timestamp", "user_name", "machine_name" (object arrays)
+        """
+        columns = self.__get_structures_columns__(self.points)
+        columns["coordinate"] = self.__coordinates_to_array__([p.coordinate for p in self.points])
+        return columns
+
+    def get_bounding_boxes_columns(self):
+        """
+        Columnar representation of the bounding boxes: a dictionary of parallel arrays where the i-th element of every
+        array belongs to the i-th bounding box.
+        :return: dictionary with the keys "id", "start", "size" (Nx3 float arrays), "chest_region", "chest_type",
+                 "feature_type" (int arrays) and "description", "timestamp", "user_name", "machine_name" (object arrays)
+        """
+        columns = self.__get_structures_columns__(self.bounding_boxes)
+        columns["start"] = self.__coordinates_to_array__([bb.start for bb in self.bounding_boxes])
+        columns["size"] = self.__coordinates_to_array__([bb.size for bb in self.bounding_boxes])
+        return columns
+
+    def add_points_from_columns(self, columns):
+        """
+        Add all the points stored in a columnar representation (see "get_points_columns")
+        :param columns: dictionary of parallel arrays
+        """
+        for i, coordinate in enumerate(columns["coordinate"].tolist()):
+            p = Point(0, 0, 0, coordinate)
+            self.__set_structure_fields_from_columns__(p, columns, i)
+            self.add_point(p, fill_auto_fields=False)
+        self.update_seed()
+
+    def add_bounding_boxes_from_columns(self, columns):
+        """
+        Add all the bounding boxes stored in a columnar representation (see "get_bounding_boxes_columns")
+        :param columns: dictionary of parallel arrays
+        """
+        for i, (start, size) in enumerate(zip(columns["start"].tolist(), columns["size"].tolist())):
+            bb = BoundingBox(0, 0, 0, start, size)
+            self.__set_structure_fields_from_columns__(bb, columns, i)
+            self.bounding_boxes.append(bb)
+        self.update_seed()
+
+    def to_columnar_file(self, file_path):
+        """
+        Save this object to a compressed binary columnar file (numpy npz format), that is much faster to read and
+        write than the xml representation for objects with a big number of structures.
+        The file can be read with "from_columnar_file"
+        :param file_path: file path (npz)
+        """
+        data = {"coordinate_system": np.array(self.coordinate_system)}
+        if self.lps_to_ijk_transformation_matrix is not None:
+            data["lps_to_ijk_transformation_matrix"] = np.array(self.lps_to_ijk_transformation_matrix,
+                                                                dtype=np.float64)
+        for name in ("spacing", "origin", "dimensions"):
+            value = getattr(self, name)
+            if value is not None:
+                data[name] = np.array(value, dtype=np.float64)
+
+        for prefix, columns in (("point_", self.get_points_columns()),
+                                ("bounding_box_", self.get_bounding_boxes_columns())):
+            for key, array in columns.items():
+                if key in self.COLUMNAR_STRING_FIELDS:
+                    # Strings are saved as unicode arrays plus a mask of the missing values, so that no pickling is needed
+                    data[prefix + key] = np.array(["" if v is None else v for v in array], dtype="U")
+                    data[prefix + key + "_missing"] = np.array([v is None for v in array], dtype=bool)
+                else:
+                    data[prefix + key] = array
+
+        # Use a file object so that numpy does not append the "npz" extension to the file path
+        with open(file_path, "wb") as f:
+            np.savez_compressed(f, **data)
+
+    @staticmethod
+    def from_columnar_file(file_path):
+        """
+        Get a GeometryTopologyData object from a binary columnar file generated with "to_columnar_file"
+        :param file_path: file path (npz)
+        :return: GeometryTopologyData object
+        """
+        geometry_topology = GeometryTopologyData()
+        with np.load(file_path) as data:
+            geometry_topology.coordinate_system = int(data["coordinate_system"])
+            if "lps_to_ijk_transformation_matrix" in data:
+                geometry_topology.lps_to_ijk_transformation_matrix = data["lps_to_ijk_transformation_matrix"].tolist()
+            for name in ("spacing", "origin", "dimensions"):
+                if name in data:
+                    setattr(geometry_topology, name, data[name])
+
+            for prefix, add_function in (("point_", geometry_topology.add_points_from_columns),
+                                         ("bounding_box_", geometry_topology.add_bounding_boxes_from_columns)):
+                columns = {}
+                for key in data.files:
+                    if key.startswith(prefix) and not key.endswith("_missing"):
+                        columns[key[len(prefix):]] = data[key]
+                for key in GeometryTopologyData.COLUMNAR_STRING_FIELDS:
+                    missing = data[prefix + key + "_missing"]
+                    columns[key] = [None if m else v for v, m in zip(columns[key].tolist(), missing.tolist())]
+                add_function(columns)
+        return geometry_topology
+
     def export_to_dataframe(self):
         """
         Export this instance info to a Pandas dataframe.
@@ -297,48 +492,84 @@ class GeometryTopologyData(object):
         if len(self.points) > 0 and len(self.bounding_boxes) > 0:
             raise NotImplementedError("This function can be used only for points or bounding boxes. This object contains both")
 
-        columns = ['chest_type_id', 'chest_type_name',
-                   'chest_region_id', 'chest_region_name',
-                   'feature_type_id', 'feature_type_name',
-                   'description', 'timestamp', 'user_name', 'machine_name',
-                   'coordinate_system', 'lps_to_ijk_transformation_matrix',
-                   'spacing', 'origin', 'dimensions'
-                   ]
-
-        if len(self.points) > 0:
-            # Export points
-            columns = ['c1', 'c2', 'c3'] + columns
-            df = pd.DataFrame(columns=columns)
-
-            for s in self.points:
-                df.loc[s.id] = [s.coordinate[0], s.coordinate[1], s.coordinate[2],
-                                s.chest_type, ChestConventions.GetChestTypeName(s.chest_type),
-                                s.chest_region, ChestConventions.GetChestRegionName(s.chest_region),
-                                s.feature_type, ChestConventions.GetImageFeatureName(s.feature_type),
-                                s.description, s.timestamp, s.user_name, s.machine_name,
-                                # Common properties
-                                self.coordinate_system_str(), self.lps_to_ijk_transformation_matrix_array,
-                                self.spacing, self.origin, self.dimensions]
-
-        elif len(self.points) > 0:
+        if len(self.bounding_boxes) > 0:
             # Export bounding boxes
-            columns = ['start1', 'start2', 'start3', 'size1', 'size2', 'size3'] + columns
-            df = pd.DataFrame(columns=columns)
-
-            for s in self.bounding_boxes:
-                df.loc[s.id] = [s.start[0], s.start[1], s.start[2],
-                                s.size[0], s.size[1], s.size[2],
-                                s.chest_type, ChestConventions.GetChestTypeName(s.chest_type),
-                                s.chest_region, ChestConventions.GetChestRegionName(s.chest_region),
-                                s.feature_type, ChestConventions.GetImageFeatureName(s.feature_type),
-                                s.description, s.timestamp, s.user_name, s.machine_name,
-                                # Common properties
-                                self.coordinate_system_str(), self.lps_to_ijk_transformation_matrix_array,
-                                self.spacing, self.origin, self.dimensions]
-
-        df.index.name = 'id'
+            columns = self.get_bounding_boxes_columns()
+            data = [('start1', columns['start'][:, 0]), ('start2', columns['start'][:, 1]),
+                    ('start3', columns['start'][:, 2]),
+                    ('size1', columns['size'][:, 0]), ('size2', columns['size'][:, 1]),
+                    ('size3', columns['size'][:, 2])]
+        else:
+            # Export points
+            columns = self.get_points_columns()
+            data = [('c1', columns['coordinate'][:, 0]), ('c2', columns['coordinate'][:, 1]),
+                    ('c3', columns['coordinate'][:, 2])]
+
+        def names(ids, get_name):
+            # Resolve every different id just once
+            unique_ids, inverse = np.unique(ids, return_inverse=True)
+            return np.array([get_name(int(i)) for i in unique_ids], dtype=object)[inverse]
+
+        n = len(columns['id'])
+        data += [('chest_type_id', columns['chest_type']),
+                 ('chest_type_name', names(columns['chest_type'], ChestConventions.GetChestTypeName)),
+                 ('chest_region_id', columns['chest_region']),
+                 ('chest_region_name', names(columns['chest_region'], ChestConventions.GetChestRegionName)),
+                 ('feature_type_id', columns['feature_type']),
+                 ('feature_type_name', names(columns['feature_type'], ChestConventions.GetImageFeatureName)),
+                 ('description', columns['description']), ('timestamp', columns['timestamp']),
+                 ('user_name', columns['user_name']), ('machine_name', columns['machine_name']),
+                 # Common properties
+                 ('coordinate_system', [self.coordinate_system_str()] * n),
+                 ('lps_to_ijk_transformation_matrix', [self.lps_to_ijk_transformation_matrix_array] * n),
+                 ('spacing', [self.spacing] * n), ('origin', [self.origin] * n), ('dimensions', [self.dimensions] * n)]
+
+        df = pd.DataFrame(collections.OrderedDict(data), index=pd.Index(columns['id'], name='id'))
         return df
 
+    def __get_structures_columns__(self, structures):
+        """
+        Columns shared by all the structures (see "get_points_columns")
+        :param structures: list of Structure objects
+        :return: dictionary of parallel arrays
+        """
+        columns = {
+            "id": np.array([s.__id__ for s in structures], dtype=np.int64),
+            "chest_region": np.array([s.chest_region for s in structures], dtype=np.int64),
+            "chest_type": np.array([s.chest_type for s in structures], dtype=np.int64),
+            "feature_type": np.array([s.feature_type for s in structures], dtype=np.int64),
+        }
+        for key in self.COLUMNAR_STRING_FIELDS:
+            array = np.empty(len(structures), dtype=object)
+            array[:] = [getattr(s, key) for s in structures]
+            columns[key] = array
+        return columns
+
+    def __set_structure_fields_from_columns__(self, structure, columns, index):
+        """
+        Set the common fields of a structure from the i-th element of a columnar representation
+        :param structure: Structure object
+        :param columns: dictionary of parallel arrays
+        :param index: position of the structure in the arrays
+        """
+        structure.__id__ = int(columns["id"][index])
+        structure.chest_region = int(columns["chest_region"][index])
+        structure.chest_type = int(columns["chest_type"][index])
+        structure.feature_type = int(columns["feature_type"][index])
+        for key in self.COLUMNAR_STRING_FIELDS:
+            setattr(structure, key, columns[key][index])
+
+    @staticmethod
+    def __coordinates_to_array__(coordinates):
+        """
+        Stack a list of 3D coordinates in a Nx3 float array
+        :param coordinates: list of coordinates
+        :return: Nx3 numpy array
+        """
+        if len(coordinates) == 0:
+            return np.empty((0, 3), dtype=np.float64)
+        return np.array(coordinates, dtype=np.float64).reshape(len(coordinates), -1)
+
     @classmethod
     def to_xml_vector(cls, array, separator="  ", level=0):
         """ Get the xml representation of a vector of coordinates (<value>elem1</value>, <value>elem2</value>...)
@@ -346,10 +577,8 @@ class GeometryTopologyData(object):
         :param level: number of tabulations that will be inserted
         :return: xml representation of the vector (<value>elem1</value>, <value>elem2</value>...)
         """
-        output = ''
-        for i in array:
-            output = "{0}{1}<value>{2:g}</value>\r\n".format(output, level * separator, i)
-        return output
+        tab = level * separator
+        return "".join(["{0}<value>{1:g}</value>\r\n".format(tab, i) for i in array])
 
     @classmethod
     def __coordinate_system_from_str__(cls, value_str):
@@ -376,15 +605,19 @@ class GeometryTopologyData(object):
         elif value_int == GeometryTopologyData.LPS: return "LPS"
         return "UNKNOWN"
 
-    def __read_transformation_matrix__(self, root_xml):
-        """ Read a 16 elems vector in the xml and return a 4x4 list (or None if node not found)
-        :param root_xml: xml root node
-        :return: 4x4 list or None
+    @classmethod
+    def __read_xml_vector__(cls, node):
+        """ Read a vector of values (<value>elem1</value>, <value>elem2</value>...) from a xml node
+        :param node: xml node that contains the "value" elements
+        :return: numpy array (float)
+        """
+        return np.array([float(node_val.text) for node_val in node.findall("value")])
+
+    def __read_transformation_matrix__(self, node):
+        """ Read a 16 elems vector in the xml and return a 4x4 list
+        :param node: LPStoIJKTransformationMatrix xml node
+        :return: 4x4 list
         """
-        # Try to find the node first
-        node = root_xml.find("LPStoIJKTransformationMatrix")
-        if node is None:
-            return None
         m = []
         temp = []
         for coord in node.findall("value"):
@@ -401,12 +634,167 @@ class GeometryTopologyData(object):
         :return: xml string (LPStoIJKTransformationMatrix complete node)
         """
         # Flatten the list
-        s = ""
-        for item in (item for sublist in matrix for item in sublist):
-            s += ("{0}<value>{1:g}</value>\r\n".format(self.__print_separator__ * 2, item))
+        s = "".join(["{0}<value>{1:g}</value>\r\n".format(self.__print_separator__ * 2, item)
+                     for sublist in matrix for item in sublist])
         return "{0}<LPStoIJKTransformationMatrix>\r\n{1}{0}</LPStoIJKTransformationMatrix>\r\n".format(self.__print_separator__, s)
 
 
+class PointsIndex(object):
+    """ Lookup structure over a collection of Point objects.
+    It maintains a KD-tree over the coordinates and inverted indexes on chest region, chest type and feature type.
+    Points added/removed after the KD-tree was built are kept in a pending buffer (and a removed set) that is
+    searched linearly, and the tree is rebuilt when any of them grows over REBUILD_RATIO of the tree size
+    """
+    REBUILD_RATIO = 0.1
+    MIN_REBUILD_SIZE = 64
+
+    def __init__(self, points=()):
+        """
+        :param points: initial collection of Point objects
+        """
+        self.__points__ = {}    # key: Point (the keys are the id of the objects, so that duplicated points are allowed)
+        self.__regions__ = collections.defaultdict(set)    # chest_region: set of keys
+        self.__types__ = collections.defaultdict(set)      # chest_type: set of keys
+        self.__features__ = collections.defaultdict(set)   # feature_type: set of keys
+
+        self.__tree__ = None
+        self.__tree_keys__ = np.empty(0, dtype=np.int64)
+        self.__pending__ = {}    # key: coordinate of the points that are not in the tree yet
+        self.__removed__ = set()    # keys of the points that are still in the tree but were removed
+
+        # Fill the inverted indexes and build the tree just once
+        for p in points:
+            self.__index_point__(p)
+        self.__rebuild_tree__()
+
+    def __len__(self):
+        return len(self.__points__)
+
+    def add(self, point):
+        """ Add a point to the index
+        :param point: Point object
+        """
+        key = self.__index_point__(point)
+        self.__pending__[key] = np.asarray(point.coordinate, dtype=np.float64)
+        self.__removed__.discard(key)
+        self.__rebuild_tree_if_needed__()
+
+    def remove(self, point):
+        """ Remove a point from the index
+        :param point: Point object
+        """
+        key = id(point)
+        if key not in self.__points__:
+            return
+        del self.__points__[key]
+        self.__regions__[point.chest_region].discard(key)
+        self.__types__[point.chest_type].discard(key)
+        self.__features__[point.feature_type].discard(key)
+        if self.__pending__.pop(key, None) is None:
+            # The point is in the tree
+            self.__removed__.add(key)
+        self.__rebuild_tree_if_needed__()
+
+    def find(self, chest_region=None, chest_type=None, feature_type=None):
+        """ Get all the points that match the specified chest region/type/feature type (None = any value)
+        :return: list of Point objects sorted by id
+        """
+        return self.__to_points__(self.__filter_keys__(chest_region, chest_type, feature_type))
+
+    def find_near(self, coordinate, radius, chest_region=None, chest_type=None, feature_type=None):
+        """ Get all the points within a distance of a coordinate that match the specified chest region/type/feature
+        type (None = any value)
+        :return: list of Point objects sorted by id
+        """
+        coordinate = np.asarray(coordinate, dtype=np.float64)
+        keys = set()
+        if self.__tree__ is not None:
+            keys.update(self.__tree_keys__[self.__tree__.query_ball_point(coordinate, radius)].tolist())
+            keys.difference_update(self.__removed__)
+        if self.__pending__:
+            pending_keys = np.fromiter(self.__pending__.keys(), dtype=np.int64, count=len(self.__pending__))
+            pending_coordinates = np.array(list(self.__pending__.values()), dtype=np.float64)
+            distances = np.linalg.norm(pending_coordinates.reshape(len(pending_keys), -1) - coordinate, axis=1)
+            keys.update(pending_keys[distances <= radius].tolist())
+        filter_keys = self.__filter_keys__(chest_region, chest_type, feature_type)
+        if filter_keys is not None:
+            keys.intersection_update(filter_keys)
+        return self.__to_points__(keys)
+
+    def find_duplicates(self, tolerance):
+        """ Get all the pairs of points that are closer than a tolerance
+        :param tolerance: maximum distance between two points to be considered duplicated
+        :return: list of (Point, Point) tuples, where the id of the first point is lower than the second one
+        """
+        if self.__pending__ or self.__removed__:
+            self.__rebuild_tree__()
+        if self.__tree__ is None:
+            return []
+        pairs = []
+        for i, j in self.__tree__.query_pairs(tolerance):
+            p1 = self.__points__[int(self.__tree_keys__[i])]
+            p2 = self.__points__[int(self.__tree_keys__[j])]
+            pairs.append((p1, p2) if p1.id <= p2.id else (p2, p1))
+        pairs.sort(key=lambda pair: (pair[0].id, pair[1].id))
+        return pairs
+
+    def __index_point__(self, point):
+        """ Add a point to the dictionary of points and the inverted indexes (not to the KD-tree)
+        :return: key of the point
+        """
+        key = id(point)
+        self.__points__[key] = point
+        self.__regions__[point.chest_region].add(key)
+        self.__types__[point.chest_type].add(key)
+        self.__features__[point.feature_type].add(key)
+        return key
+
+    def __filter_keys__(self, chest_region, chest_type, feature_type):
+        """ Intersect the inverted indexes for the specified values
+        :return: set of keys or None if there is not any filter
+        """
+        sets = []
+        if chest_region is not None:
+            sets.append(self.__regions__.get(chest_region, set()))
+        if chest_type is not None:
+            sets.append(self.__types__.get(chest_type, set()))
+        if feature_type is not None:
+            sets.append(self.__features__.get(feature_type, set()))
+        if not sets:
+            return None
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
+
+    def __to_points__(self, keys):
+        """ Get the points for a set of keys (all the points if keys is None), sorted by id
+        """
+        if keys is None:
+            points = list(self.__points__.values())
+        else:
+            points = [self.__points__[key] for key in keys]
+        points.sort(key=lambda p: p.id)
+        return points
+
+    def __rebuild_tree_if_needed__(self):
+        threshold = max(self.MIN_REBUILD_SIZE, self.REBUILD_RATIO * len(self.__tree_keys__))
+        if len(self.__pending__) > threshold or len(self.__removed__) > threshold:
+            self.__rebuild_tree__()
+
+    def __rebuild_tree__(self):
+        """ Build the KD-tree with all the current points
+        """
+        import scipy.spatial
+        self.__pending__ = {}
+        self.__removed__ = set()
+        keys = list(self.__points__.keys())
+        self.__tree_keys__ = np.array(keys, dtype=np.int64)
+        if len(keys) == 0:
+            self.__tree__ = None
+            return
+        coordinates = np.array([self.__points__[key].coordinate for key in keys], dtype=np.float64)
+        self.__tree__ = scipy.spatial.cKDTree(coordinates.reshape(len(keys), -1))
+
+
 class Structure(object):
     def __init__(self, chest_region, chest_type, feature_type, description=None,
                    timestamp=None, user_name=None, machine_name=None):
@@ -0,0 +1,153 @@
+""" Lazy import helpers used to keep the startup time of the CIP modules low.
+
+The CIP packages used to import all their submodules (and their third party dependencies) eagerly, so every CIP
+scripted module paid the full price at Slicer startup. With these helpers the packages just declare which public
+names live in which submodule, and the submodules are loaded the first time one of those names is accessed.
+
+Example of use (in a package __init__.py):
+from CIP.logic.lazy_loader import LazyPackage
+LazyPackage.install(__name__,
+                    exports={"MyClass": "my_module"},
+                    submodules=["my_module", "other_module"],
+                    extra_submodules=["new_module"])
+
+Example of use (third party modules):
+from CIP.logic.lazy_loader import lazy_import
+sitk = lazy_import("SimpleITK")     # SimpleITK will be imported the first time that any sitk.X member is used
+"""
+import importlib
+import importlib.util
+import sys
+import threading
+import types
+
+
+class LazyModule(types.ModuleType):
+    """ Placeholder for a module that will be imported the first time that any of its attributes is accessed """
+    def __init__(self, name):
+        super(LazyModule, self).__init__(name)
+        self.__dict__["__lazy_lock__"] = threading.RLock()
+        self.__dict__["__lazy_module__"] = None
+
+    def __load__(self):
+        """ Import the real module (just once) and copy its namespace to this object, so that next accesses
+        don't go through __getattr__
+        :return: real module
+        """
+        d = self.__dict__
+        if d["__lazy_module__"] is None:
+            with d["__lazy_lock__"]:
+                if d["__lazy_module__"] is None:
+                    module = importlib.import_module(self.__name__)
+                    d.update(module.__dict__)
+                    d["__lazy_module__"] = module
+        return d["__lazy_module__"]
+
+    def __getattr__(self, name):
+        return getattr(self.__load__(), name)
+
+    def __dir__(self):
+        return dir(self.__load__())
+
+    def __repr__(self):
+        if self.__dict__["__lazy_module__"] is None:
+            return "<lazy module '{}' (not loaded)>".format(self.__name__)
+        return repr(self.__dict__["__lazy_module__"])
+
+
+def lazy_import(module_name):
+    """ Get a module that will be imported the first time that any of its attributes is accessed.
+    If the module was already imported, the real module is returned.
+    :param module_name: full name of the module (ex: "SimpleITK")
+    :return: module or LazyModule
+    """
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    return LazyModule(module_name)
+
+
+class LazyPackage(types.ModuleType):
+    """ Module type for packages that resolve their public names on first access.
+    It replaces the "from .submodule import *" statements in the package __init__.py files.
+    Use LazyPackage.install in the __init__.py file of the package.
+    """
+    @staticmethod
+    def install(package_name, exports, submodules=(), extra_submodules=()):
+        """ Turn an already created package module into a lazy package.
+        :param package_name: full name of the package (usually __name__ in the __init__.py file)
+        :param exports: dictionary of public name-relative submodule name. Ex: {"Util": "Util", "LabelExtent": "Util"}
+        :param submodules: ordered list of the relative submodule names that the package used to wildcard import.
+                           Names that are not in "exports" will be searched there, in the same order
+        :param extra_submodules: relative names of other submodules of the package. They are not searched for
+                                 undeclared names (they were never wildcard imported)
+        :return: package module
+        """
+        package = sys.modules[package_name]
+        package.__dict__["__lazy_exports__"] = dict(exports)
+        package.__dict__["__lazy_submodules__"] = list(submodules)
+        package.__dict__["__lazy_extra_submodules__"] = list(extra_submodules)
+        package.__dict__["__all__"] = sorted(exports)
+        package.__class__ = LazyPackage
+        return package
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            # Special attributes (__path__, __file__, etc.) must never trigger any import
+            raise AttributeError(name)
+        d = self.__dict__
+        exports = d["__lazy_exports__"]
+        submodules = d["__lazy_submodules__"]
+        if name in exports:
+            value = getattr(self.__import_submodule__(exports[name]), name)
+        elif name in submodules or name in d["__lazy_extra_submodules__"] or self.__has_submodule__(name):
+            # Load just that submodule (ex: "from CIP.logic import cli_pipeline"), not the whole package
+            value = self.__import_submodule__(name)
+        else:
+            # Emulate the old wildcard imports for names that were not declared explicitly
+            for submodule_name in submodules:
+                module = self.__import_submodule__(submodule_name)
+                if not name.startswith("_") and hasattr(module, name):
+                    value = getattr(module, name)
+                    break
+            else:
+                raise AttributeError("module '{}' has no attribute '{}'".format(self.__name__, name))
+        types.ModuleType.__setattr__(self, name, value)
+        return value
+
+    def __setattr__(self, name, value):
+        # The import system sets every submodule as an attribute of its package once it's loaded.
+        # When a submodule has the same name as the public object that it contains (ex: Util.Util), keep the
+        # public object, like the old "from .Util import *" did
+        if isinstance(value, types.ModuleType) and self.__dict__["__lazy_exports__"].get(name) == name \
+                and value.__name__ == "{}.{}".format(self.__name__, name):
+            value = getattr(value, name, value)
+        types.ModuleType.__setattr__(self, name, value)
+
+    def __dir__(self):
+        d = self.__dict__
+        return sorted(set(d) | set(d["__lazy_exports__"]) | set(d["__lazy_submodules__"]) |
+                      set(d["__lazy_extra_submodules__"]))
+
+    def __has_submodule__(self, name):
+        """ True if the package contains a submodule with that name (it is not imported)
+        """
+        try:
+            return importlib.util.find_spec("{}.{}".format(self.__name__, name)) is not None
+        except (ImportError, ValueError):
+            return False
+
+    def __import_submodule__(self, submodule_name):
+        """ Import a submodule of this package
+        :param submodule_name: relative name of the submodule
+        :return: submodule
+        """
+        return importlib.import_module("{}.{}".format(self.__name__, submodule_name))
+
+    def load_all(self):
+        """ Resolve all the public names of the package (equivalent to the old eager imports).
+        It can be useful to warm up the package in a background task or to check that all the submodules are correct
+        """
+        for name in self.__dict__["__lazy_exports__"]:
+            getattr(self, name)
+        for submodule_name in self.__dict__["__lazy_submodules__"]:
+            self.__import_submodule__(submodule_name)
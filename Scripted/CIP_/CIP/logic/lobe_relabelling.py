@@ -0,0 +1,132 @@
+""" Incremental update of a lung lobes segmentation when some fissures are modified.
+
+As in the lobe segmentation CLI (segmentlunglobes), every fissure is a thin plate spline height surface (z = f(x, y))
+that interpolates its fiducials. When the fiducials of a fissure are moved, only the voxels between the previous and
+the new surface need to be relabelled.
+"""
+import numpy as np
+
+# Lobe codes (ChestConventions.xml)
+RIGHT_SUPERIOR_LOBE = 4
+RIGHT_MIDDLE_LOBE = 5
+RIGHT_INFERIOR_LOBE = 6
+LEFT_SUPERIOR_LOBE = 7
+LEFT_INFERIOR_LOBE = 8
+
+
+class FissureSurface(object):
+    """ Thin plate spline surface z = f(x, y) that interpolates the fiducials of a fissure
+    """
+    def __init__(self, points, regularization=0.0):
+        """
+        :param points: Nx3 array of coordinates (x, y, z) of the fiducials
+        :param regularization: smoothing factor (0 = exact interpolation)
+        """
+        points = np.asarray(points, dtype=float)
+        self.xy = points[:, :2]
+        n = len(points)
+        A = np.zeros((n + 3, n + 3))
+        A[:n, :n] = self.__kernel__(self.__distances__(self.xy[:, 0], self.xy[:, 1])) + regularization * np.eye(n)
+        A[:n, n] = 1
+        A[:n, n + 1:] = self.xy
+        A[n, :n] = 1
+        A[n + 1:, :n] = self.xy.T
+        b = np.zeros(n + 3)
+        b[:n] = points[:, 2]
+        # lstsq is robust to degenerate configurations (duplicated or aligned fiducials)
+        coefficients = np.linalg.lstsq(A, b, rcond=None)[0]
+        self.weights = coefficients[:n]
+        self.affine = coefficients[n:]
+
+    def evaluate(self, x, y, chunkSize=65536):
+        """ Height of the surface in the (x, y) positions
+        :param x: array of x coordinates
+        :param y: array of y coordinates
+        :param chunkSize: number of positions evaluated at once (to limit the memory used)
+        :return: array of z coordinates
+        """
+        x = np.asarray(x, dtype=float).ravel()
+        y = np.asarray(y, dtype=float).ravel()
+        z = self.affine[0] + self.affine[1] * x + self.affine[2] * y
+        for start in range(0, len(x), chunkSize):
+            end = start + chunkSize
+            z[start:end] += self.__kernel__(self.__distances__(x[start:end], y[start:end])).dot(self.weights)
+        return z
+
+    def __distances__(self, x, y):
+        return np.sqrt((x[:, np.newaxis] - self.xy[:, 0]) ** 2 + (y[:, np.newaxis] - self.xy[:, 1]) ** 2)
+
+    @staticmethod
+    def __kernel__(r):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            u = r * r * np.log(r)
+        u[r == 0] = 0
+        return u
+
+
+def relabelBetweenSurfaces(labelArray, geometry, fissureName, oldSurface, surfaces):
+    """ Relabel (in place) the lobe voxels that are between the old and the new surface of a fissure.
+    As in the lobe segmentation CLI, every fissure is a height (z) surface over the axial plane: the superior
+    lobes are above the oblique fissures and the middle lobe is above the right oblique fissure and below the
+    right horizontal fissure.
+    :param labelArray: numpy array (k, j, i) with the lobes label map (the chest types in the most significant
+                       byte are preserved)
+    :param geometry: tuple with the RAS affine transformation of the columns (2x3 matrix for x, y from i, j, 1)
+                     and the (z spacing, z origin) of the slices.
+                     See CIP_InteractiveLobeSegmentationLogic.__getAxialGeometry__
+    :param fissureName: 'LO', 'RO' or 'RH'
+    :param oldSurface: FissureSurface that was used to label the volume
+    :param surfaces: dictionary of fissure name-FissureSurface with the new surfaces of all the fissures
+    :return: number of relabelled voxels
+    """
+    xyMatrix, (zSpacing, zOrigin) = geometry
+    if fissureName == 'LO':
+        lobes = np.array([LEFT_SUPERIOR_LOBE, LEFT_INFERIOR_LOBE])
+    else:
+        lobes = np.array([RIGHT_SUPERIOR_LOBE, RIGHT_MIDDLE_LOBE, RIGHT_INFERIOR_LOBE])
+
+    # Columns (j, i) that contain voxels of the affected lung
+    regions = labelArray & 0xFF
+    sideMask = np.isin(regions, lobes)
+    columns = sideMask.any(axis=0)
+    if not columns.any():
+        return 0
+    jj, ii = np.nonzero(columns)
+    x = xyMatrix[0, 0] * ii + xyMatrix[0, 1] * jj + xyMatrix[0, 2]
+    y = xyMatrix[1, 0] * ii + xyMatrix[1, 1] * jj + xyMatrix[1, 2]
+
+    # Height of the current surfaces of the lung in every column
+    fissures = ['LO'] if fissureName == 'LO' else ['RO', 'RH']
+    heights = dict((name, surfaces[name].evaluate(x, y)) for name in fissures)
+
+    # Band of slices between the old and the new surface in every column (plus one voxel of margin)
+    kOld = (oldSurface.evaluate(x, y) - zOrigin) / zSpacing
+    kNew = (heights[fissureName] - zOrigin) / zSpacing
+    kMin = np.clip(np.floor(np.minimum(kOld, kNew)) - 1, 0, labelArray.shape[0] - 1).astype(int)
+    kMax = np.clip(np.ceil(np.maximum(kOld, kNew)) + 1, 0, labelArray.shape[0] - 1).astype(int)
+    lengths = kMax - kMin + 1
+    columnIndex = np.repeat(np.arange(len(jj)), lengths)
+    kk = np.repeat(kMin, lengths) + (np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths))
+
+    # Keep just the voxels of the affected lung
+    voxelMask = sideMask[kk, jj[columnIndex], ii[columnIndex]]
+    kk = kk[voxelMask]
+    columnIndex = columnIndex[voxelMask]
+    z = kk * zSpacing + zOrigin
+    if fissureName == 'LO':
+        newRegions = np.where(z > heights['LO'][columnIndex], LEFT_SUPERIOR_LOBE, LEFT_INFERIOR_LOBE)
+    else:
+        aboveOblique = z > heights['RO'][columnIndex]
+        aboveHorizontal = z > heights['RH'][columnIndex]
+        newRegions = np.where(~aboveOblique, RIGHT_INFERIOR_LOBE,
+                              np.where(aboveHorizontal, RIGHT_SUPERIOR_LOBE, RIGHT_MIDDLE_LOBE))
+
+    index = (kk, jj[columnIndex], ii[columnIndex])
+    values = labelArray[index]
+    changed = (values & 0xFF) != newRegions
+    index = tuple(a[changed] for a in index)
+    # Keep the chest type (most significant byte). Note that ~0xFF is a negative python int, which can't be combined
+    # with unsigned arrays in NumPy 2
+    values = values[changed]
+    labelArray[index] = (values - (values & 0xFF)) | newRegions[changed].astype(values.dtype)
+    return int(changed.sum())
@@ -1,6 +1,9 @@
-import SimpleITK as sitk
 import numpy as np
 
+from .lazy_loader import lazy_import
+
+sitk = lazy_import("SimpleITK")
+
 
 class LungSplitter:
     def __init__(self, split_thirds=False):
@@ -0,0 +1,233 @@
+""" Sliding window (slab) projections of volumes: maximum (MIP), minimum (MinIP) and mean.
+
+The projection of every slice of the volume is computed at once in O(N) per voxel row, independently of the number
+of slices of the slab:
+- Max/min: van Herk/Gil-Werman algorithm (prefix and suffix running extremes in blocks of the window size)
+- Mean: prefix sums
+The results are stored in derived volumes (SlabProjectionCache), so that scrolling through a MIP/MinIP is just
+displaying a slice of a volume instead of recomputing the projection of the whole slab in every render.
+
+Example of use:
+cache = SlabProjectionCache()
+mipNode = cache.getProjectionNode(ctNode, SlabProjection.AXIS_K, 20, SlabProjection.OPERATION_MAX)
+"""
+import vtk, slicer
+import numpy as np
+
+from .Util import Util
+from .SlicerUtil import SlicerUtil
+
+
+class SlabProjection(object):
+    OPERATION_MAX = "max"
+    OPERATION_MIN = "min"
+    OPERATION_MEAN = "mean"
+
+    # Axes of the volume (IJK). Note that the numpy arrays are indexed (k, j, i)
+    AXIS_I = 0
+    AXIS_J = 1
+    AXIS_K = 2
+
+    @staticmethod
+    def project(array, axis, numberOfSlices, operation, out=None, chunkSize=2**22):
+        """ Compute the sliding window projection of every slice of a volume.
+        Slice k of the result is the projection of the slices [k - (numberOfSlices-1)//2, ...] (numberOfSlices
+        slices centered in k). The windows are clipped in the borders of the volume
+        :param array: numpy array
+        :param axis: numpy axis of the projection
+        :param numberOfSlices: size of the window (slab)
+        :param operation: OPERATION_MAX, OPERATION_MIN or OPERATION_MEAN
+        :param out: optional array where the result will be stored (same shape and data type as array)
+        :param chunkSize: approximate number of voxels processed at once (to limit the memory of the temporary arrays)
+        :return: numpy array with the same shape and data type
+        """
+        if operation not in (SlabProjection.OPERATION_MAX, SlabProjection.OPERATION_MIN,
+                             SlabProjection.OPERATION_MEAN):
+            raise Exception("Unknown projection operation: {}".format(operation))
+        if out is None:
+            out = np.empty_like(array)
+        numberOfSlices = max(1, min(int(numberOfSlices), array.shape[axis]))
+        source = np.moveaxis(array, axis, 0)
+        target = np.moveaxis(out, axis, 0)
+        n = source.shape[0]
+        if numberOfSlices == 1:
+            target[...] = source
+            return out
+
+        # Process the volume in chunks of complete rows along the projection axis
+        if source.ndim == 1:
+            source = source[:, np.newaxis]
+            target = target[:, np.newaxis]
+        rowSize = int(np.prod(source.shape[2:], dtype=np.int64))
+        rowsPerChunk = max(1, chunkSize // (n * rowSize))
+        for start in range(0, source.shape[1], rowsPerChunk):
+            block = source[:, start:start + rowsPerChunk]
+            shape = block.shape
+            block = block.reshape(n, -1)
+            if operation == SlabProjection.OPERATION_MEAN:
+                result = SlabProjection.__sliding_mean__(block, numberOfSlices)
+                if np.issubdtype(array.dtype, np.integer):
+                    result = np.round(result)
+            else:
+                result = SlabProjection.__sliding_extreme__(block, numberOfSlices,
+                                                           operation == SlabProjection.OPERATION_MAX)
+            target[:, start:start + rowsPerChunk] = result.reshape(shape)
+        return out
+
+    @staticmethod
+    def __sliding_extreme__(block, numberOfSlices, maximum):
+        """ Sliding max/min along the axis 0 of a 2D array (van Herk/Gil-Werman)
+        """
+        n, m = block.shape
+        w = numberOfSlices
+        before = (w - 1) // 2
+        if np.issubdtype(block.dtype, np.integer):
+            info = np.iinfo(block.dtype)
+            identity = info.min if maximum else info.max
+        else:
+            identity = -np.inf if maximum else np.inf
+        # Pad so that the window of slice k is [k, k + w - 1] in the padded array, and the length is multiple of w
+        length = n + w - 1
+        length += (-length) % w
+        padded = np.full((length, m), identity, dtype=block.dtype)
+        padded[before:before + n] = block
+        blocks = padded.reshape(length // w, w, m)
+        accumulate = np.maximum.accumulate if maximum else np.minimum.accumulate
+        prefix = accumulate(blocks, axis=1).reshape(length, m)
+        suffix = accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(length, m)
+        extreme = np.maximum if maximum else np.minimum
+        return extreme(suffix[:n], prefix[w - 1:w - 1 + n])
+
+    @staticmethod
+    def __sliding_mean__(block, numberOfSlices):
+        """ Sliding mean along the axis 0 of a 2D array (prefix sums)
+        """
+        n = block.shape[0]
+        before = (numberOfSlices - 1) // 2
+        sums = np.zeros((n + 1,) + block.shape[1:], dtype=np.float64)
+        np.cumsum(block, axis=0, dtype=np.float64, out=sums[1:])
+        k = np.arange(n)
+        low = np.clip(k - before, 0, n)
+        high = np.clip(k - before + numberOfSlices, 0, n)
+        return (sums[high] - sums[low]) / (high - low)[:, np.newaxis]
+
+
+class SlabProjectionCache(object):
+    """ Derived volumes with the slab projections of other volumes.
+    Every (volume, axis, operation) has one derived volume (hidden and not saved with the scene), that is recomputed
+    just when the number of slices or the original volume change
+    """
+    def __init__(self, scene=None):
+        self.scene = slicer.mrmlScene if scene is None else scene
+        # (source id, axis, operation): (derived node, number of slices, key of the source data)
+        self.__projections__ = {}
+        self.__sources__ = {}           # derived node id: source node id
+        self.__displayObservers__ = {}  # source node id: (display node, observer tag)
+
+        def onNodeRemoved(caller, event, node):
+            if node is not None and any(key[0] == node.GetID() for key in self.__projections__):
+                self.clear(node)
+        onNodeRemoved.CallDataType = vtk.VTK_OBJECT
+        self.__sceneObserver__ = self.scene.AddObserver(self.scene.NodeRemovedEvent, onNodeRemoved)
+
+    def getProjectionNode(self, volumeNode, axis, numberOfSlices, operation):
+        """ Get a volume where every slice along "axis" is the projection of "numberOfSlices" slices of volumeNode
+        :param volumeNode: vtkMRMLScalarVolumeNode
+        :param axis: SlabProjection.AXIS_I, AXIS_J or AXIS_K
+        :param numberOfSlices: number of slices of the slab
+        :param operation: SlabProjection operation
+        :return: derived vtkMRMLScalarVolumeNode (it should not be modified or removed by the caller)
+        """
+        volumeNode = self.getSourceNode(volumeNode)
+        imageData = volumeNode.GetImageData()
+        key = (imageData.GetMTime(), imageData.GetPointData().GetScalars().GetMTime())
+        cacheKey = (volumeNode.GetID(), axis, operation)
+        cached = self.__projections__.get(cacheKey)
+        if cached is not None and cached[0].GetScene() is None:
+            cached = None
+        if cached is not None and cached[1] == numberOfSlices and cached[2] == key:
+            return cached[0]
+
+        if cached is None:
+            projectionNode = SlicerUtil.cloneVolume(volumeNode, "{}_{}{}".format(volumeNode.GetName(), operation,
+                                                                                "IJK"[axis]),
+                                                    mrmlScene=self.scene, cloneImageData=True, addToScene=False)
+            projectionNode.SetHideFromEditors(True)
+            projectionNode.SetSaveWithScene(False)
+            self.scene.AddNode(projectionNode)
+            self.__sources__[projectionNode.GetID()] = volumeNode.GetID()
+            self.__observeDisplayNode__(volumeNode)
+        else:
+            projectionNode = cached[0]
+            if projectionNode.GetImageData().GetDimensions() != imageData.GetDimensions():
+                clonedImageData = vtk.vtkImageData()
+                clonedImageData.DeepCopy(imageData)
+                projectionNode.SetAndObserveImageData(clonedImageData)
+
+        source = Util.vtkImageData_numpy_array(imageData)
+        target = Util.vtkImageData_numpy_array(projectionNode.GetImageData())
+        # numpy arrays are indexed (k, j, i)
+        SlabProjection.project(source, 2 - axis, numberOfSlices, operation, out=target)
+        projectionNode.GetImageData().Modified()
+        self.__projections__[cacheKey] = (projectionNode, numberOfSlices, key)
+        return projectionNode
+
+    def getSourceNode(self, volumeNode):
+        """ Get the original volume of a derived projection volume (or the same volume if it is not a projection)
+        :param volumeNode: volume node
+        :return: volume node
+        """
+        sourceId = self.__sources__.get(volumeNode.GetID())
+        if sourceId is None:
+            return volumeNode
+        sourceNode = self.scene.GetNodeByID(sourceId)
+        return sourceNode if sourceNode is not None else volumeNode
+
+    def getSourceNodeId(self, volumeNodeId):
+        """ Same as getSourceNode with node ids
+        """
+        return self.__sources__.get(volumeNodeId, volumeNodeId)
+
+    def isProjectionNode(self, volumeNode):
+        return volumeNode is not None and volumeNode.GetID() in self.__sources__
+
+    def clear(self, volumeNode=None):
+        """ Remove the derived volumes of a volume (or all of them)
+        :param volumeNode: original volume (None for all the volumes)
+        """
+        sourceId = None if volumeNode is None else volumeNode.GetID()
+        for cacheKey in list(self.__projections__.keys()):
+            if sourceId is None or cacheKey[0] == sourceId:
+                projectionNode = self.__projections__.pop(cacheKey)[0]
+                self.__sources__.pop(projectionNode.GetID(), None)
+                if projectionNode.GetScene() is not None:
+                    self.scene.RemoveNode(projectionNode)
+        for nodeId in list(self.__displayObservers__.keys()):
+            if sourceId is None or nodeId == sourceId:
+                displayNode, tag = self.__displayObservers__.pop(nodeId)
+                displayNode.RemoveObserver(tag)
+
+    def cleanup(self):
+        """ Remove all the derived volumes and observers
+        """
+        self.clear()
+        if self.__sceneObserver__ is not None:
+            self.scene.RemoveObserver(self.__sceneObserver__)
+            self.__sceneObserver__ = None
+
+    def __observeDisplayNode__(self, volumeNode):
+        """ Keep the window/level of the derived volumes synchronized with the original volume
+        """
+        displayNode = volumeNode.GetDisplayNode()
+        if displayNode is None or volumeNode.GetID() in self.__displayObservers__:
+            return
+        sourceId = volumeNode.GetID()
+
+        def onDisplayModified(caller, event):
+            for (nodeId, axis, operation), (projectionNode, n, key) in list(self.__projections__.items()):
+                projectionDisplayNode = projectionNode.GetDisplayNode()
+                if nodeId == sourceId and projectionDisplayNode is not None:
+                    projectionDisplayNode.SetAutoWindowLevel(False)
+                    projectionDisplayNode.SetWindowLevel(caller.GetWindow(), caller.GetLevel())
+        tag = displayNode.AddObserver(vtk.vtkCommand.ModifiedEvent, onDisplayModified)
+        self.__displayObservers__[sourceId] = (displayNode, tag)
@@ -11,8 +11,47 @@ print "The total time was {} seconds".format(GlobalTimer.stop())
 # Equivalent:
 GlobalTimer.stop()
 print "The total time was {} seconds".format(GlobalTimer.total_time())
+
+Hierarchical profiling (nested spans) with the Profiler class. Example of use:
+@GlobalProfiler.profile()
+def heavy_function():
+    with GlobalProfiler.span("step1"):
+        op1()
+    with GlobalProfiler.span("step2"):
+        op2()
+
+heavy_function()
+print GlobalProfiler.summary()
+GlobalProfiler.to_chrome_trace("/tmp/trace.json")   # Open in chrome://tracing
+
+The entry points of the modules (ex: onApply) are decorated with GlobalProfiler.profile_run(), that clears the previous
+spans and logs the summary at the end of every run.
+Memory: if tracemalloc is tracing (GlobalProfiler.set_trace_memory(True)), the peak_memory of a span is the peak of the
+memory allocated by python and numpy between its start and its end. Otherwise it is the increase of the peak resident
+memory of the process during the span (so it is 0 if the span did not use more memory than the previous ones)
 """
+import collections
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
 import time
+import tracemalloc
+try:
+    import resource
+except ImportError:
+    # Not available in Windows
+    resource = None
+
+# CPU time of the current thread, so that spans running in other threads are not measured
+if hasattr(time, "thread_time"):
+    _cpu_time = time.thread_time
+elif hasattr(time, "process_time"):
+    _cpu_time = time.process_time
+else:
+    _cpu_time = time.clock
 
 class Timer(object):
     def __init__(self):
@@ -61,4 +100,290 @@ class GlobalTimer(object):
 
     @staticmethod
     def last_lap():
-        return GlobalTimer.__timer__.last_lap()
\ No newline at end of file
+        return GlobalTimer.__timer__.last_lap()
+
+
+class ProfilingSpan(object):
+    """ Measure of a block of code. The spans opened while this one is active will be its children
+    """
+    def __init__(self, name, parent=None, args=None):
+        self.name = name
+        self.parent = parent
+        self.path = name if parent is None else parent.path + "/" + name
+        self.args = args or {}
+        self.thread_id = threading.current_thread().ident
+        self.start_time = time.time()
+        self.end_time = None
+        self.__cpu_start__ = _cpu_time()
+        self.cpu_time = None
+        self.peak_memory = None
+        # Memory at the start of the span and highest memory observed while it is active (bytes). See Profiler
+        self.__memory_start__ = None
+        self.__memory_peak__ = None
+
+    @property
+    def wall_time(self):
+        if self.end_time is None:
+            return time.time() - self.start_time
+        return self.end_time - self.start_time
+
+    def stop(self):
+        self.end_time = time.time()
+        self.cpu_time = _cpu_time() - self.__cpu_start__
+        if self.__memory_start__ is not None:
+            # MB
+            self.peak_memory = max(self.__memory_peak__ - self.__memory_start__, 0) / (1024.0 * 1024.0)
+
+
+class Profiler(object):
+    """ Thread safe collection of nested spans (see ProfilingSpan).
+    Every thread has its own stack of active spans. The finished spans are aggregated by path
+    (ex: "run/First-Order Statistics") and the last MAX_SPANS of them are kept to generate traces
+    """
+    MAX_SPANS = 100000
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        # Directory where the chrome trace of every run is written (see profile_run). None: no traces
+        self.trace_directory = None
+        self.__lock__ = threading.Lock()
+        self.__local__ = threading.local()
+        # Active spans of all the threads. The memory peaks are measured for all of them at once (see __sample_memory__)
+        self.__active_spans__ = set()
+        self.reset()
+
+    def reset(self):
+        """ Remove all the finished spans (ex: at the beginning of a new module run)
+        """
+        with self.__lock__:
+            self.__spans__ = collections.deque(maxlen=self.MAX_SPANS)
+            self.__stats__ = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        """ Context manager that measures the enclosed block of code.
+        :param name: name of the span
+        :param args: additional info that will be stored in the traces
+        """
+        if not self.enabled:
+            yield None
+            return
+        stack = self.__get_stack__()
+        s = ProfilingSpan(name, stack[-1] if stack else None, args)
+        stack.append(s)
+        with self.__lock__:
+            s.__memory_start__ = s.__memory_peak__ = self.__sample_memory__()
+            self.__active_spans__.add(s)
+        try:
+            yield s
+        finally:
+            with self.__lock__:
+                self.__sample_memory__()
+                self.__active_spans__.discard(s)
+            s.stop()
+            stack.pop()
+            self.__add_span__(s)
+
+    def profile(self, name=None):
+        """ Decorator that measures every call to a function in a span
+        :param name: name of the span (default: name of the function)
+        """
+        def decorator(function):
+            span_name = name or function.__name__
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def profile_run(self, name=None):
+        """ Decorator for the entry points of the modules. Every call is a new run: the previous spans are removed,
+        the call is measured in a span and the summary is logged at the end (and the chrome trace is written in
+        trace_directory if set). Nested runs (ex: a module that calls the logic of another one) are regular spans
+        :param name: name of the span (default: name of the function)
+        """
+        def decorator(function):
+            span_name = name or function.__name__
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or self.__get_stack__():
+                    with self.span(span_name):
+                        return function(*args, **kwargs)
+                self.reset()
+                try:
+                    with self.span(span_name):
+                        return function(*args, **kwargs)
+                finally:
+                    self.__end_run__(span_name)
+            return wrapper
+        return decorator
+
+    def summary_text(self):
+        """ Aggregated stats for every span path as a text table (see summary)
+        """
+        lines = ["{:<60} {:>6} {:>10} {:>10} {:>10}".format("Span", "Count", "Wall (s)", "CPU (s)", "Mem (MB)")]
+        for stats in self.summary():
+            memory = stats["peak_memory"]
+            lines.append("{:<60} {:>6} {:>10.3f} {:>10.3f} {:>10}".format(
+                stats["path"], stats["count"], stats["wall_time"], stats["cpu_time"],
+                "-" if memory is None else "{:.1f}".format(memory)))
+        return "\n".join(lines)
+
+    def summary(self):
+        """ Aggregated stats for every span path
+        :return: list of dictionaries (path, count, wall_time, cpu_time, peak_memory) sorted by path
+        """
+        with self.__lock__:
+            return [dict(path=path, **stats) for path, stats in sorted(self.__stats__.items())]
+
+    def to_json(self, file_path=None):
+        """ Export the aggregated stats and all the spans in json format
+        :param file_path: file where the json will be written (optional)
+        :return: json string
+        """
+        with self.__lock__:
+            spans = [{"name": s.name, "path": s.path, "thread_id": s.thread_id, "start_time": s.start_time,
+                      "wall_time": s.wall_time, "cpu_time": s.cpu_time, "peak_memory": s.peak_memory,
+                      "args": s.args} for s in self.__spans__]
+        return self.__write__({"summary": self.summary(), "spans": spans}, file_path)
+
+    def to_chrome_trace(self, file_path=None):
+        """ Export all the spans in the Chrome trace event format (chrome://tracing, Perfetto...)
+        :param file_path: file where the trace will be written (optional)
+        :return: json string
+        """
+        pid = os.getpid()
+        with self.__lock__:
+            events = []
+            for s in self.__spans__:
+                args = dict(s.args)
+                args["cpu_time"] = s.cpu_time
+                args["peak_memory_mb"] = s.peak_memory
+                events.append({"name": s.name, "cat": "CIP", "ph": "X", "pid": pid, "tid": s.thread_id,
+                               "ts": s.start_time * 1e6, "dur": s.wall_time * 1e6, "args": args})
+        return self.__write__({"traceEvents": events, "displayTimeUnit": "ms"}, file_path)
+
+    @staticmethod
+    def set_trace_memory(enabled):
+        """ Start/stop tracing the memory allocations with tracemalloc. It measures the memory used by python and
+        numpy much more accurately than the resident memory of the process, but the allocations are slower
+        """
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not enabled and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @staticmethod
+    def get_peak_memory():
+        """ Peak resident memory of the process in MB (None if it cannot be measured in this platform)
+        """
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KB, OSX reports bytes
+        return peak / (1024.0 * 1024.0) if os.uname()[0] == "Darwin" else peak / 1024.0
+
+    def __sample_memory__(self):
+        """ Update the memory peak of all the active spans. It must be called with the lock acquired.
+        With tracemalloc the peak is reset after every sample, so that the peak of a span is just the highest value
+        observed while it is active (the peak before its start is assigned to the spans that were active then)
+        :return: current memory in bytes (tracemalloc), or peak resident memory of the process. None if the memory
+                 cannot be measured
+        """
+        if tracemalloc.is_tracing() and hasattr(tracemalloc, "reset_peak"):
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        else:
+            peak = self.get_peak_memory()
+            if peak is None:
+                return None
+            current = peak = peak * 1024.0 * 1024.0
+        for s in self.__active_spans__:
+            if s.__memory_peak__ is not None:
+                s.__memory_peak__ = max(s.__memory_peak__, peak)
+        return current
+
+    def __end_run__(self, name):
+        logging.info("Profiling of {}:\n{}".format(name, self.summary_text()))
+        if self.trace_directory:
+            file_path = os.path.join(self.trace_directory,
+                                     "{}_{}.json".format(name, time.strftime("%Y%m%d_%H%M%S")))
+            try:
+                self.to_chrome_trace(file_path)
+            except (IOError, OSError) as ex:
+                logging.warning("The profiling trace could not be written to {}: {}".format(file_path, ex))
+
+    def __get_stack__(self):
+        if not hasattr(self.__local__, "stack"):
+            self.__local__.stack = []
+        return self.__local__.stack
+
+    def __add_span__(self, span):
+        with self.__lock__:
+            self.__spans__.append(span)
+            stats = self.__stats__.get(span.path)
+            if stats is None:
+                stats = self.__stats__[span.path] = {"count": 0, "wall_time": 0.0, "cpu_time": 0.0,
+                                                     "peak_memory": None}
+            stats["count"] += 1
+            stats["wall_time"] += span.wall_time
+            stats["cpu_time"] += span.cpu_time
+            if span.peak_memory is not None:
+                stats["peak_memory"] = max(stats["peak_memory"] or 0, span.peak_memory)
+
+    @staticmethod
+    def __write__(obj, file_path):
+        s = json.dumps(obj, indent=1)
+        if file_path is not None:
+            with open(file_path, "w") as f:
+                f.write(s)
+        return s
+
+
+class GlobalProfiler(object):
+    __profiler__ = Profiler()
+
+    @staticmethod
+    def span(name, **args):
+        return GlobalProfiler.__profiler__.span(name, **args)
+
+    @staticmethod
+    def profile(name=None):
+        return GlobalProfiler.__profiler__.profile(name)
+
+    @staticmethod
+    def profile_run(name=None):
+        return GlobalProfiler.__profiler__.profile_run(name)
+
+    @staticmethod
+    def set_enabled(enabled):
+        GlobalProfiler.__profiler__.enabled = enabled
+
+    @staticmethod
+    def set_trace_memory(enabled):
+        Profiler.set_trace_memory(enabled)
+
+    @staticmethod
+    def set_trace_directory(directory):
+        GlobalProfiler.__profiler__.trace_directory = directory
+
+    @staticmethod
+    def reset():
+        GlobalProfiler.__profiler__.reset()
+
+    @staticmethod
+    def summary():
+        return GlobalProfiler.__profiler__.summary()
+
+    @staticmethod
+    def summary_text():
+        return GlobalProfiler.__profiler__.summary_text()
+
+    @staticmethod
+    def to_json(file_path=None):
+        return GlobalProfiler.__profiler__.to_json(file_path)
+
+    @staticmethod
+    def to_chrome_trace(file_path=None):
+        return GlobalProfiler.__profiler__.to_chrome_trace(file_path)
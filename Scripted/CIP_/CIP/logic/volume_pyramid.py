@@ -0,0 +1,207 @@
+""" Multi-resolution pyramid of volumes (in-plane downsampled levels) computed in memory.
+
+The levels of every volume are computed once and cached (until the original volume is modified or removed), so that
+any module that needs a coarse version of a volume (fast previews, fast label map generation, etc.) can reuse them.
+The levels are scalar nodes in the scene (hidden and not saved with the scene), so that they can be used as the
+input of CLI modules too.
+
+Example of use:
+coarseNode = VolumePyramid.getLevelNode(ctNode, 2)
+... generate a labelmap in coarseLabelmapNode from coarseNode ...
+VolumePyramid.upsampleLabelmap(coarseLabelmapNode, ctNode)     # coarseLabelmapNode has now the geometry of ctNode
+"""
+import vtk, slicer
+import numpy as np
+
+from .Util import Util
+
+
+class VolumePyramid(object):
+    # Downsampling factors (in-plane) of the levels
+    LEVELS = (2, 4)
+
+    # source node id: {"key": key of the source data, "nodes": {factor: level node}, "valid": set of updated factors}
+    __levels__ = {}
+    __sceneObserver__ = None
+
+    @staticmethod
+    def getLevelNode(volumeNode, factor=2):
+        """ Get a scalar node with the volume downsampled in-plane (i, j) by "factor", averaging blocks of
+        factor x factor voxels. The slices (k) are not modified.
+        The level is computed just the first time (or when the original volume is modified)
+        :param volumeNode: vtkMRMLScalarVolumeNode
+        :param factor: downsampling factor. It must be one of the LEVELS
+        :return: vtkMRMLScalarVolumeNode
+        """
+        if factor not in VolumePyramid.LEVELS:
+            raise Exception("Not valid pyramid level: {}. Valid levels: {}".format(factor, VolumePyramid.LEVELS))
+        VolumePyramid.__observeScene__()
+        key = VolumePyramid.__getSourceKey__(volumeNode)
+        entry = VolumePyramid.__levels__.get(volumeNode.GetID())
+        if entry is None:
+            entry = {"key": key, "nodes": {}, "valid": set()}
+            VolumePyramid.__levels__[volumeNode.GetID()] = entry
+        elif entry["key"] != key:
+            # The original volume changed. The level nodes will be reused
+            entry["key"] = key
+            entry["valid"].clear()
+        valid = entry["valid"]
+
+        levelNode = entry["nodes"].get(factor)
+        if levelNode is not None and levelNode.GetScene() is None:
+            # The level was removed from the scene
+            levelNode = None
+            valid.discard(factor)
+        if levelNode is not None and factor in valid:
+            return levelNode
+
+        # Build the level from the closest finer level that is already computed
+        sourceNode, sourceFactor = volumeNode, 1
+        for f in sorted(VolumePyramid.LEVELS):
+            if f < factor and factor % f == 0 and f in valid:
+                sourceNode, sourceFactor = entry["nodes"][f], f
+        relativeFactor = factor // sourceFactor
+        array = VolumePyramid.downsampleArray(slicer.util.array(sourceNode.GetID()), relativeFactor)
+
+        if levelNode is None:
+            levelNode = slicer.mrmlScene.CreateNodeByClass("vtkMRMLScalarVolumeNode")
+            levelNode.SetName("{}_x{}".format(volumeNode.GetName(), factor))
+            levelNode.SetHideFromEditors(True)
+            levelNode.SetSaveWithScene(False)
+            slicer.mrmlScene.AddNode(levelNode)
+            entry["nodes"][factor] = levelNode
+        VolumePyramid.__setImageData__(levelNode, array)
+        levelNode.SetIJKToRASMatrix(VolumePyramid.__getLevelMatrix__(sourceNode, relativeFactor))
+        valid.add(factor)
+        return levelNode
+
+    @staticmethod
+    def getLevelArray(volumeNode, factor=2):
+        """ Get the numpy array (k, j, i) of a level of the pyramid. See getLevelNode
+        :return: numpy array
+        """
+        return slicer.util.array(VolumePyramid.getLevelNode(volumeNode, factor).GetID())
+
+    @staticmethod
+    def upsampleLabelmap(labelmapNode, referenceVolumeNode, outputLabelmapNode=None):
+        """ Resample (nearest neighbour) a labelmap that was generated in a level of the pyramid to the geometry of
+        the original volume
+        :param labelmapNode: coarse vtkMRMLLabelMapVolumeNode (same geometry as a level of referenceVolumeNode)
+        :param referenceVolumeNode: original volume
+        :param outputLabelmapNode: node where the result will be stored (default: labelmapNode, in place)
+        :return: output labelmap node
+        """
+        if outputLabelmapNode is None:
+            outputLabelmapNode = labelmapNode
+        factor = int(round(labelmapNode.GetSpacing()[0] / referenceVolumeNode.GetSpacing()[0]))
+        shape = list(referenceVolumeNode.GetImageData().GetDimensions())
+        shape.reverse()
+        array = VolumePyramid.upsampleArray(slicer.util.array(labelmapNode.GetID()), factor, shape)
+        VolumePyramid.__setImageData__(outputLabelmapNode, array)
+        ijkToRas = vtk.vtkMatrix4x4()
+        referenceVolumeNode.GetIJKToRASMatrix(ijkToRas)
+        outputLabelmapNode.SetIJKToRASMatrix(ijkToRas)
+        return outputLabelmapNode
+
+    @staticmethod
+    def downsampleArray(array, factor):
+        """ Downsample in-plane a volume array (k, j, i) averaging blocks of factor x factor voxels.
+        The borders are padded replicating the last row/column when the dimensions are not multiple of the factor
+        :param array: numpy array (k, j, i)
+        :param factor: downsampling factor
+        :return: numpy array with shape (k, ceil(j/factor), ceil(i/factor)) and the same data type
+        """
+        if factor == 1:
+            return array.copy()
+        nk, nj, ni = array.shape
+        padJ = (-nj) % factor
+        padI = (-ni) % factor
+        if padJ or padI:
+            array = np.pad(array, ((0, 0), (0, padJ), (0, padI)), mode="edge")
+        blocks = array.reshape(nk, array.shape[1] // factor, factor, array.shape[2] // factor, factor)
+        # Accumulate slab by slab to limit the memory of the temporary float array
+        result = np.empty((nk, blocks.shape[1], blocks.shape[3]), dtype=array.dtype)
+        slabSize = 16
+        for k in range(0, nk, slabSize):
+            mean = blocks[k:k + slabSize].mean(axis=(2, 4))
+            if np.issubdtype(array.dtype, np.integer):
+                mean = np.round(mean)
+            result[k:k + slabSize] = mean
+        return result
+
+    @staticmethod
+    def upsampleArray(array, factor, shape):
+        """ Nearest neighbour in-plane upsampling of a volume array (inverse of downsampleArray)
+        :param array: numpy array (k, j, i)
+        :param factor: upsampling factor
+        :param shape: shape of the result (original shape before the downsampling)
+        :return: numpy array
+        """
+        jIndexes = np.minimum(np.arange(shape[1]) // factor, array.shape[1] - 1)
+        iIndexes = np.minimum(np.arange(shape[2]) // factor, array.shape[2] - 1)
+        return array[:shape[0]][:, jIndexes][:, :, iIndexes]
+
+    @staticmethod
+    def clear(volumeNode=None):
+        """ Remove the levels of a volume (or all of them) from the cache and from the scene
+        :param volumeNode: original volume (None for all the volumes)
+        """
+        ids = list(VolumePyramid.__levels__.keys()) if volumeNode is None else [volumeNode.GetID()]
+        for nodeId in ids:
+            entry = VolumePyramid.__levels__.pop(nodeId, None)
+            if entry is None:
+                continue
+            for levelNode in entry["nodes"].values():
+                if levelNode.GetScene() is not None:
+                    levelNode.GetScene().RemoveNode(levelNode)
+
+    @staticmethod
+    def __getSourceKey__(volumeNode):
+        """ Key that changes when the voxels or the geometry of the volume change
+        """
+        imageData = volumeNode.GetImageData()
+        ijkToRas = vtk.vtkMatrix4x4()
+        volumeNode.GetIJKToRASMatrix(ijkToRas)
+        return (imageData.GetMTime(), imageData.GetPointData().GetScalars().GetMTime(),
+                str(Util.convert_vtk_matrix_to_list(ijkToRas)))
+
+    @staticmethod
+    def __getLevelMatrix__(volumeNode, factor):
+        """ IJK to RAS matrix of a level. The spacing of i and j is multiplied by the factor and the origin is the
+        center of the first block of voxels
+        """
+        ijkToRas = vtk.vtkMatrix4x4()
+        volumeNode.GetIJKToRASMatrix(ijkToRas)
+        offset = (factor - 1) / 2.0
+        for row in range(3):
+            ijkToRas.SetElement(row, 3, ijkToRas.GetElement(row, 3) +
+                                offset * (ijkToRas.GetElement(row, 0) + ijkToRas.GetElement(row, 1)))
+            for column in range(2):
+                ijkToRas.SetElement(row, column, ijkToRas.GetElement(row, column) * factor)
+        return ijkToRas
+
+    @staticmethod
+    def __setImageData__(volumeNode, array):
+        """ Replace the image data of a node with the content of a numpy array (k, j, i)
+        """
+        array = np.ascontiguousarray(array)
+        imageData = vtk.vtkImageData()
+        imageData.SetDimensions(array.shape[2], array.shape[1], array.shape[0])
+        scalars = vtk.util.numpy_support.numpy_to_vtk(array.ravel(), deep=True)
+        imageData.GetPointData().SetScalars(scalars)
+        volumeNode.SetAndObserveImageData(imageData)
+
+    @staticmethod
+    def __observeScene__():
+        """ Remove the levels of the volumes that are removed from the scene (only once)
+        """
+        if VolumePyramid.__sceneObserver__ is not None:
+            return
+
+        def onNodeRemoved(caller, event, node):
+            if node is not None and node.GetID() in VolumePyramid.__levels__:
+                VolumePyramid.clear(node)
+        onNodeRemoved.CallDataType = vtk.VTK_OBJECT
+
+        VolumePyramid.__sceneObserver__ = slicer.mrmlScene.AddObserver(slicer.mrmlScene.NodeRemovedEvent,
+                                                                      onNodeRemoved)
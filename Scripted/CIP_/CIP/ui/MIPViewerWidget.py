@@ -4,6 +4,7 @@ from __main__ import vtk, qt, ctk, slicer
 
 
 from CIP.logic.SlicerUtil import SlicerUtil
+from CIP.logic.slab_projection import SlabProjection, SlabProjectionCache
 
 class MIPViewerWidget(object):
     CONTEXT_UNKNOWN = 0
@@ -51,6 +52,18 @@ class MIPViewerWidget(object):
         if slicer.app.layoutManager() is not None:
             self.originalLayout = slicer.app.layoutManager().layout
 
+        # Precomputed projections of the volumes (scrolling through a projection doesn't recompute the slab)
+        self.slabProjectionCache = SlabProjectionCache()
+        # Layout name of the 2D window: id of the projection volume displayed in that window
+        self.__backgroundOverrides__ = {}
+        # While the spacing sliders are being moved, the slab is resliced on the fly (cheap for every slider value)
+        # and the projection volumes are computed just when the value settles
+        self.__previewMode__ = False
+        self.spacingTimer = qt.QTimer()
+        self.spacingTimer.setSingleShot(True)
+        self.spacingTimer.setInterval(300)
+        self.spacingTimer.timeout.connect(self.__onSpacingSettled__)
+
     ####
     # PROPERTIES
     @property
@@ -355,6 +368,7 @@ class MIPViewerWidget(object):
         self.resetViewButton.connect("clicked()", self.__onResetViewButtonClicked__)
         for slicer in (item[1] for item in self.spacingSliderItems.values()):
             slicer.connect('valueChanged(int)', self.__onNumberOfSlicesChanged__)
+            slicer.connect('sliderReleased()', self.__onSpacingSettled__)
         self.crosshairCheckbox.connect("stateChanged(int)", self.__onCrosshairCheckChanged__)
         self.centerButton.connect("clicked()", self.__onCenterButtonClicked__)
 
@@ -369,7 +383,8 @@ class MIPViewerWidget(object):
 
     def cleanup(self):
         """This is invoked as a destructor of the GUI when the module is no longer going to be used"""
-        pass
+        self.spacingTimer.stop()
+        self.slabProjectionCache.cleanup()
 
     def activateEnhacedVisualization(self, active):
         """ Set on/off the enhanced visualization for the current context
@@ -393,6 +408,9 @@ class MIPViewerWidget(object):
         if backgroundVolumeID is None:
             # No volumes are active. Nothing to do
             return
+        # The window could be displaying a projection of the volume
+        backgroundVolumeID = self.slabProjectionCache.getSourceNodeId(backgroundVolumeID)
+        self.__backgroundOverrides__.clear()
         labelmapVolumeID = compNode.GetLabelVolumeID()
         foregroundVolumeID = compNode.GetForegroundVolumeID()
 
@@ -465,7 +483,8 @@ class MIPViewerWidget(object):
         for compNode in compNodes.values():
             compNode.SetLabelVolumeID(labelmapVolumeID)
             compNode.SetForegroundVolumeID(foregroundVolumeID)
-            compNode.SetBackgroundVolumeID(backgroundVolumeID)
+            compNode.SetBackgroundVolumeID(self.__backgroundOverrides__.get(compNode.GetLayoutName(),
+                                                                            backgroundVolumeID))
 
         # Relink all the controls
         compNodes = slicer.util.getNodes("vtkMRMLSliceCompositeNode*")
@@ -496,6 +515,12 @@ class MIPViewerWidget(object):
             compNode.SetLinkedControl(False)
         SlicerUtil.changeLayout(self.originalLayout)
 
+        # Display again the original volumes instead of the projections
+        for compNode in compNodes.values():
+            backgroundVolumeID = compNode.GetBackgroundVolumeID()
+            if backgroundVolumeID:
+                compNode.SetBackgroundVolumeID(self.slabProjectionCache.getSourceNodeId(backgroundVolumeID))
+
         # Remove all possible reslicing and set default planes for default 2D windows
         nodes = slicer.util.getNodes("vtkMRMLSliceNode*")
         for node in nodes.values():
@@ -576,14 +601,35 @@ class MIPViewerWidget(object):
         sliceLogic = appLogic.GetSliceLogic(sliceNode)
         sliceLayerLogic = sliceLogic.GetBackgroundLayer()
         reslice = sliceLayerLogic.GetReslice()
+        self.__backgroundOverrides__.pop(sliceNode.GetLayoutName(), None)
 
         if operation == self.OPERATION_NONE:
             reslice.SetSlabMode(0)          # This alone not always works
             reslice.SetSlabNumberOfSlices(1)
+            sliceNode.Modified()
+            return
+
+        # Get the value from the slider matching this operation
+        spacing = self.spacingSliderItems[operation][1].value / 10.0
+        volume = self.__getBackgroundVolume__()
+        axis = self.__getProjectionAxis__(volume, plane)
+        if axis is not None:
+            numberOfSlices = int(spacing / volume.GetSpacing()[axis])
         else:
-            # Get the value from the slider matching this operation
-            spacing = self.spacingSliderItems[operation][1].value / 10.0
-            reslice.SetSlabNumberOfSlices(self.__calculateSlices__(spacing, plane))
+            numberOfSlices = self.__calculateSlices__(spacing, plane)
+        if numberOfSlices > 1 and axis is not None and not self.__previewMode__:
+            # Display a precomputed projection of the volume. The slab is not recalculated in every render
+            projectionOperation = {self.OPERATION_MIP: SlabProjection.OPERATION_MAX,
+                                   self.OPERATION_MinIP: SlabProjection.OPERATION_MIN,
+                                   self.OPERATION_MEAN: SlabProjection.OPERATION_MEAN}[operation]
+            projectionNode = self.slabProjectionCache.getProjectionNode(volume, axis, numberOfSlices,
+                                                                        projectionOperation)
+            self.__backgroundOverrides__[sliceNode.GetLayoutName()] = projectionNode.GetID()
+            reslice.SetSlabMode(0)
+            reslice.SetSlabNumberOfSlices(1)
+        else:
+            # Oblique volume or spacing slider being moved. Reslice in slab mode
+            reslice.SetSlabNumberOfSlices(numberOfSlices)
             if operation == self.OPERATION_MIP:
                 reslice.SetSlabModeToMax()
             elif operation == self.OPERATION_MinIP:
@@ -593,6 +639,38 @@ class MIPViewerWidget(object):
 
         sliceNode.Modified()
 
+    def __getBackgroundVolume__(self):
+        """ Get the original volume displayed in the 2D windows (even if the red window is displaying a projection)
+        :return: volume node or None
+        """
+        compNode = slicer.mrmlScene.GetNodeByID("vtkMRMLSliceCompositeNodeRed")
+        volumeId = compNode.GetBackgroundVolumeID()
+        if not volumeId:
+            return None
+        return slicer.mrmlScene.GetNodeByID(self.slabProjectionCache.getSourceNodeId(volumeId))
+
+    def __getProjectionAxis__(self, volume, plane):
+        """ Get the IJK axis of the volume that is perpendicular to the plane
+        :param volume: volume node
+        :param plane: PLANE_AXIAL, PLANE_SAGITTAL or PLANE_CORONAL
+        :return: SlabProjection.AXIS_I, AXIS_J, AXIS_K or None if the volume is not aligned with the plane
+        """
+        if volume is None or volume.GetImageData() is None:
+            return None
+        # Normal of the plane in RAS
+        if plane == self.PLANE_SAGITTAL:
+            row = 0
+        elif plane == self.PLANE_CORONAL:
+            row = 1
+        else:
+            row = 2
+        directions = vtk.vtkMatrix4x4()
+        volume.GetIJKToRASDirectionMatrix(directions)
+        for axis in (SlabProjection.AXIS_I, SlabProjection.AXIS_J, SlabProjection.AXIS_K):
+            if abs(abs(directions.GetElement(row, axis)) - 1.0) < 1e-3:
+                return axis
+        return None
+
     # def __calculateSpacingMm__(self):
     #     """ Calculate the mm that are selected by the user when he adjusts the slider value.
     #     It also sets the text of the slider (value in mm)
@@ -627,11 +705,9 @@ class MIPViewerWidget(object):
         else:
             position = 2
         # Get the spacing of the displayed volume
-        compNode = slicer.mrmlScene.GetNodeByID("vtkMRMLSliceCompositeNodeRed")
-        volumeId = compNode.GetBackgroundVolumeID()
-        if volumeId == "":
+        volume = self.__getBackgroundVolume__()
+        if volume is None:
             return 0
-        volume = slicer.mrmlScene.GetNodeByID(volumeId)
         slices = spacing / volume.GetSpacing()[position]
         return int(slices)
 
@@ -723,6 +799,24 @@ class MIPViewerWidget(object):
         """
         for row in self.spacingSliderItems.values():
             row[2].setText("{0} mm".format(row[1].value / 10.0))
+        # Computing the projection volume for every intermediate value would block the slider
+        self.__previewMode__ = True
+        try:
+            self.executeCurrentSettings()
+        finally:
+            self.__previewMode__ = False
+        if any(row[1].isSliderDown() for row in self.spacingSliderItems.values()):
+            # The projection will be computed when the slider is released
+            self.spacingTimer.stop()
+        else:
+            # Keyboard, mouse wheel, page steps...
+            self.spacingTimer.start()
+
+    def __onSpacingSettled__(self):
+        """ The spacing slider was released or its value has not changed for a while. Display the precomputed
+        projections for the current spacing
+        """
+        self.spacingTimer.stop()
         self.executeCurrentSettings()
 
     def __onCrosshairCheckChanged__(self, checkedState):
@@ -1,6 +1,8 @@
 import qt
 
 import os
+import re
+import base64
 import shutil
 import logging
 import tempfile
@@ -15,7 +17,7 @@ class PdfReporter(object):
 
 
     def printPdf(self, htmlTemplatePath, values, callbackFunction, pdfOutputPath=None,
-                 imagesFileList=None, tempHtmlFolder=None,):
+                 imagesFileList=None, tempHtmlFolder=None, imagesBuffers=None):
         """
         Print a pdf file with the html stored in htmlPath and the specified values
         :param htmlTemplatePath: path to the html file that contains the template
@@ -24,6 +26,8 @@ class PdfReporter(object):
         :param pdfOutputPath: path to the pdf file that will be created (if none, it will be saved in a temp file)
         :param imagesFileList: list of full paths to images that may be needed to generate the report
         :param tempHtmlFolder: folder where all the intermediate files will be stored. If none, a temporary folder will be used
+        :param imagesBuffers: dictionary of in-memory PNG images (file name used in the html -> PNG bytes). These images
+            are never written to disk
         """
         if tempHtmlFolder is None:
             tempHtmlFolder = tempfile.mkdtemp()
@@ -43,7 +47,12 @@ class PdfReporter(object):
                 fileName = os.path.basename(im)
                 shutil.copy(im, os.path.join(tempHtmlFolder, fileName))
 
+        if imagesBuffers is None:
+            imagesBuffers = {}
+
         if hasattr(qt,'QWebView'):
+            # Embed the in-memory images in the html
+            html = self.__embedImages__(html, imagesBuffers)
             # Save the file in the temporary folder
             htmlPath = os.path.join(tempHtmlFolder, "temp__.html")
             with open(htmlPath, "w") as f:
@@ -65,6 +74,11 @@ class PdfReporter(object):
             doc = qt.QTextDocument()
             doc.setHtml(html)
             doc.baseUrl = qt.QUrl.fromLocalFile(tempHtmlFolder+"/")
+            # In-memory images are registered as document resources
+            for fileName, pngBytes in imagesBuffers.items():
+                image = qt.QImage()
+                image.loadFromData(qt.QByteArray(pngBytes), "PNG")
+                doc.addResource(qt.QTextDocument.ImageResource, qt.QUrl(fileName), image)
             doc.setPageSize(qt.QSizeF(printer.pageRect().size()))  # hide the page number
             doc.print(printer)
 
@@ -72,6 +86,25 @@ class PdfReporter(object):
             self.__callbackFunction__(self.__pdfOutputPath__)
             self.__callbackFunction__ = None
 
+    @staticmethod
+    def __embedImages__(html, imagesBuffers):
+        """ Replace the src attributes that reference in-memory images with data uris (the rest of the html is
+        not modified, even if it contains the file names)
+        :param html: html text
+        :param imagesBuffers: dictionary of file name -> PNG bytes
+        :return: html text
+        """
+        if not imagesBuffers:
+            return html
+
+        def replaceSrc(match):
+            pngBytes = imagesBuffers.get(match.group(3))
+            if pngBytes is None:
+                return match.group(0)
+            return match.group(1) + match.group(2) + "data:image/png;base64," \
+                + base64.b64encode(pngBytes).decode("ascii") + match.group(2)
+        return re.sub(r"""(\bsrc\s*=\s*)(["'])(.*?)\2""", replaceSrc, html, flags=re.IGNORECASE)
+
     def __webViewFormLoadedCallback__(self, loaded):
         if loaded:
             #outputFileName = os.path.join(self.getCurrentDataFolder(), "report.pdf")
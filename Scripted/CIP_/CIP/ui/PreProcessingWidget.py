@@ -3,6 +3,7 @@ import csv, os, time, pprint
 from __main__ import qt, ctk, slicer
 
 from CIP.logic.SlicerUtil import SlicerUtil
+from CIP.logic.volume_pyramid import VolumePyramid
 
 class PreProcessingWidget():
     
@@ -233,7 +234,16 @@ class PreProcessingWidget():
         """
         self.LMCreationFrame.setEnabled(enabled)
         
-    def filterInputCT(self,inputCT):        
+    def filterInputCT(self,inputCT):
+        method, options = self.getFilterOptions()
+        if method is not None:
+            self.logic.filterCT(inputCT,method,**options)
+
+    def getFilterOptions(self):
+        """ Get the filtering method and its parameters based on the current options in the GUI
+        :return: tuple with the method ('NLM', 'Median', 'Gaussian' or None) and a dictionary of keyword arguments
+        for PreProcessingLogic.filterCT
+        """
         if self.NLMFilterRadioButton.checked:
             method = 'NLM'
             
@@ -253,7 +263,7 @@ class PreProcessingWidget():
                 noise_power = 5.0
                 nlm_h = 1.2
                 
-            self.logic.filterCT(inputCT,method,s_rad=sr,c_rad=cr,noisePower=noise_power,h=nlm_h,ps=nlm_ps)
+            return method, dict(s_rad=sr,c_rad=cr,noisePower=noise_power,h=nlm_h,ps=nlm_ps)
             
         elif self.MedianFilterRadioButton.checked: 
             method = 'Median'
@@ -267,7 +277,7 @@ class PreProcessingWidget():
             if self.Filt2DOption.checked: # 2D filtering
                 neighborhood[2] = 1
             
-            self.logic.filterCT(inputCT,method,n_rad=neighborhood)
+            return method, dict(n_rad=neighborhood)
             
         elif self.GaussianFilterRadioButton.checked:
             method = 'Gaussian'            
@@ -277,15 +287,43 @@ class PreProcessingWidget():
                 s = 2.0
             elif self.HeavyOption.checked: # Heavy strength
                 s = 3.0
-            self.logic.filterCT(inputCT,method,sigma=s)
+            return method, dict(sigma=s)
+        return None, {}
+
+    def getLMSpeed(self):
+        """ Speed selected in the GUI for the label map creation ('Fast' or 'Slow')
+        """
+        if self.FastOption.checked:
+            return 'Fast'
+        return 'Slow'
         
     def createPartialLM(self,inputCT,labelMap):
-        speed = 'Slow'
-        if self.FastOption.checked:
-            speed = 'Fast'
-        self.logic.generatePartialLungLabelMap(inputCT,labelMap,speed)
+        self.logic.generatePartialLungLabelMap(inputCT,labelMap,self.getLMSpeed())
+        self.__setBackgroundVolume__(inputCT)
+
+    def addFilterStage(self, pipeline, inputCT):
+        """ Add to a CliPipeline the filtering of inputCT (in place) with the current options in the GUI.
+        Asynchronous equivalent of filterInputCT
+        :param pipeline: CliPipeline
+        :param inputCT: CT volume node
+        """
+        method, options = self.getFilterOptions()
+        if method is not None:
+            self.logic.addFilterCTStage(pipeline, inputCT, method, **options)
+
+    def addPartialLMStages(self, pipeline, inputCT, labelMap):
+        """ Add to a CliPipeline the stages to create a partial lung label map with the current options in the GUI.
+        Asynchronous equivalent of createPartialLM
+        :param pipeline: CliPipeline
+        :param inputCT: CT volume node
+        :param labelMap: output label map node
+        """
+        self.logic.addPartialLungLabelMapStages(pipeline, inputCT, labelMap, self.getLMSpeed())
+        pipeline.addFunctionStage("Update views", lambda: self.__setBackgroundVolume__(inputCT))
+
+    def __setBackgroundVolume__(self, volumeNode):
         for color in ['Red', 'Yellow', 'Green']:
-            slicer.app.layoutManager().sliceWidget(color).sliceLogic().GetSliceCompositeNode().SetBackgroundVolumeID(inputCT.GetID())
+            slicer.app.layoutManager().sliceWidget(color).sliceLogic().GetSliceCompositeNode().SetBackgroundVolumeID(volumeNode.GetID())
         
     def warningMessageForLM(self):
         answer = qt.QMessageBox.question(slicer.util.mainWindow(),self.__moduleName__, 'Do you want to create a lung label map?', qt.QMessageBox.Yes | qt.QMessageBox.No)
@@ -299,8 +337,27 @@ class PreProcessingLogic(object):
         self.__moduleName__ = moduleName
            
     def filterCT(self,input_ct,method,s_rad=[3,3,3],c_rad=[5,5,5],noisePower=3.0,h=0.8,ps=2.0,n_rad=[1,1,1],sigma=1.0):
+        cliModule, parameters = self.getFilterCTCli(input_ct,method,s_rad=s_rad,c_rad=c_rad,noisePower=noisePower,h=h,
+                                                    ps=ps,n_rad=n_rad,sigma=sigma)
+        if cliModule is not None:
+            slicer.cli.run(cliModule,None,parameters,wait_for_completion=True)
+
+    def addFilterCTStage(self, pipeline, input_ct, method, **kwargs):
+        """ Add to a CliPipeline the filtering of input_ct (in place). Asynchronous equivalent of filterCT
+        :param pipeline: CliPipeline
+        :param input_ct: CT volume node
+        :param method: 'NLM', 'Median' or 'Gaussian'
+        :param kwargs: filter parameters (see filterCT)
+        """
+        cliModule, parameters = self.getFilterCTCli(input_ct, method, **kwargs)
+        if cliModule is not None:
+            pipeline.addCliStage("Filtering ({})".format(method), cliModule, parameters)
+
+    def getFilterCTCli(self,input_ct,method,s_rad=[3,3,3],c_rad=[5,5,5],noisePower=3.0,h=0.8,ps=2.0,n_rad=[1,1,1],sigma=1.0):
+        """ Get the CLI module and the parameters needed to filter a CT (in place)
+        :return: tuple with CLI module and dictionary of parameters (None, None if the method is unknown)
+        """
         if method=='NLM': # NLM Filter
-            generatenlmfilteredimage = slicer.modules.generatenlmfilteredimage
             parameters = {
                       "ctFileName": input_ct.GetID(),
                       "outputFileName": input_ct.GetID(),
@@ -310,24 +367,23 @@ class PreProcessingLogic(object):
                       "iH": h,
                       "iPs": ps,
                       }
-            slicer.cli.run(generatenlmfilteredimage,None,parameters,wait_for_completion=True)
+            return slicer.modules.generatenlmfilteredimage, parameters
 
         elif method=='Median': # Median Filter
-            medianimagefilter = slicer.modules.medianimagefilter
             parameters = {
                         "inputVolume": input_ct.GetID(),
                         "outputVolume": input_ct.GetID(),
                         "neighborhood": n_rad, 
                         }
-            slicer.cli.run(medianimagefilter,None,parameters,wait_for_completion=True)
+            return slicer.modules.medianimagefilter, parameters
         elif method=='Gaussian':
-            gaussianblurimagefilter = slicer.modules.gaussianblurimagefilter       
             parameters = {
                       "inputVolume": input_ct.GetID(),
                       "outputVolume": input_ct.GetID(),
                       "sigma": sigma,
                       }
-            slicer.cli.run(gaussianblurimagefilter,None,parameters,wait_for_completion=True)
+            return slicer.modules.gaussianblurimagefilter, parameters
+        return None, None
 
     def generatePartialLungLabelMap(self, input_ct, label_map, speed):
         """Create partial lung label map from input ct image
@@ -338,61 +394,54 @@ class PreProcessingLogic(object):
         if speed=='Fast':          
             inputNode = self.downsampleCT(input_ct)
                       
-        generatepartiallunglabelmap = slicer.modules.generatepartiallunglabelmap
-#        labelNode = slicer.mrmlScene.AddNode(slicer.vtkMRMLLabelMapVolumeNode())
-#        self.CTlabelNode.SetName(self.CTNode.GetName() + '_partialLungLabelMap')
-        parameters = {
-              "ctFileName": inputNode.GetID(),
-              "outputLungMaskFileName": label_map.GetID(),	  
-              }
-        slicer.cli.run(generatepartiallunglabelmap,None,parameters,wait_for_completion=True)
+        slicer.cli.run(slicer.modules.generatepartiallunglabelmap,None,
+                       self.getPartialLungLabelMapParameters(inputNode, label_map),wait_for_completion=True)
     
         if speed=='Fast':
-            label_map = self.upsampleLabel(label_map)
-            slicer.mrmlScene.RemoveNode(inputNode)
-        
+            label_map = self.upsampleLabel(label_map, input_ct)
+
+    def addPartialLungLabelMapStages(self, pipeline, input_ct, label_map, speed):
+        """ Add to a CliPipeline the stages needed to create a partial lung label map.
+        Asynchronous equivalent of generatePartialLungLabelMap
+        :param pipeline: CliPipeline
+        :param input_ct: ct image
+        :param label_map: node for created labelmap
+        :param speed: 'Fast' or 'Slow'
+        """
+        if speed=='Fast':
+            pipeline.addFunctionStage("Downsampling CT", lambda: self.downsampleCT(input_ct))
+            # The pyramid level is cached, so it is just computed once
+            pipeline.addCliStage("Creating label map", slicer.modules.generatepartiallunglabelmap,
+                                 lambda: self.getPartialLungLabelMapParameters(self.downsampleCT(input_ct), label_map))
+            pipeline.addFunctionStage("Upsampling label map", lambda: self.upsampleLabel(label_map, input_ct))
+        else:
+            pipeline.addCliStage("Creating label map", slicer.modules.generatepartiallunglabelmap,
+                                 self.getPartialLungLabelMapParameters(input_ct, label_map))
+
+    def getPartialLungLabelMapParameters(self, input_ct, label_map):
+        """ Parameters for the generatepartiallunglabelmap CLI
+        :param input_ct: ct image
+        :param label_map: node for created labelmap
+        :return: dictionary of parameters
+        """
+        return {
+              "ctFileName": input_ct.GetID(),
+              "outputLungMaskFileName": label_map.GetID(),	  
+              }
+
     def downsampleCT(self, input_image):
-        """Downsample input image by factor 2
+        """Downsample input image by factor 2 (in plane).
+        The result is a level of the multi-resolution pyramid of the volume, so it is cached and it must not be
+        removed by the caller
         :params input_image: image to downsample
+        :return: downsampled scalar node
         """
-        oldSpacing = input_image.GetSpacing()
-    
-        newSpacing = []    
-        newSpacing.append(oldSpacing[0]*2)
-        newSpacing.append(oldSpacing[1]*2)
-        newSpacing.append(oldSpacing[2])
-    
-        resamplescalarvolume = slicer.modules.resamplescalarvolume
-        upsampledNode = slicer.mrmlScene.AddNode(slicer.vtkMRMLScalarVolumeNode())
-    
-        parameters = {
-              "outputPixelSpacing": newSpacing,
-              "InputVolume": input_image.GetID(),
-              "OutputVolume": upsampledNode.GetID(),
-        }
-        slicer.cli.run(resamplescalarvolume,None,parameters,wait_for_completion=True)    
-        return upsampledNode
+        return VolumePyramid.getLevelNode(input_image, 2)
         
-    def upsampleLabel(self, labelMap):
-        """Upsample input image by factor 2
-        :params input_image: image to downsample
+    def upsampleLabel(self, labelMap, referenceVolume):
+        """Upsample (in place) a labelmap created from a downsampled image to the geometry of the original image
+        :params labelMap: labelmap to upsample
+        :params referenceVolume: original (not downsampled) image
+        :return: labelMap
         """
-        
-        oldSpacing = labelMap.GetSpacing()
-    
-        newSpacing = []    
-        newSpacing.append(oldSpacing[0]/2)
-        newSpacing.append(oldSpacing[1]/2)
-        newSpacing.append(oldSpacing[2])
-    
-        resamplescalarvolume = slicer.modules.resamplescalarvolume
-    
-        parameters = {
-              "outputPixelSpacing": newSpacing,
-              "InputVolume": labelMap.GetID(),
-              "OutputVolume": labelMap.GetID(),
-              "interpolationType":'nearestNeighbor',
-              }
-        slicer.cli.run(resamplescalarvolume,None,parameters,wait_for_completion=True)
-    
-        return labelMap
\ No newline at end of file
+        return VolumePyramid.upsampleLabelmap(labelMap, referenceVolume)
@@ -1,13 +1,27 @@
 # from .CIP_EditorWidget import CIP_EditorWidget
 # from .CIP_EditBox import *
-from .CaseReportsWidget import *
-from .PreProcessingWidget import *
-from .MIPViewerWidget import *
-from .CollapsibleMultilineText import *
-from .PdfReporter import *
 #from ACIL_GetImage.CaseNavigatorWidget import *
 #from AutoUpdateWidget import AutoUpdateWidget
 
+# The widgets are loaded on demand (first access to any of their public names) to reduce the startup time
+# of the CIP modules. See CIP/logic/lazy_loader.py
+from CIP.logic.lazy_loader import LazyPackage
+
+LazyPackage.install(__name__,
+    exports={
+        "CaseReportsWidget": "CaseReportsWidget",
+        "CaseReportsLogic": "CaseReportsWidget",
+        "CaseReportsWindow": "CaseReportsWidget",
+        "PreProcessingWidget": "PreProcessingWidget",
+        "PreProcessingLogic": "PreProcessingWidget",
+        "MIPViewerWidget": "MIPViewerWidget",
+        "CollapsibleMultilineText": "CollapsibleMultilineText",
+        "PdfReporter": "PdfReporter",
+    },
+    submodules=["CaseReportsWidget", "PreProcessingWidget", "MIPViewerWidget", "CollapsibleMultilineText",
+                "PdfReporter"]
+)
+
 # import os
 # CIP_ICON_DIR = os.path.realpath(os.path.dirname(os.path.realpath(__file__)) + '/../Resources/Icons')
 # del os
@@ -15,6 +15,7 @@ from slicer.ScriptedLoadableModule import *
 
 from CIP.logic.SlicerUtil import SlicerUtil
 from CIP.logic import Util
+from CIP.logic.timer import GlobalProfiler
 from CIP_BodyComposition_logic import BodyCompositionParameters
 from CIP.ui import CaseReportsWidget
 import CIP.ui as CIPUI
@@ -489,7 +490,7 @@ class CIP_BodyCompositionWidget(ScriptedLoadableModuleWidget):
     def __loadColormapNode__(self):
         """ Load the colormap node for the bodycomposition structures and set the value to the self.colorTableNode property
         """
-        colorTableNodes = slicer.util.getNodes("CIP_BodyComposition_ColorMap*")
+        colorTableNodes = SlicerUtil.getNodesByPattern("CIP_BodyComposition_ColorMap*")
 
         if len(colorTableNodes) == 0:
             # Load the node from disk
@@ -1175,6 +1176,8 @@ class CIP_BodyCompositionWidget(ScriptedLoadableModuleWidget):
         # Reset the region/type comboboxes to be adjusted properly with the next volume
         self.regionComboBox.currentIndex = 0
         self.resetModuleState()
+        # Release the label extents of the closed labelmaps
+        Util.clear_label_caches()
 
 
 #
@@ -1199,10 +1202,11 @@ class CIP_BodyCompositionLogic(ScriptedLoadableModuleLogic):
     def getLabelmapSlices(self, labelmapNode):
         """For each label map, get the slices where it appears. Store the result in labelmapSlices object
         (it will be used later for statistics)"""
-        numpyArray = slicer.util.array(labelmapNode.GetID())
-        self.labelmapSlices = Util.get_labelmap_slices(numpyArray)
+        extents = Util.get_label_extents_from_node(labelmapNode)
+        self.labelmapSlices = dict((label, extent.slices) for label, extent in extents.items() if label > 0)
         return self.labelmapSlices
 
+    @GlobalProfiler.profile_run("BodyCompositionStatistics")
     def calculateStatistics(self, grayscaleNode, labelNode, labelmapSlices=None, callbackStepFunction=None):
         # Get the numpy arrays of both nodes. We do not use Slicer function beacuse we will need the imageData node to apply preprocessing vtk filters
         intensityImageData = grayscaleNode.GetImageData()
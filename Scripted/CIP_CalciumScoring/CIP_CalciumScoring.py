@@ -2,6 +2,7 @@ import os, sys, string
 from collections import OrderedDict
 import unittest
 import vtk, qt, ctk, slicer
+import vtk.util.numpy_support
 import numpy as np
 import SimpleITK as sitk
 import sitkUtils
@@ -13,6 +14,7 @@ from CIP.ui import CaseReportsWidget
 from CIP.ui import PreProcessingWidget
 from CIP.ui import PdfReporter
 from CIP.logic.SlicerUtil import SlicerUtil
+from CIP.logic import Util
 
 #
 # Calc Scoring
@@ -118,9 +120,11 @@ class CIP_CalciumScoringWidget(ScriptedLoadableModuleWidget):
         self.transformPolyData = vtk.vtkTransformPolyDataFilter()
 
         self.selectedLabelList = []
+        self.tableLabels = []
+        self.selectedComponents = set()
         self.labelScores = []
         self.selectedLabels = {}
-        self.modelNodes = []
+        self.modelNodes = {}
         self.voxelVolume = 1.
         self.sx = 1.
         self.sy = 1.
@@ -156,7 +160,7 @@ class CIP_CalciumScoringWidget(ScriptedLoadableModuleWidget):
         # Instantiate and connect widgets ...
         ScriptedLoadableModuleWidget.setup(self)
 
-        #self.logic = CIP_CalciumScoringLogic()
+        self.logic = CIP_CalciumScoringLogic()
 
         #
         # Parameters Area
@@ -321,10 +325,13 @@ class CIP_CalciumScoringWidget(ScriptedLoadableModuleWidget):
           self.selectLabels.setItem(row,1+ii,item1)
 
     def handleItemClicked(self, item):
+        label = self.tableLabels[item.row()]
         if item.checkState() == qt.Qt.Checked:
             self.selectedLabelList[item.row()] = 1
+            self.selectedComponents.add(label)
         else:
             self.selectedLabelList[item.row()] = 0
+            self.selectedComponents.discard(label)
         #print "LIST=", self.selectedLabelList
         self.computeTotalScore()
         self.updateModels()
@@ -343,7 +350,7 @@ class CIP_CalciumScoringWidget(ScriptedLoadableModuleWidget):
 
     def updateModels(self):
         for n in range(0, len(self.selectedLabelList)):
-            model = self.modelNodes[n]
+            model = self.modelNodes[self.tableLabels[n]]
             dnode = model.GetDisplayNode()
             rgb = [1,0,0]
             if self.selectedLabelList[n] == 1:
@@ -415,19 +422,25 @@ class CIP_CalciumScoringWidget(ScriptedLoadableModuleWidget):
 
     def onMinSizeChanged(self, value):
         self.MinimumLesionSize = value
-        #self.createModels()
+        # Live update once the lesions have been computed (the size filter does not relabel anything)
+        if self.logic.thresholdRange is not None:
+            self.updateSizeFilter()
 
     def onMaxSizeChanged(self, value):
         self.MaximumLesionSize = value
-        #self.createModels()
+        if self.logic.thresholdRange is not None:
+            self.updateSizeFilter()
 
     def onThresholdMinChanged(self, value):
         self.ThresholdMin = value
-        #self.createModels()
+        # Live update once the lesions have been computed (only the affected components are relabelled)
+        if self.logic.thresholdRange is not None:
+            self.createModels()
 
     def onThresholdMaxChanged(self, value):
         self.ThresholdMax = value
-        #self.createModels()
+        if self.logic.thresholdRange is not None:
+            self.createModels()
 
     def onROIChangedEvent(self, observee, event):
         pass
@@ -437,12 +450,20 @@ class CIP_CalciumScoringWidget(ScriptedLoadableModuleWidget):
         self.createModels()
 
     def deleteModels(self):
-        for m in self.modelNodes:
-            m.SetAndObservePolyData(None)
-            slicer.mrmlScene.RemoveNode(m.GetDisplayNode())
-            slicer.mrmlScene.RemoveNode(m)
-        self.modelNodes = []
+        for label in list(self.modelNodes.keys()):
+            self.deleteModel(label)
+        self.modelNodes = {}
         self.selectedLabels = {}
+        self.selectedComponents = set()
+
+    def deleteModel(self, label):
+        m = self.modelNodes.pop(label, None)
+        if m is None:
+            return
+        self.selectedLabels.pop(m.GetPolyData(), None)
+        m.SetAndObservePolyData(None)
+        slicer.mrmlScene.RemoveNode(m.GetDisplayNode())
+        slicer.mrmlScene.RemoveNode(m)
 
     def PickProp(self, object, event):  
         # print "PICK"
@@ -493,114 +514,157 @@ class CIP_CalciumScoringWidget(ScriptedLoadableModuleWidget):
         return score
 
     def createModels(self):
-        self.deleteModels()
-        for sr in self.summary_reports:
-            self.labelScores[sr]=[]
-        self.selectedLabelList = []
+        """ Label the calcified lesions in the ROI and create a model for every lesion in the size range.
+        The cropped ROI and the components are cached in the logic, so only the changes are processed
+        """
         if self.calcificationType == 0 and self.volumeNode and self.roiNode:
             #print 'in Heart Create Models'
-
-            slicer.vtkSlicerCropVolumeLogic().CropVoxelBased(self.roiNode, self.volumeNode, self.croppedNode)
-            croppedImage    = sitk.ReadImage( sitkUtils.GetSlicerITKReadWriteAddress(self.croppedNode.GetName()))
-            thresholdImage  = sitk.BinaryThreshold(croppedImage,self.ThresholdMin, self.ThresholdMax, 1, 0)
-            connectedCompImage  =sitk.ConnectedComponent(thresholdImage, True)
-            relabelImage  =sitk.RelabelComponent(connectedCompImage)
-            labelStatFilter =sitk.LabelStatisticsImageFilter()
-            labelStatFilter.Execute(croppedImage, relabelImage)
-            if relabelImage.GetPixelID() != sitk.sitkInt16:
-                relabelImage = sitk.Cast( relabelImage, sitk.sitkInt16 )
-            sitk.WriteImage( relabelImage, sitkUtils.GetSlicerITKReadWriteAddress(self.labelsNode.GetName()))
-
-            nLabels = labelStatFilter.GetNumberOfLabels()
-            #print "Number of labels = ", nLabels
-            self.totalScore = 0
-            count = 0
-            #Computation of the score follows this paper:
-            #C. H McCollough, Radiology, 243(2), 2007
-            
-            for n in range(0,nLabels):
-                max = labelStatFilter.GetMaximum(n)
-                mean = labelStatFilter.GetMean(n)
-                size = labelStatFilter.GetCount(n)
-                volume = size*self.voxelVolume
-                if volume > self.MaximumLesionSize:
-                    continue
-
-                if volume < self.MinimumLesionSize:
-                    nLabels = n+1
-                    break
-                
-                density_score = self.computeDensityScore(max)
-
-                #Agatston score is \sum_i area_i * density_score_i
-                #For now we assume that all the plaques have the same density score
-                score = size*(self.sx*self.sy)*density_score
-                
-                mass_score = mean*volume
-
-                #print "label = ", n, "  max = ", max, " score = ", score, " voxels = ", size
-                self.labelScores["Agatston Score"].append(score)
-                self.labelScores["Mass Score"].append(mass_score)
-                self.labelScores["Volume"].append(volume)
-                self.selectedLabelList.append(0)
-                self.marchingCubes.SetInputData(self.labelsNode.GetImageData())
-                self.marchingCubes.SetValue(0, n)
-                self.marchingCubes.Update()
-                    
-                self.transformPolyData.SetInputData(self.marchingCubes.GetOutput())
-                mat = vtk.vtkMatrix4x4()
-                self.labelsNode.GetIJKToRASMatrix(mat)
-                trans = vtk.vtkTransform()
-                trans.SetMatrix(mat)
-                self.transformPolyData.SetTransform(trans)
-                self.transformPolyData.Update()
-                poly = vtk.vtkPolyData()
-                poly.DeepCopy(self.transformPolyData.GetOutput())
-                    
-                modelNode = slicer.vtkMRMLModelNode()
-                slicer.mrmlScene.AddNode(modelNode)
-                dnode = slicer.vtkMRMLModelDisplayNode()
-                slicer.mrmlScene.AddNode(dnode)
-                modelNode.AddAndObserveDisplayNodeID(dnode.GetID())
-                modelNode.SetAndObservePolyData(poly)
-
-                ct=slicer.mrmlScene.GetNodeByID('vtkMRMLColorTableNodeLabels')
-                rgb = [0,0,0]
-                ct.GetLookupTable().GetColor(count+1,rgb)
-                dnode.SetColor(rgb)
-                #Enable Slice intersection
-                dnode.SetSliceDisplayMode(0)
-                dnode.SetSliceIntersectionVisibility(1)
-
-                self.addLabel(count, rgb, [score,mass_score,volume,mean,max])
-                count = count+1
-
-                self.modelNodes.append(modelNode)
-                self.selectedLabels[poly] = n
-                #a = slicer.util.array(tn.GetID())
-                #sa = sitk.GetImageFromArray(a)
-            for sr in self.summary_reports:
-                self.scoreField[sr].setText(self.totalScores[sr])
+            if self.logic.updateCroppedVolume(self.volumeNode, self.roiNode, self.croppedNode):
+                self.deleteModels()
+            self.updateComponents()
         else:
             print ("not implemented")
 
+    def updateComponents(self):
+        """ Relabel the components after a threshold change (only the affected components are processed)
+        """
+        removed, added = self.logic.updateComponents(self.ThresholdMin, self.ThresholdMax)
+        for label in removed:
+            self.deleteModel(label)
+            self.selectedComponents.discard(label)
+        sitk.WriteImage(self.logic.labelsImage(), sitkUtils.GetSlicerITKReadWriteAddress(self.labelsNode.GetName()))
+        self.updateSizeFilter()
+
+    def updateSizeFilter(self):
+        """ Show the models of the lesions in the current size range and refresh the table.
+        The components are not recomputed
+        """
+        self.selectedLabelList = []
+        self.tableLabels = []
+        for sr in self.summary_reports:
+            self.labelScores[sr] = []
+
+        # Largest lesions first (same order as sitk.RelabelComponent)
+        components = sorted(self.logic.components.values(), key=lambda c: c.count, reverse=True)
+        count = 0
+        #Computation of the score follows this paper:
+        #C. H McCollough, Radiology, 243(2), 2007
+        for component in components:
+            volume = component.count * self.voxelVolume
+            visible = self.MinimumLesionSize <= volume <= self.MaximumLesionSize
+            if not visible:
+                if component.label in self.modelNodes:
+                    self.modelNodes[component.label].GetDisplayNode().SetVisibility(False)
+                continue
+
+            density_score = self.computeDensityScore(component.max)
+            #Agatston score is \sum_i area_i * density_score_i
+            #For now we assume that all the plaques have the same density score
+            score = component.count * (self.sx * self.sy) * density_score
+            mass_score = component.mean * volume
+
+            self.labelScores["Agatston Score"].append(score)
+            self.labelScores["Mass Score"].append(mass_score)
+            self.labelScores["Volume"].append(volume)
+            self.selectedLabelList.append(1 if component.label in self.selectedComponents else 0)
+            self.tableLabels.append(component.label)
+
+            if component.label not in self.modelNodes:
+                self.createModel(component.label)
+            dnode = self.modelNodes[component.label].GetDisplayNode()
+            dnode.SetVisibility(True)
+
+            ct = slicer.mrmlScene.GetNodeByID('vtkMRMLColorTableNodeLabels')
+            rgb = [0,0,0]
+            ct.GetLookupTable().GetColor(count+1,rgb)
+            self.addLabel(count, rgb, [score, mass_score, volume, component.mean, component.max])
+            if self.selectedLabelList[count] == 1:
+                self.selectLabels.item(count, 0).setCheckState(qt.Qt.Checked)
+            count = count+1
+
+        self.selectLabels.setRowCount(count)
+        self.computeTotalScore()
+        self.updateModels()
+
+    def createModel(self, label):
+        """ Create the model of a single component. Marching cubes only runs in the bounding box of the component
+        :param label: component label
+        """
+        self.marchingCubes.SetInputData(self.logic.componentImageData(label))
+        self.marchingCubes.SetValue(0, 1)
+        self.marchingCubes.Update()
+
+        self.transformPolyData.SetInputData(self.marchingCubes.GetOutput())
+        mat = vtk.vtkMatrix4x4()
+        self.croppedNode.GetIJKToRASMatrix(mat)
+        trans = vtk.vtkTransform()
+        trans.SetMatrix(mat)
+        self.transformPolyData.SetTransform(trans)
+        self.transformPolyData.Update()
+        poly = vtk.vtkPolyData()
+        poly.DeepCopy(self.transformPolyData.GetOutput())
+
+        modelNode = slicer.vtkMRMLModelNode()
+        slicer.mrmlScene.AddNode(modelNode)
+        dnode = slicer.vtkMRMLModelDisplayNode()
+        slicer.mrmlScene.AddNode(dnode)
+        modelNode.AddAndObserveDisplayNodeID(dnode.GetID())
+        modelNode.SetAndObservePolyData(poly)
+        #Enable Slice intersection
+        dnode.SetSliceDisplayMode(0)
+        dnode.SetSliceIntersectionVisibility(1)
+
+        self.modelNodes[label] = modelNode
+        self.selectedLabels[poly] = label
+
 
 #
 # CIP_CalciumScoringLogic
 #
 
+class CalcifiedComponent(object):
+    """ Connected component of the thresholded ROI.
+    The bounding box is stored in numpy (z, y, x) order, in the ijk space of the cropped volume
+    """
+    def __init__(self, label, count, mean, maximum, bbox):
+        self.label = label
+        self.count = count
+        self.mean = mean
+        self.max = maximum
+        self.bbox = bbox
+
+    def slices(self, padding=0, shape=None):
+        """ Numpy slices that contain the component
+        :param padding: number of voxels to add at each side (clipped to shape when it is provided)
+        :param shape: shape of the array that is going to be sliced
+        :return: tuple of slices (z, y, x)
+        """
+        return Util.bounding_box_slices(self.bbox, padding, shape)
+
+
 class CIP_CalciumScoringLogic(ScriptedLoadableModuleLogic):
     """This class should implement all the actual
     computation done by your module.  The interface
     should be such that other python code can import
     this class and make use of the functionality without
     requiring an instance of the Widget
+
+    The cropped ROI and its connected components are cached, so that narrowing the threshold range only
+    relabels the components that actually changed, and the lesion size filter does not need any recomputation
     """
 
     def __init__(self):
         self.cropVolumeLogic = slicer.vtkSlicerCropVolumeLogic()
         self.threshold = vtk.vtkImageThreshold()
 
+        self.croppedImage = None
+        self.croppedArray = None
+        self.labelArray = None
+        self.components = OrderedDict()
+        self.thresholdRange = None
+        self.__cropKey__ = None
+        self.__nextLabel__ = 1
+
     def cropVolumeWithROI(self, volumeNode, roiNode, croppedVolume):
         self.cropVolumeLogic.CropVoxelBased(roiNode, volumeNode, croppedVolume)
         #print croppedVolume
@@ -615,6 +679,142 @@ class CIP_CalciumScoringLogic(ScriptedLoadableModuleLogic):
         self.threshold.Update()
         threshImage.DeepCopy(self.threshold.GetOutput())
 
+    def updateCroppedVolume(self, volumeNode, roiNode, croppedVolumeNode):
+        """ Crop the volume with the ROI, unless neither of them changed since the last crop.
+        All the cached components are discarded when the volume is cropped again
+        :param volumeNode: input scalar volume
+        :param roiNode: annotation ROI node
+        :param croppedVolumeNode: scalar volume node that will store the cropped volume
+        :return: True if the volume was cropped again
+        """
+        key = (volumeNode.GetID(), volumeNode.GetMTime(), volumeNode.GetImageData().GetMTime(),
+               roiNode.GetID(), roiNode.GetMTime())
+        if key == self.__cropKey__ and self.croppedImage is not None:
+            return False
+        self.cropVolumeWithROI(volumeNode, roiNode, croppedVolumeNode)
+        self.croppedImage = sitk.ReadImage(sitkUtils.GetSlicerITKReadWriteAddress(croppedVolumeNode.GetName()))
+        self.croppedArray = sitk.GetArrayFromImage(self.croppedImage)
+        self.__cropKey__ = key
+        self.resetComponents()
+        return True
+
+    def resetComponents(self):
+        """ Discard all the cached components """
+        self.labelArray = None
+        self.components = OrderedDict()
+        self.thresholdRange = None
+        self.__nextLabel__ = 1
+
+    def updateComponents(self, thresholdMin, thresholdMax):
+        """ Label the connected components of the cropped volume in the range [thresholdMin, thresholdMax].
+        When the new range is contained in the previous one, every new component is a subset of an old one,
+        so only the components that lost voxels are labelled again (inside their bounding box).
+        Otherwise the whole ROI is labelled from scratch
+        :param thresholdMin: lower HU threshold (inclusive)
+        :param thresholdMax: upper HU threshold (inclusive)
+        :return: tuple with the list of removed component labels and the list of added component labels
+        """
+        if self.thresholdRange is not None and thresholdMin >= self.thresholdRange[0] \
+                and thresholdMax <= self.thresholdRange[1]:
+            removed, added = self.__refineComponents__(thresholdMin, thresholdMax)
+        else:
+            removed = list(self.components.keys())
+            added = self.__labelROI__(thresholdMin, thresholdMax)
+        self.thresholdRange = (thresholdMin, thresholdMax)
+        return removed, added
+
+    def labelsImage(self):
+        """ SimpleITK image with the current labels, in the same physical space as the cropped volume
+        :return: sitk image (int32)
+        """
+        image = sitk.GetImageFromArray(self.labelArray)
+        image.CopyInformation(self.croppedImage)
+        return image
+
+    def componentImageData(self, label):
+        """ Binary vtkImageData of a component, restricted to its (padded) bounding box.
+        The extent of the image is expressed in the ijk space of the cropped volume
+        :param label: component label
+        :return: vtkImageData (unsigned char)
+        """
+        component = self.components[label]
+        sl = component.slices(padding=1, shape=self.labelArray.shape)
+        mask = (self.labelArray[sl] == label).astype(np.uint8)
+        image = vtk.vtkImageData()
+        image.SetExtent(sl[2].start, sl[2].stop - 1, sl[1].start, sl[1].stop - 1, sl[0].start, sl[0].stop - 1)
+        image.GetPointData().SetScalars(vtk.util.numpy_support.numpy_to_vtk(mask.ravel(), deep=True,
+                                                                            array_type=vtk.VTK_UNSIGNED_CHAR))
+        return image
+
+    def __labelROI__(self, thresholdMin, thresholdMax):
+        """ Label the whole cropped volume
+        :return: list of labels of the new components
+        """
+        thresholdImage = sitk.BinaryThreshold(self.croppedImage, thresholdMin, thresholdMax, 1, 0)
+        relabelImage = sitk.RelabelComponent(sitk.ConnectedComponent(thresholdImage, True))
+        self.labelArray = sitk.GetArrayFromImage(relabelImage).astype(np.int32)
+        self.components = OrderedDict()
+        for component in self.__collectComponents__(self.croppedImage, relabelImage, (0, 0, 0)):
+            self.components[component.label] = component
+        self.__nextLabel__ = len(self.components) + 1
+        return list(self.components.keys())
+
+    def __refineComponents__(self, thresholdMin, thresholdMax):
+        """ Relabel only the components that lost voxels with the new (narrower) threshold range
+        :return: tuple with the list of removed component labels and the list of added component labels
+        """
+        removed = []
+        added = []
+        for component in list(self.components.values()):
+            sl = component.slices()
+            intensity = self.croppedArray[sl]
+            labels = self.labelArray[sl]
+            inComponent = labels == component.label
+            mask = inComponent & (intensity >= thresholdMin) & (intensity <= thresholdMax)
+            count = np.count_nonzero(mask)
+            if count == component.count:
+                # Nothing changed in this component
+                continue
+            removed.append(component.label)
+            del self.components[component.label]
+            # labels is a view, so the global label array is updated too
+            labels[inComponent] = 0
+            if count == 0:
+                continue
+            subLabelsImage = sitk.RelabelComponent(
+                sitk.ConnectedComponent(sitk.GetImageFromArray(mask.astype(np.uint8)), True))
+            subLabels = sitk.GetArrayFromImage(subLabelsImage)
+            offset = (sl[0].start, sl[1].start, sl[2].start)
+            intensityImage = sitk.GetImageFromArray(np.ascontiguousarray(intensity))
+            for newComponent in self.__collectComponents__(intensityImage, subLabelsImage, offset):
+                labels[subLabels == newComponent.label] = self.__nextLabel__
+                newComponent.label = self.__nextLabel__
+                self.__nextLabel__ += 1
+                self.components[newComponent.label] = newComponent
+                added.append(newComponent.label)
+        return removed, added
+
+    def __collectComponents__(self, intensityImage, labelImage, offset):
+        """ Statistics of the consecutive labels (1..N) of a labelmap
+        :param intensityImage: sitk intensity image
+        :param labelImage: sitk labelmap with consecutive labels
+        :param offset: (z, y, x) offset of the images in the cropped volume
+        :return: list of CalcifiedComponent
+        """
+        labelStatFilter = sitk.LabelStatisticsImageFilter()
+        labelStatFilter.Execute(intensityImage, labelImage)
+        components = []
+        for label in range(1, labelStatFilter.GetNumberOfLabels()):
+            # sitk bounding box: (xmin, xmax, ymin, ymax, zmin, zmax)
+            bb = labelStatFilter.GetBoundingBox(label)
+            bbox = (bb[4] + offset[0], bb[5] + offset[0],
+                    bb[2] + offset[1], bb[3] + offset[1],
+                    bb[0] + offset[2], bb[1] + offset[2])
+            components.append(CalcifiedComponent(label, labelStatFilter.GetCount(label),
+                                                 labelStatFilter.GetMean(label),
+                                                 labelStatFilter.GetMaximum(label), bbox))
+        return components
+
 
 class CIP_CalciumScoringTest(unittest.TestCase):
     """
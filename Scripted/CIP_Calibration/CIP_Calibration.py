@@ -421,6 +421,9 @@ class CIP_CalibrationWidget(ScriptedLoadableModuleWidget,VTKObservationMixin):
 # This class makes all the operations not related with the user interface (download and handle volumes, etc.)
 #
 class CIP_CalibrationLogic(ScriptedLoadableModuleLogic):
+    # Max number of voxels processed at once (the volumes are processed in slabs of full slices)
+    SLAB_SIZE = 2 ** 22
+
     def __init__(self):
         """Constructor. """
         ScriptedLoadableModuleLogic.__init__(self)
@@ -444,7 +447,8 @@ class CIP_CalibrationLogic(ScriptedLoadableModuleLogic):
     def calibrate(self, scalarNode, labelmapNode, air_output, blood_output):
         """
         Calibrate the volume. Take the mean value of each region marked and rescale the volume to the values
-        specified by air_output and blood_output
+        specified by air_output and blood_output.
+        The volume is processed in slabs, so that the memory needed is about the size of one slab
         @param scalarNode: MRML Scalar node to be calibrated
         @param labelmapNode: MRML labelmap node
         @param air_output: value expecte  for air
@@ -454,15 +458,14 @@ class CIP_CalibrationLogic(ScriptedLoadableModuleLogic):
         s = slicer.util.array(scalarNode.GetName())
         lm = slicer.util.array(labelmapNode.GetName())
 
-        mask = lm == 1
-        if not np.any(mask):
+        sums, counts = self.getRegionsSufficientStatistics(s, lm, (1, 2))
+        if counts[0] == 0:
             return "Please mark some area corresponding to air in the volume"
-        air_input = np.mean(s[mask])
+        air_input = sums[0] / counts[0]
 
-        mask = lm == 2
-        if not np.any(mask):
+        if counts[1] == 0:
             return "Please mark some area corresponding to blood in the volume"
-        blood_input = np.mean(s[mask])
+        blood_input = sums[1] / counts[1]
 
         # Find the line that passes through these points
         d = float(blood_input - air_input)
@@ -473,17 +476,82 @@ class CIP_CalibrationLogic(ScriptedLoadableModuleLogic):
         b = air_output - (m * air_input)
 
         # Adjust the CT
-        a2 = s * m + b
-        a2 = a2.astype(np.int16)
-        slicer.util.updateVolumeFromArray(scalarNode, a2)
+        if s.dtype == np.int16:
+            # In place
+            self.applyLinearTransform(s, m, b, s)
+            # Notify the change in the voxels so that the views and the histogram are refreshed,
+            # and mark the volume as modified since it was read
+            scalarNode.GetImageData().GetPointData().GetScalars().Modified()
+            scalarNode.GetImageData().Modified()
+            scalarNode.Modified()
+            scalarNode.StorableModified()
+        else:
+            a2 = np.empty(s.shape, np.int16)
+            self.applyLinearTransform(s, m, b, a2)
+            slicer.util.updateVolumeFromArray(scalarNode, a2)
 
+    @classmethod
+    def getSlabs(cls, shape):
+        """
+        Split the first axis of an array in slabs of SLAB_SIZE voxels at most (one slice at least)
+        :param shape: shape of the array
+        :return: list of slices along the first axis
+        """
+        sliceSize = int(np.prod(shape[1:])) if len(shape) > 1 else 1
+        step = max(1, cls.SLAB_SIZE // max(sliceSize, 1))
+        return [slice(i, min(i + step, shape[0])) for i in range(0, shape[0], step)]
 
+    @classmethod
+    def getRegionsSufficientStatistics(cls, image_array, labelmap_array, labels):
+        """
+        Sum of the intensities and number of voxels of every region of a labelmap (computed slab by slab)
+        :param image_array: numpy array
+        :param labelmap_array: numpy array with the same shape as image_array
+        :param labels: list of labels
+        :return: tuple with the list of sums (float) and the list of counts (int), in the same order as labels
+        """
+        sums = [0.0] * len(labels)
+        counts = [0] * len(labels)
+        for slab in cls.getSlabs(image_array.shape):
+            lmSlab = labelmap_array[slab]
+            imageSlab = image_array[slab]
+            for i, label in enumerate(labels):
+                mask = lmSlab == label
+                n = int(np.count_nonzero(mask))
+                if n > 0:
+                    counts[i] += n
+                    sums[i] += float(imageSlab[mask].sum(dtype=np.float64))
+        return sums, counts
+
+    @classmethod
+    def applyLinearTransform(cls, image_array, m, b, output_array):
+        """
+        output = m * image + b, clipped to the range of the output type and truncated like numpy astype.
+        The operation is performed slab by slab (output_array can be image_array to work in place)
+        :param image_array: numpy array
+        :param m: slope
+        :param b: intercept
+        :param output_array: numpy array with the same shape as image_array
+        """
+        isInteger = np.issubdtype(output_array.dtype, np.integer)
+        if isInteger:
+            info = np.iinfo(output_array.dtype)
+        for slab in cls.getSlabs(image_array.shape):
+            # float64 as in the original full volume computation (exact for int16 input)
+            temp = image_array[slab].astype(np.float64)
+            temp *= m
+            temp += b
+            if isInteger:
+                np.clip(temp, info.min, info.max, temp)
+                np.trunc(temp, temp)
+            output_array[slab] = temp
 
     @staticmethod
     def normalize_CT_image_intensity(image_array, min_value=-300, max_value=700, min_output=0.0, max_output=1.0,
                                      inplace=True):
         """
         Threshold and adjust contrast range in a CT image.
+        The array is processed in slabs, so no full size temporary arrays are allocated
         :param image_array: int numpy array (CT or partial CT image)
         :param min_value: int. Min threshold (everything below that value will be thresholded). If None, ignore
         :param max_value: int. Max threshold (everything below that value will be thresholded). If None, ignore
@@ -491,25 +559,32 @@ class CIP_CalibrationLogic(ScriptedLoadableModuleLogic):
         :param max_output: float. Max output value
         :return: None if in_place==True. Otherwise, float numpy array with adapted intensity
         """
+        if inplace and image_array.dtype != np.float32:
+            raise Exception(
+                "The image array must contain float32 elements, because the transformation will be performed in place")
+
         clip = min_value is not None or max_value is not None
         if min_value is None:
             min_value = np.min(image_array)
         if max_value is None:
             max_value = np.max(image_array)
-        if clip:
-            np.clip(image_array, min_value, max_value, image_array)
 
-        if inplace and image_array.dtype != np.float32:
-            raise Exception(
-                "The image array must contain float32 elements, because the transformation will be performed in place")
-        if not inplace:
-            # Copy the array!
-            image_array = image_array.astype(np.float32)
-
-        # Change of range
-        image_array -= min_value
-        image_array /= (max_value - min_value)
-        image_array *= (max_output - min_output)
-        image_array += min_output
+        # Change of range: output = input * scale + offset
+        scale = float(max_output - min_output) / (max_value - min_value)
+        offset = min_output - min_value * scale
+
+        result = image_array if inplace else np.empty(image_array.shape, np.float32)
+        for slab in CIP_CalibrationLogic.getSlabs(image_array.shape):
+            if inplace:
+                temp = result[slab]
+            else:
+                # Copy the slab
+                temp = image_array[slab].astype(np.float32)
+            if clip:
+                np.clip(temp, min_value, max_value, temp)
+            temp *= scale
+            temp += offset
+            if not inplace:
+                result[slab] = temp
         if not inplace:
-            return image_array
+            return result
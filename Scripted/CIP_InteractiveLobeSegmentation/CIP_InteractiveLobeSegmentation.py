@@ -1,10 +1,14 @@
 import os
 import unittest
+import numpy as np
 import vtk, qt, ctk, slicer
 
 from slicer.ScriptedLoadableModule import *
 
 from CIP.logic.SlicerUtil import SlicerUtil
+from CIP.logic.cli_pipeline import CliPipeline
+from CIP.logic import lobe_relabelling
+from CIP.logic.lobe_relabelling import FissureSurface
 from CIP.ui import PreProcessingWidget
 
 #
@@ -34,6 +38,8 @@ class CIP_InteractiveLobeSegmentationWidget(ScriptedLoadableModuleWidget):
         ScriptedLoadableModuleWidget.__init__(self, parent)
         self.logic = CIP_InteractiveLobeSegmentationLogic()
         self.observerTags = []
+        self.pipeline = None
+        self.clonedCTNode = None
         if not parent:
             self.parent = slicer.qMRMLWidget()
             self.parent.setLayout(qt.QVBoxLayout())
@@ -270,6 +276,33 @@ class CIP_InteractiveLobeSegmentationWidget(ScriptedLoadableModuleWidget):
         self.layout.addWidget(self.applyButton, 0, 4)
         # self.layout.setAlignment(2)
 
+        self.incrementalCheckBox = qt.QCheckBox("Incremental update")
+        self.incrementalCheckBox.toolTip = "When only some fissures were modified since the last segmentation, " \
+                                           "relabel just the voxels between the previous and the new fissure " \
+                                           "surfaces instead of segmenting the whole lung again"
+        self.incrementalCheckBox.checked = True
+        self.layout.addWidget(self.incrementalCheckBox)
+
+        #
+        # Progress of the segmentation pipeline
+        #
+        self.progressFrame = qt.QFrame()
+        self.progressFrame.setLayout(qt.QHBoxLayout())
+        self.layout.addWidget(self.progressFrame)
+        self.progressLabel = qt.QLabel()
+        self.progressFrame.layout().addWidget(self.progressLabel)
+        self.progressBar = qt.QProgressBar()
+        self.progressBar.setRange(0, 100)
+        self.progressFrame.layout().addWidget(self.progressBar)
+        self.cancelButton = qt.QPushButton("Cancel")
+        self.cancelButton.toolTip = "Cancel the current segmentation"
+        self.progressFrame.layout().addWidget(self.cancelButton)
+        self.progressFrame.hide()
+        self.timingsLabel = qt.QLabel()
+        self.timingsLabel.toolTip = "Time spent in every stage of the last segmentation"
+        self.layout.addWidget(self.timingsLabel)
+        self.timingsLabel.hide()
+
         #
         # Show Fiducials
         #
@@ -283,6 +316,7 @@ class CIP_InteractiveLobeSegmentationWidget(ScriptedLoadableModuleWidget):
 
         # connections
         self.applyButton.connect('clicked(bool)', self.onApplyButton)
+        self.cancelButton.connect('clicked()', self.onCancelButton)
         self.CTSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.onCTSelect)
         self.labelSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.onSelect)
         self.outputSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.onSelect)
@@ -296,7 +330,8 @@ class CIP_InteractiveLobeSegmentationWidget(ScriptedLoadableModuleWidget):
         self.layout.addStretch(1)
 
     def cleanup(self):
-        pass
+        if self.pipeline is not None:
+            self.pipeline.cleanup()
 
     def onCTSelect(self, CTNode):
         if CTNode:
@@ -380,29 +415,43 @@ class CIP_InteractiveLobeSegmentationWidget(ScriptedLoadableModuleWidget):
         logic.createList('RH')
 
     def onApplyButton(self):
+        if self.pipeline is not None and self.pipeline.isRunning:
+            return
         red_logic = slicer.app.layoutManager().sliceWidget("Red").sliceLogic()
         red_cn = red_logic.GetSliceCompositeNode()
         volumeID = red_cn.GetBackgroundVolumeID()
         CTNode = SlicerUtil.getNode(volumeID)
-        if self.labelSelector.currentNode() == None:
+        if not self.logic.checkFissureFiducials():
+            self.applyButton.enabled = True
+            return False
+
+        # The whole process (filtering, label map and lobes) runs asynchronously, so that Slicer is responsive
+        # and the user can cancel it
+        self.pipeline = CliPipeline("Interactive Lobe Segmentation")
+        self.pipeline.addObservable(self.pipeline.EVENT_STAGE_STARTED, self.__onPipelineStageStarted__)
+        self.pipeline.addObservable(self.pipeline.EVENT_STAGE_PROGRESS, self.__onPipelineStageProgress__)
+        self.pipeline.addObservable(self.pipeline.EVENT_PIPELINE_FINISHED, self.__onPipelineFinished__)
+
+        labelNode = self.labelSelector.currentNode()
+        if labelNode is None:
            warning = self.preProcessingWidget.warningMessageForLM()
            if warning == 16384:
-               labelNode = slicer.mrmlScene.AddNode(slicer.vtkMRMLLabelMapVolumeNode())
-               labelNode.SetName(CTNode.GetName() + '_partialLungLabelMap')               
-               
                if not CTNode:
                    self.applyButton.enabled = True
                    return False
+               labelNode = slicer.mrmlScene.AddNode(slicer.vtkMRMLLabelMapVolumeNode())
+               labelNode.SetName(CTNode.GetName() + '_partialLungLabelMap')               
+               
                if self.preProcessingWidget.filterOnRadioButton.checked:
                    volumesLogic = slicer.modules.volumes.logic()
-                   clonedCTNode = volumesLogic.CloneVolume(slicer.mrmlScene, CTNode, 'Cloned Volume')
-                   self.filterInputCT(clonedCTNode)
-                   self.createLungLabelMap(clonedCTNode,labelNode)
-                   slicer.mrmlScene.RemoveNode(clonedCTNode)
-                   for color in ['Red', 'Yellow', 'Green']:
-                       slicer.app.layoutManager().sliceWidget(color).sliceLogic().GetSliceCompositeNode().SetBackgroundVolumeID(CTNode.GetID())
+                   self.clonedCTNode = volumesLogic.CloneVolume(slicer.mrmlScene, CTNode, 'Cloned Volume')
+                   self.preProcessingWidget.addFilterStage(self.pipeline, self.clonedCTNode)
+                   self.preProcessingWidget.addPartialLMStages(self.pipeline, self.clonedCTNode, labelNode)
+                   self.pipeline.addFunctionStage("Removing filtered volume",
+                                                  lambda: self.__removeClonedCTNode__(CTNode))
                else:
-                   self.createLungLabelMap(CTNode,labelNode)
+                   self.preProcessingWidget.addPartialLMStages(self.pipeline, CTNode, labelNode)
+               self.pipeline.addFunctionStage("Selecting label map", lambda: self.__onLabelMapCreated__(labelNode))
                
            else:
                qt.QMessageBox.warning(slicer.util.mainWindow(),
@@ -412,66 +461,82 @@ class CIP_InteractiveLobeSegmentationWidget(ScriptedLoadableModuleWidget):
            
         self.visualizationWidget.updateScene()
         
-        self.applyButton.text = "Segmenting Lobes..."
-        self.applyButton.repaint()
-        slicer.app.processEvents()
-
-        logic = CIP_InteractiveLobeSegmentationLogic()
-        
-        self.visualizationWidget.pendingUpdate = True
         outputNode = self.outputSelector.currentNode()
         if not outputNode:
             outputNode = slicer.vtkMRMLLabelMapVolumeNode()
             slicer.mrmlScene.AddNode(outputNode)
-            
-        fissureVolume = None
-        try:
-            fissureVolume = logic.run(self.labelSelector.currentNode(), outputNode)
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
+        if not (self.incrementalCheckBox.checked and
+                self.logic.addIncrementalSegmentationStage(self.pipeline, labelNode, outputNode)):
+            self.logic.addSegmentationStage(self.pipeline, labelNode, outputNode)
+        self.pipeline.addFunctionStage("Updating views", lambda: self.__onSegmentationCompleted__(CTNode, outputNode))
+
+        self.visualizationWidget.pendingUpdate = True
+        self.applyButton.enabled = False
+        self.timingsLabel.hide()
+        self.progressBar.value = 0
+        self.progressFrame.show()
+        self.pipeline.run()
+
+    def onCancelButton(self):
+        if self.pipeline is not None:
+            self.cancelButton.enabled = False
+            self.progressLabel.text = "Cancelling..."
+            self.pipeline.cancel()
+
+    def __onPipelineStageStarted__(self, stage, index, count):
+        self.applyButton.text = stage.name + "..."
+        self.progressLabel.text = "{}/{}: {}".format(index + 1, count, stage.name)
+        self.progressBar.value = int(index * 100.0 / count)
+        self.cancelButton.enabled = True
+
+    def __onPipelineStageProgress__(self, stage, progress, globalProgress):
+        self.progressBar.value = int(globalProgress)
+
+    def __onPipelineFinished__(self, status, timings):
+        if status != CliPipeline.STATUS_COMPLETED:
+            self.__removeClonedCTNode__()
+        if status == CliPipeline.STATUS_FAILED:
             qt.QMessageBox.warning(slicer.util.mainWindow(),
-                                   "Running", 'Exception!\n\n' + str(e) + "\n\nSee Python Console for Stack Trace")
-        
-        # if fissureVolume is not None:
-        self.outputSelector.setCurrentNode(fissureVolume)
-        SlicerUtil.changeLabelmapOpacity(0.5)
+                                   "Running", 'Exception!\n\n' + str(self.pipeline.errorMessage) +
+                                   "\n\nSee Python Console for Stack Trace")
 
-        self.onFourUpButton()
+        self.progressFrame.hide()
+        self.timingsLabel.text = "{}\n{}".format(status, self.pipeline.getTimingsSummary())
+        self.timingsLabel.show()
         self.applyButton.text = "Apply"
-        self.applyButton.repaint()
-        slicer.app.processEvents()
         self.applyButton.enabled = True
         applicationLogic = slicer.app.applicationLogic()
         interactionNode = applicationLogic.GetInteractionNode()
         interactionNode.Reset(None)
         self.visualizationWidget.pendingUpdate = False
 
+    def __onLabelMapCreated__(self, labelNode):
+        """ Select the lung label map once it has been created
+        """
+        SlicerUtil.changeLabelmapOpacity(0.5)
+        self.labelSelector.setCurrentNode(labelNode)
+
+    def __onSegmentationCompleted__(self, CTNode, outputNode):
+        """ Show the lobes once the segmentation is finished
+        """
+        self.outputSelector.setCurrentNode(outputNode)
+        SlicerUtil.changeLabelmapOpacity(0.5)
+        self.onFourUpButton()
         for color in ['Red', 'Yellow', 'Green']:
             slicer.app.layoutManager().sliceWidget(color).sliceLogic().GetSliceCompositeNode().SetBackgroundVolumeID(
                 CTNode.GetID())
             slicer.app.layoutManager().sliceWidget(color).sliceLogic().GetSliceCompositeNode().SetLabelVolumeID(
                 self.outputSelector.currentNode().GetID())
-        
-    def filterInputCT(self, input_node):
-        # self.applyButton.enabled = False
-        self.applyButton.text = "Filtering..."
-        self.applyButton.repaint()
-        slicer.app.processEvents()
 
-        self.preProcessingWidget.filterInputCT(input_node)
-        
-    def createLungLabelMap(self, input_node, label_node):
-        """Create the lung label map
+    def __removeClonedCTNode__(self, CTNode=None):
+        """ Remove the temporary filtered volume (if any) and show the original CT again
         """
-        self.applyButton.text = "Creating Label Map..."
-        self.applyButton.repaint()
-        slicer.app.processEvents()
-
-        self.preProcessingWidget.createPartialLM(input_node, label_node)
-
-        SlicerUtil.changeLabelmapOpacity(0.5)
-        self.labelSelector.setCurrentNode(label_node)
+        if self.clonedCTNode is not None:
+            slicer.mrmlScene.RemoveNode(self.clonedCTNode)
+            self.clonedCTNode = None
+        if CTNode is not None:
+            for color in ['Red', 'Yellow', 'Green']:
+                slicer.app.layoutManager().sliceWidget(color).sliceLogic().GetSliceCompositeNode().SetBackgroundVolumeID(CTNode.GetID())
 
     def updateList(self):
         """Observe the mrml scene for changes that we wish to respond to."""
@@ -904,8 +969,19 @@ class CIP_InteractiveLobeSegmentationLogic(ScriptedLoadableModuleLogic):
     requiring an instance of the Widget
     """
 
+    # Lobe codes (ChestConventions.xml)
+    RIGHT_SUPERIOR_LOBE = lobe_relabelling.RIGHT_SUPERIOR_LOBE
+    RIGHT_MIDDLE_LOBE = lobe_relabelling.RIGHT_MIDDLE_LOBE
+    RIGHT_INFERIOR_LOBE = lobe_relabelling.RIGHT_INFERIOR_LOBE
+    LEFT_SUPERIOR_LOBE = lobe_relabelling.LEFT_SUPERIOR_LOBE
+    LEFT_INFERIOR_LOBE = lobe_relabelling.LEFT_INFERIOR_LOBE
+
+    FISSURE_NAMES = ('LO', 'RO', 'RH')
+
     def __init__(self):
         self.name = "Fiducial"
+        # Fiducials, fissure surfaces and nodes of the last segmentation (used for the incremental updates)
+        self.lastSegmentation = None
 
     def hasImageData(self, volumeNode):
         """This is a dummy logic method that
@@ -984,6 +1060,58 @@ class CIP_InteractiveLobeSegmentationLogic(ScriptedLoadableModuleLogic):
         """
         Run the actual algorithm
         """
+        parameters = self.getSegmentLungLobesParameters(labelVolume, outputVolume)
+        if parameters is None:
+            return False
+        fiducials = self.getFissuresPositions()
+        slicer.cli.run(slicer.modules.segmentlunglobes, None, parameters, wait_for_completion=True)
+        return self.onSegmentationCompleted(labelVolume, outputVolume, fiducials)
+
+    def addSegmentationStage(self, pipeline, labelVolume, outputVolume):
+        """ Add the lobe segmentation to a CliPipeline (asynchronous equivalent of run).
+        :param pipeline: CliPipeline
+        :param labelVolume: lung label map node (it can be empty when the pipeline is created)
+        :param outputVolume: output label map node
+        :return: False if the fiducials are not valid to run the segmentation (the stage is not added)
+        """
+        parameters = self.getSegmentLungLobesParameters(labelVolume, outputVolume)
+        if parameters is None:
+            return False
+        # Fiducials used in this segmentation (the user could move them while the CLI is running)
+        fiducials = self.getFissuresPositions()
+        pipeline.addCliStage("Segmenting lobes", slicer.modules.segmentlunglobes, parameters,
+                             onCompleted=lambda stage: self.onSegmentationCompleted(labelVolume, outputVolume,
+                                                                                    fiducials))
+        return True
+
+    def addIncrementalSegmentationStage(self, pipeline, labelVolume, outputVolume):
+        """ Add to a CliPipeline an incremental update of the last segmentation, when only some fissures changed.
+        Only the voxels between the previous and the new position of the modified fissures are relabelled.
+        :param pipeline: CliPipeline
+        :param labelVolume: lung label map node
+        :param outputVolume: output (lobes) label map node
+        :return: True if the stage was added, or False when a full segmentation is needed
+        """
+        changedFissures = self.getChangedFissures(labelVolume, outputVolume)
+        if not changedFissures:
+            return False
+        pipeline.addFunctionStage("Updating {} fissure(s)".format(", ".join(changedFissures)),
+                                  lambda: self.__runIncrementalSegmentationStage__(labelVolume, outputVolume))
+        return True
+
+    def __runIncrementalSegmentationStage__(self, labelVolume, outputVolume):
+        """ Function of the incremental segmentation stage. The fiducials or the output may have changed since the
+        stage was added, so the pipeline fails (instead of completing without updating the output) when a full
+        segmentation is needed. Applying again will run the full segmentation in that case
+        """
+        if self.runIncrementalSegmentation(labelVolume, outputVolume) is None:
+            raise Exception("The fissures or the lobes label map changed while the segmentation was being updated. "
+                            "Please apply again to run the full segmentation")
+
+    def getFissureFiducials(self):
+        """ Get the fiducial lists of the fissures
+        :return: tuple with left oblique, right oblique and right horizontal fiducials lists (or None)
+        """
         listsInScene = slicer.util.getNodes('vtkMRMLMarkupsFiducialNode*')
         leftObliqueFiducials = None
         rightObliqueFiducials = None
@@ -999,6 +1127,33 @@ class CIP_InteractiveLobeSegmentationLogic(ScriptedLoadableModuleLogic):
                     rightObliqueFiducials = fiducialList
                 elif fiducialList.GetName() == name[2]:
                     rightHorizontalFiducials = fiducialList
+        return leftObliqueFiducials, rightObliqueFiducials, rightHorizontalFiducials
+
+    def checkFissureFiducials(self):
+        """ Check that the right lung has fiducials in both fissures (or in none of them).
+        A warning is displayed otherwise
+        :return: True if the fiducials are valid
+        """
+        leftObliqueFiducials, rightObliqueFiducials, rightHorizontalFiducials = self.getFissureFiducials()
+        if rightObliqueFiducials and not rightHorizontalFiducials:
+            qt.QMessageBox.warning(slicer.util.mainWindow(),
+                               "Interactive Lobe Segmentation", "Please place fiducials on the right horizontal fissure.")
+            return False
+        if rightHorizontalFiducials and not rightObliqueFiducials:
+            qt.QMessageBox.warning(slicer.util.mainWindow(),
+                                   "Interactive Lobe Segmentation", "Please place fiducials on the right oblique fissure.")
+            return False
+        return True
+
+    def getSegmentLungLobesParameters(self, labelVolume, outputVolume):
+        """ Parameters for the segmentlunglobes CLI based on the fiducials in the scene
+        :param labelVolume: lung label map node
+        :param outputVolume: output label map node
+        :return: dictionary of parameters or None if the fiducials are not valid (a warning is displayed)
+        """
+        if not self.checkFissureFiducials():
+            return None
+        leftObliqueFiducials, rightObliqueFiducials, rightHorizontalFiducials = self.getFissureFiducials()
                     
         parameters = {
             "inLabelMapFileName": labelVolume.GetID(),
@@ -1008,21 +1163,122 @@ class CIP_InteractiveLobeSegmentationLogic(ScriptedLoadableModuleLogic):
         if leftObliqueFiducials:
             parameters["leftObliqueFiducials"] = leftObliqueFiducials
         if rightObliqueFiducials:
-            if rightHorizontalFiducials:
-                parameters["rightObliqueFiducials"] = rightObliqueFiducials
-                parameters["rightHorizontalFiducials"] = rightHorizontalFiducials
-            else:
-                qt.QMessageBox.warning(slicer.util.mainWindow(),
-                                   "Interactive Lobe Segmentation", "Please place fiducials on the right horizontal fissure.")
-                return False
-        elif rightHorizontalFiducials:
-            qt.QMessageBox.warning(slicer.util.mainWindow(),
-                                   "Interactive Lobe Segmentation", "Please place fiducials on the right oblique fissure.")
-            return False
-
-        slicer.cli.run(slicer.modules.segmentlunglobes, None, parameters, wait_for_completion=True)
+            parameters["rightObliqueFiducials"] = rightObliqueFiducials
+            parameters["rightHorizontalFiducials"] = rightHorizontalFiducials
+        return parameters
+
+    def onSegmentationCompleted(self, labelVolume, outputVolume, fiducials=None):
+        """ Set the output label map as the active one once the segmentation is finished
+        :param fiducials: fissure fiducials used in the segmentation (see getFissuresPositions). Needed to allow
+        incremental updates of the segmentation
+        :return: outputVolume
+        """
+        self.__saveSegmentationState__(labelVolume, outputVolume, fiducials)
         selectionNode = slicer.app.applicationLogic().GetSelectionNode()
         selectionNode.SetReferenceActiveLabelVolumeID(outputVolume.GetID())
         outputVolume.SetName(labelVolume.GetName().replace("_partialLungLabelMap", "_interactiveLobeSegmentation"))
         slicer.app.applicationLogic().PropagateLabelVolumeSelection(0)
         return outputVolume
+
+    def getFissuresPositions(self):
+        """ Get the RAS coordinates of the fiducials of every fissure in the scene
+        :return: dictionary of fissure name ('LO', 'RO', 'RH')-numpy array (Nx3). Empty lists are not included
+        """
+        positions = {}
+        for name, fiducialList in zip(self.FISSURE_NAMES, self.getFissureFiducials()):
+            if fiducialList is not None and fiducialList.GetNumberOfFiducials() > 0:
+                coords = np.zeros((fiducialList.GetNumberOfFiducials(), 3))
+                pos = [0.0, 0.0, 0.0]
+                for i in range(fiducialList.GetNumberOfFiducials()):
+                    fiducialList.GetNthFiducialPosition(i, pos)
+                    coords[i] = pos
+                positions[name] = coords
+        return positions
+
+    def getChangedFissures(self, labelVolume, outputVolume):
+        """ Get the fissures whose fiducials changed since the last segmentation, when the segmentation can be
+        updated incrementally.
+        :param labelVolume: lung label map node
+        :param outputVolume: output (lobes) label map node
+        :return: list of fissure names. None if a full segmentation is needed (no previous segmentation, different
+        nodes, fissures added or removed, the output was modified by the user, not axial volume, etc.)
+        """
+        state = self.lastSegmentation
+        if state is None or labelVolume is None or outputVolume is None \
+                or state["labelVolumeID"] != labelVolume.GetID() or state["outputVolumeID"] != outputVolume.GetID() \
+                or outputVolume.GetImageData() is None \
+                or state["outputMTime"] != outputVolume.GetImageData().GetMTime():
+            return None
+        fiducials = self.getFissuresPositions()
+        if set(fiducials.keys()) != set(state["fiducials"].keys()):
+            return None
+        changed = [name for name in self.FISSURE_NAMES if name in fiducials
+                   and not np.array_equal(fiducials[name], state["fiducials"][name])]
+        for name in changed:
+            required = ['LO'] if name == 'LO' else ['RO', 'RH']
+            if len(fiducials[name]) < 3 or any(r not in state["surfaces"] for r in required):
+                return None
+        if self.__getAxialGeometry__(outputVolume) is None:
+            return None
+        return changed
+
+    def runIncrementalSegmentation(self, labelVolume, outputVolume):
+        """ Update the last segmentation re-fitting only the fissures whose fiducials changed and relabelling the
+        voxels between the previous and the new fissure surfaces.
+        :param labelVolume: lung label map node
+        :param outputVolume: output (lobes) label map node. It must contain the last segmentation
+        :return: number of relabelled voxels (None if a full segmentation is needed)
+        """
+        changedFissures = self.getChangedFissures(labelVolume, outputVolume)
+        if changedFissures is None:
+            return None
+        state = self.lastSegmentation
+        fiducials = self.getFissuresPositions()
+        oldSurfaces = dict(state["surfaces"])
+        newSurfaces = dict(state["surfaces"])
+        for name in changedFissures:
+            newSurfaces[name] = FissureSurface(fiducials[name])
+
+        labelArray = slicer.util.array(outputVolume.GetID())
+        geometry = self.__getAxialGeometry__(outputVolume)
+        relabelled = 0
+        for name in changedFissures:
+            relabelled += lobe_relabelling.relabelBetweenSurfaces(labelArray, geometry, name, oldSurfaces[name],
+                                                                  newSurfaces)
+        outputVolume.GetImageData().Modified()
+
+        state["fiducials"] = fiducials
+        state["surfaces"] = newSurfaces
+        state["outputMTime"] = outputVolume.GetImageData().GetMTime()
+        return relabelled
+
+    def __saveSegmentationState__(self, labelVolume, outputVolume, fiducials):
+        """ Save the information needed to update the segmentation incrementally
+        """
+        if fiducials is None or outputVolume.GetImageData() is None:
+            self.lastSegmentation = None
+            return
+        surfaces = {}
+        for name, coords in fiducials.items():
+            if len(coords) >= 3:
+                surfaces[name] = FissureSurface(coords)
+        self.lastSegmentation = {
+            "labelVolumeID": labelVolume.GetID(),
+            "outputVolumeID": outputVolume.GetID(),
+            "outputMTime": outputVolume.GetImageData().GetMTime(),
+            "fiducials": fiducials,
+            "surfaces": surfaces,
+        }
+
+    def __getAxialGeometry__(self, volumeNode):
+        """ Get the geometry of a volume whose slices are axial planes (the incremental update works with columns
+        of voxels along the z axis)
+        :return: tuple with a 2x3 matrix to get x, y RAS coordinates from i, j and (z spacing, z origin).
+        None if the slices are not axial
+        """
+        ijkToRas = vtk.vtkMatrix4x4()
+        volumeNode.GetIJKToRASMatrix(ijkToRas)
+        m = np.array([[ijkToRas.GetElement(r, c) for c in range(4)] for r in range(3)])
+        if not np.allclose([m[0, 2], m[1, 2], m[2, 0], m[2, 1]], 0) or m[2, 2] == 0:
+            return None
+        return m[:2, [0, 1, 3]], (m[2, 2], m[2, 3])
@@ -8,6 +8,7 @@ import time
 import logging
 from . import *
 import FeatureExtractionLib
+from CIP.logic.timer import GlobalProfiler
 
 class FeatureExtractionLogic:
     def __init__(self, volumeNode, labelmapROIArray, featureCategoriesKeys, featureKeys, additionalProgressbarDesc="",
@@ -53,6 +54,7 @@ class FeatureExtractionLogic:
         """
         return self.__analysisTimingDict__
 
+    @GlobalProfiler.profile_run("FeatureExtractionLogic.run")
     def run(self, resultsStorage, printTiming=False, resultsStorageTiming=None):
         """ Run all the selected analysis
         :return:
@@ -104,7 +106,8 @@ class FeatureExtractionLogic:
             self.updateProgressBar(progressBarDesc, "First-Order Statistics", len(self.__analysisResultsDict__))
             self.firstOrderStatistics = FeatureExtractionLib.FirstOrderStatistics(self.targetVoxels, self.bins, self.numGrayLevels, self.featureKeys)
             t1 = time.time()
-            results = self.firstOrderStatistics.EvaluateFeatures(printTiming, self.checkStopProcess)
+            with GlobalProfiler.span("First-Order Statistics"):
+                results = self.firstOrderStatistics.EvaluateFeatures(printTiming, self.checkStopProcess)
             if printTiming:
                 self.__analysisResultsDict__.update(results[0])
                 self.__analysisTimingDict__.update(results[1])
@@ -125,7 +128,8 @@ class FeatureExtractionLogic:
                 matrixSA, matrixSACoordinates = self.padMatrix(self.matrix, self.matrixCoordinates, maxDimsSA, self.targetVoxels)
             self.morphologyStatistics = FeatureExtractionLib.MorphologyStatistics(self.volumeNode.GetSpacing(), matrixSA, matrixSACoordinates, self.targetVoxels, self.featureKeys)
             t1 = time.time()
-            results = self.morphologyStatistics.EvaluateFeatures(printTiming, self.checkStopProcess)
+            with GlobalProfiler.span("Morphology and Shape"):
+                results = self.morphologyStatistics.EvaluateFeatures(printTiming, self.checkStopProcess)
             if printTiming:
                 self.__analysisResultsDict__.update(results[0])
                 self.__analysisTimingDict__.update(results[1])
@@ -138,7 +142,8 @@ class FeatureExtractionLogic:
             self.updateProgressBar(progressBarDesc, "GLCM Texture Features", len(self.__analysisResultsDict__))
             self.textureFeaturesGLCM = FeatureExtractionLib.TextureGLCM(self.grayLevels, self.numGrayLevels, self.matrix, self.matrixCoordinates, self.targetVoxels, self.featureKeys, self.checkStopProcess)
             t1 = time.time()
-            results =self.textureFeaturesGLCM.EvaluateFeatures(printTiming, self.checkStopProcess)
+            with GlobalProfiler.span("Texture: GLCM"):
+                results =self.textureFeaturesGLCM.EvaluateFeatures(printTiming, self.checkStopProcess)
             if printTiming:
                 self.__analysisResultsDict__.update(results[0])
                 self.__analysisTimingDict__.update(results[1])
@@ -151,7 +156,8 @@ class FeatureExtractionLogic:
             self.updateProgressBar(progressBarDesc, "GLRL Texture Features", len(self.__analysisResultsDict__))
             self.textureFeaturesGLRL = FeatureExtractionLib.TextureGLRL(self.grayLevels, self.numGrayLevels, self.matrix, self.matrixCoordinates, self.targetVoxels, self.featureKeys)
             t1 = time.time()
-            results =self.textureFeaturesGLRL.EvaluateFeatures(printTiming, self.checkStopProcess)
+            with GlobalProfiler.span("Texture: GLRL"):
+                results =self.textureFeaturesGLRL.EvaluateFeatures(printTiming, self.checkStopProcess)
             if printTiming:
                 self.__analysisResultsDict__.update(results[0])
                 self.__analysisTimingDict__.update(results[1])
@@ -164,7 +170,8 @@ class FeatureExtractionLogic:
             self.updateProgressBar(progressBarDesc, "Geometrical Measures", len(self.__analysisResultsDict__))
             self.geometricalMeasures = FeatureExtractionLib.GeometricalMeasures(self.volumeNode.GetSpacing(), self.matrix, self.matrixCoordinates, self.targetVoxels, self.featureKeys)
             t1 = time.time()
-            results =self.geometricalMeasures.EvaluateFeatures(printTiming, self.checkStopProcess)
+            with GlobalProfiler.span("Geometrical Measures"):
+                results =self.geometricalMeasures.EvaluateFeatures(printTiming, self.checkStopProcess)
             if printTiming:
                 self.__analysisResultsDict__.update(results[0])
                 self.__analysisTimingDict__.update(results[1])
@@ -180,7 +187,8 @@ class FeatureExtractionLogic:
             matrixPadded, matrixPaddedCoordinates = self.padMatrix(self.matrix, self.matrixCoordinates, maxDims, self.targetVoxels)
             self.renyiDimensions = FeatureExtractionLib.RenyiDimensions(matrixPadded, matrixPaddedCoordinates, self.featureKeys)
             t1 = time.time()
-            results =self.renyiDimensions.EvaluateFeatures(printTiming, self.checkStopProcess)
+            with GlobalProfiler.span("Renyi Dimensions"):
+                results =self.renyiDimensions.EvaluateFeatures(printTiming, self.checkStopProcess)
             if printTiming:
                 self.__analysisResultsDict__.update(results[0])
                 self.__analysisTimingDict__.update(results[1])
@@ -194,7 +202,8 @@ class FeatureExtractionLogic:
             self.parenchymalVolume = FeatureExtractionLib.ParenchymalVolume(self.labelmapWholeVolumeArray, self.labelmapROIArray,
                                                         self.volumeNode.GetSpacing(), self.featureKeys)
             t1 = time.time()
-            results =self.parenchymalVolume.EvaluateFeatures(printTiming, self.checkStopProcess)
+            with GlobalProfiler.span("Parenchymal Volume"):
+                results =self.parenchymalVolume.EvaluateFeatures(printTiming, self.checkStopProcess)
             if printTiming:
                 self.__analysisResultsDict__.update(results[0])
                 self.__analysisTimingDict__.update(results[1])
@@ -11,6 +11,7 @@ from CIP.ui import PreProcessingWidget
 from CIP.ui import PdfReporter
 from CIP.logic.SlicerUtil import SlicerUtil
 from CIP.logic.Util import Util
+from CIP.logic.timer import GlobalProfiler
 from CIP.logic.lung_splitter import LungSplitter as lung_splitter
 from functools import reduce
 
@@ -431,6 +432,7 @@ class CIP_ParenchymaAnalysisWidget(ScriptedLoadableModuleWidget):
 
         SlicerUtil.changeLabelmapOpacity(0.5)
 
+    @GlobalProfiler.profile_run("CIP_ParenchymaAnalysis.onApply")
     def onApply(self):
         """Calculate the parenchyma analysis
         """
@@ -506,7 +508,7 @@ class CIP_ParenchymaAnalysisWidget(ScriptedLoadableModuleWidget):
         """
         Print a pdf report
         """
-        emphysema_image_path, ct_slice_path = self.logic.writeEmphysemaOnSliceToFiles(op=0.5)
+        emphysema_png, ct_png = self.logic.getEmphysemaOnSliceImages(op=0.5)
         pdfReporter = PdfReporter()
         # Get the values that are going to be inserted in the html template
         caseName = self.CTNode.GetName()
@@ -532,12 +534,15 @@ class CIP_ParenchymaAnalysisWidget(ScriptedLoadableModuleWidget):
         # Get a list of image absolute paths that may be needed for the report. In this case, we get the ACIL logo
         imagesFileList = [SlicerUtil.ACIL_LOGO_PATH]
 
-        values["@@EMPHYSEMA_IMAGE@@"] = emphysema_image_path
-        values["@@CT_IMAGE@@"] = ct_slice_path
+        # The slice images are passed to the reporter in memory
+        imagesBuffers = {"emphysema_slice.png": emphysema_png, "ct_slice.png": ct_png}
+        values["@@EMPHYSEMA_IMAGE@@"] = "emphysema_slice.png"
+        values["@@CT_IMAGE@@"] = "ct_slice.png"
 
         # Print the report. Remember that we can optionally specify the absolute path where the report is going to
         # be stored
-        pdfReporter.printPdf(htmlTemplatePath, values, self.reportPrinted, imagesFileList=imagesFileList)
+        pdfReporter.printPdf(htmlTemplatePath, values, self.reportPrinted, imagesFileList=imagesFileList,
+                             imagesBuffers=imagesBuffers)
 
     def reportPrinted(self, reportPath):
         logging.info(f"PDF report generated: {reportPath}")
@@ -643,6 +648,7 @@ class CIP_ParenchymaAnalysisLogic(ScriptedLoadableModuleLogic):
         (14, 14)  # RLT
         ]
 
+    @GlobalProfiler.profile("ParenchymaStatistics")
     def __init__(self, CTNode, lungMaskNode, freq_by_region_volume=True):
 
         self.regionTags = [] # Found regions
@@ -652,9 +658,11 @@ class CIP_ParenchymaAnalysisLogic(ScriptedLoadableModuleLogic):
         litersPerCubicMM = 0.000001
 
         # Center slices, can be used for creating images for reporting
-        self.sitk_ct_slice = None
-        self.sitk_emph_slice = None
+        self.ct_slice_image = None
+        self.emph_slice_mask = None
         self.colorTableNode = None
+        # Histogram table node for every region (see createHistogram)
+        self.histogramTableNodes = {}
 
         if lungMaskNode and lungMaskNode.GetClassName() == "vtkMRMLSegmentationNode":
             # Got a segmentation node, create a label node from it
@@ -959,6 +967,7 @@ class CIP_ParenchymaAnalysisLogic(ScriptedLoadableModuleLogic):
         if self.colorTableNode: 
             slicer.mrmlScene.RemoveNode(self.colorTableNode)
 
+    @GlobalProfiler.profile()
     def createHistogram(self, labelNode):
         self.setHistogramLayout()
 
@@ -973,38 +982,18 @@ class CIP_ParenchymaAnalysisLogic(ScriptedLoadableModuleLogic):
         plotChartNode.SetXAxisTitle('Density (HU)')
         plotChartNode.SetYAxisTitle('Frequency')
         plotChartNode.SetYAxisRangeAuto(False)
-        plotChartNode.SetYAxisRange(0, 50)
+        plotChartNode.SetYAxisRange(0, 50 if self.freq_by_region_volume else 0.01)
 
+        self.histogramTableNodes = {}
         for regionTag in self.regionTags:
-            if self.freq_by_region_volume:
-                histogram = self.regionHists_by_region_volume[regionTag]
-            else:
-                histogram = self.regionHists[regionTag]
-
-            bins = self.regionBins[regionTag]
-
             tableNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTableNode", 'TableNode_{}'.format(regionTag))
-            table = tableNode.GetTable()
-
-            arrX = vtk.vtkFloatArray()
-            arrX.SetName("bins".format(regionTag))
-            table.AddColumn(arrX)
-
-            arrY = vtk.vtkFloatArray()
-            arrY.SetName("freq_{}".format(regionTag))
-            table.AddColumn(arrY)
-
-            dataSamples = histogram.size
-            table.SetNumberOfRows(dataSamples)
-
-            for i in range(dataSamples):
-                table.SetValue(i, 0, float(bins[i]))
-                table.SetValue(i, 1, histogram[i])
+            self.histogramTableNodes[regionTag] = tableNode
+            self.populateHistogramTable(tableNode.GetTable(), regionTag)
 
             plotSeriesNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLPlotSeriesNode", regionTag)
             plotSeriesNode.SetAndObserveTableNodeID(tableNode.GetID())
-            plotSeriesNode.SetXColumnName("bins".format(regionTag))
-            plotSeriesNode.SetYColumnName("freq_{}".format(regionTag))
+            plotSeriesNode.SetXColumnName("bins")
+            plotSeriesNode.SetYColumnName(self.getHistogramColumnName(regionTag, self.freq_by_region_volume))
             plotSeriesNode.SetPlotType(slicer.vtkMRMLPlotSeriesNode.PlotTypeScatter)
             plotSeriesNode.SetLineStyle(slicer.vtkMRMLPlotSeriesNode.LineStyleSolid)
             plotSeriesNode.SetLineWidth(2.)
@@ -1016,41 +1005,46 @@ class CIP_ParenchymaAnalysisLogic(ScriptedLoadableModuleLogic):
 
         histogramViewNode.SetPlotChartNodeID(plotChartNode.GetID())
 
+    @staticmethod
+    def getHistogramColumnName(regionTag, byRegionVolume):
+        """ Name of the table column that stores the frequencies of a region histogram
+        :param regionTag: region
+        :param byRegionVolume: frequencies weighted by the region volume or density
+        :return: column name
+        """
+        return "freq_{}".format(regionTag) if byRegionVolume else "density_{}".format(regionTag)
+
+    def populateHistogramTable(self, table, regionTag):
+        """ Fill a vtkTable with the bins and both frequency columns (by region volume and density) of a region.
+        The columns are built in bulk from the numpy arrays
+        :param table: vtkTable
+        :param regionTag: region
+        """
+        import vtk.util.numpy_support, numpy
+        while table.GetNumberOfColumns() > 0:
+            table.RemoveColumn(0)
+        dataSamples = self.regionHists[regionTag].size
+        columns = (("bins", self.regionBins[regionTag][:dataSamples]),
+                   (self.getHistogramColumnName(regionTag, True), self.regionHists_by_region_volume[regionTag]),
+                   (self.getHistogramColumnName(regionTag, False), self.regionHists[regionTag]))
+        for name, values in columns:
+            arr = vtk.util.numpy_support.numpy_to_vtk(numpy.ascontiguousarray(values, dtype=numpy.float32),
+                                                      deep=True, array_type=vtk.VTK_FLOAT)
+            arr.SetName(name)
+            table.AddColumn(arr)
+        table.Modified()
+
     def ChangeHistogramFrequency(self, histogramsList, byRegionVolume=True):
+        """ Switch the frequency shown in the histograms. The tables already contain both columns, so only the
+        plot series are updated
+        """
         plotChartNode = SlicerUtil.getNode('PlotChartNode')
         plotChartNode.RemoveAllPlotSeriesNodeIDs()
+        plotChartNode.SetYAxisRange(0, 50 if byRegionVolume else 0.01)
         for regionTag in self.regionTags:
-            if byRegionVolume:
-                plotChartNode.SetYAxisRange(0, 50)
-                histogram = self.regionHists_by_region_volume[regionTag]
-            else:
-                plotChartNode.SetYAxisRange(0, 0.01)
-                histogram = self.regionHists[regionTag]
-
-            bins = self.regionBins[regionTag]
-
-            tableNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTableNode", 'TableNode_{}'.format(regionTag))
-            table = tableNode.GetTable()
-
-            arrX = vtk.vtkFloatArray()
-            arrX.SetName("bins".format(regionTag))
-            table.AddColumn(arrX)
-
-            arrY = vtk.vtkFloatArray()
-            arrY.SetName("freq_{}".format(regionTag))
-            table.AddColumn(arrY)
-
-            dataSamples = histogram.size
-            table.SetNumberOfRows(dataSamples)
-
-            for i in range(dataSamples):
-                table.SetValue(i, 0, float(bins[i]))
-                table.SetValue(i, 1, histogram[i])
-
             plotSeriesNode = SlicerUtil.getNode(regionTag)
-            plotSeriesNode.SetAndObserveTableNodeID(tableNode.GetID())
-            plotSeriesNode.SetXColumnName("bins".format(regionTag))
-            plotSeriesNode.SetYColumnName("freq_{}".format(regionTag))
+            plotSeriesNode.SetXColumnName("bins")
+            plotSeriesNode.SetYColumnName(self.getHistogramColumnName(regionTag, byRegionVolume))
 
         self.AddSelectedHistograms(histogramsList)
 
@@ -1166,13 +1160,14 @@ class CIP_ParenchymaAnalysisLogic(ScriptedLoadableModuleLogic):
         layoutManager.layoutLogic().GetLayoutNode().AddLayoutDescription(customLayoutId, customLayout)
         layoutManager.setLayout(customLayoutId)
 
+    @GlobalProfiler.profile()
     def computeEmphysemaOnSlice(self, CTNode, labelNode):
         """Get a center slice of the CT and the emphysema label and save into
-        self.sitk_ct_slice and self.sitk_emph_slice.
+        self.ct_slice_image (windowed uint8 image) and self.emph_slice_mask.
+        Both arrays are oriented as they are displayed in the report (first row is the top of the image).
+        Everything is computed from the numpy arrays, so it does not depend on the layout (it can run headless)
         """
-
         import numpy as np
-        import SimpleITK as sitk
 
         image_arr = slicer.util.array(CTNode.GetName()).transpose([2, 1, 0])
         label_arr = slicer.util.array(labelNode.GetName()).transpose([2, 1, 0])
@@ -1180,41 +1175,41 @@ class CIP_ParenchymaAnalysisLogic(ScriptedLoadableModuleLogic):
         sl = int(image_arr.shape[2] / 2.0)
 
         ct_slice = image_arr[:, sl, :]
-        slice_label = label_arr[:, sl, :]
+        # Copy, so that the labelmap node is not modified
+        slice_label = label_arr[:, sl, :].copy()
         slice_label[np.logical_and(slice_label > 1, slice_label < 512)] = 1
         slice_label[slice_label >= 512] = 0
 
-        emph_slice = ct_slice.copy()
-
-        emph_slice[emph_slice >= -950.0] = 0
-        emph_slice[np.logical_and(emph_slice >= -3000.0, emph_slice < -950.0)] = 1
-        emph_slice = emph_slice.astype(np.uint8)
-
-        emph_slice[slice_label==0] = 0
+        emph_slice = np.logical_and(ct_slice >= -3000.0, ct_slice < -950.0)
+        emph_slice[slice_label == 0] = False
 
-        sitk_ct_slice = sitk.GetImageFromArray(ct_slice.transpose())
-        self.sitk_ct_slice = sitk.Cast(sitk.IntensityWindowing(sitk_ct_slice, windowMinimum=-1200, windowMaximum=200,
-                                                          outputMinimum=0, outputMaximum=255), sitk.sitkUInt8)
+        # Window [-1200, 200] HU -> [0, 255]
+        ct_image = np.clip((ct_slice.astype(np.float32) + 1200.0) * (255.0 / 1400.0), 0, 255).astype(np.uint8)
 
-        self.sitk_emph_slice = sitk.GetImageFromArray(emph_slice.transpose())
+        # Rows from the top of the image
+        self.ct_slice_image = ct_image.transpose()[::-1]
+        self.emph_slice_mask = emph_slice.transpose()[::-1]
 
-    def writeEmphysemaOnSliceToFiles(self, op=0.2):
-
-        label_overlay = sitk.LabelOverlay(self.sitk_ct_slice, self.sitk_emph_slice, opacity=op, colormap=[255, 51, 51])
-        # label_overlay = sitk.LabelOverlay(sitk_ct_slice, sitk_emph_slice, opacity=op)
-
-        label_ovelay_img = sitk.Flip(label_overlay, flipAxes=(False, True))
-        ct_img = sitk.Flip(self.sitk_ct_slice, flipAxes=(False, True))
-
-        import tempfile
-        tmpFolder = tempfile.mkdtemp()
-        img_path = os.path.join(tmpFolder, "tmpImg__.png")
-        img_path_CT = os.path.join(tmpFolder, "tmpImgCT__.png")
-
-        sitk.WriteImage(label_ovelay_img, img_path)
-        sitk.WriteImage(ct_img, img_path_CT)
-
-        return img_path, img_path_CT
+    def renderEmphysemaOnSlice(self, op=0.2, color=(255, 51, 51)):
+        """ Blend the emphysema mask over the CT slice computed in computeEmphysemaOnSlice
+        :param op: opacity of the emphysema overlay
+        :param color: RGB color of the emphysema overlay
+        :return: tuple of uint8 numpy arrays: RGB emphysema overlay image (rows, cols, 3) and gray CT image (rows, cols)
+        """
+        import numpy as np
+        gray = self.ct_slice_image
+        overlay = np.repeat(gray[:, :, np.newaxis], 3, axis=2)
+        blended = (1.0 - op) * gray[self.emph_slice_mask][:, np.newaxis] + op * np.asarray(color, dtype=np.float64)
+        overlay[self.emph_slice_mask] = blended.astype(np.uint8)
+        return overlay, gray
+
+    def getEmphysemaOnSliceImages(self, op=0.2):
+        """ In-memory PNG images for the report
+        :param op: opacity of the emphysema overlay
+        :return: tuple with the PNG bytes of the emphysema overlay image and the CT image
+        """
+        overlay, ct = self.renderEmphysemaOnSlice(op)
+        return Util.png_from_numpy_array(overlay), Util.png_from_numpy_array(ct)
 
 
 class Slicelet(object):
@@ -349,6 +349,18 @@ class CIP_ParenchymaSubtypeTrainingLogic(CIP_PointsLabellingLogic):
         artifactLabel = "-{}".format(self.params.getArtifactAbbreviation(artifactId)) if artifactId != 0 else ""
         return typeLabel + regionLabel + artifactLabel
 
+    def getMarkupDescription(self, typesList):
+        """
+        Overriden. Get the description that will be stored in the fiducial for the corresponding types-subtypes
+        combination. The format is:
+        EffectiveType_Region_Artifact
+        :param typesList: tuple (type-subtype-region-artifact)
+        :return: description string for this fiducial
+        """
+        return "{}_{}_{}".format(self.getEffectiveType(self.getTypeId(typesList), self.getSubtypeId(typesList)),
+                                 self.getRegionId(typesList),
+                                 self.getArtifactId(typesList))
+
     def getTypesListFromXmlPoint(self, geometryTopologyDataPoint):
         """
         Overriden. Get a list of types that the module will use to operate from a Point object in a GeometryTopologyData object
@@ -379,15 +391,7 @@ class CIP_ParenchymaSubtypeTrainingLogic(CIP_PointsLabellingLogic):
         markupListNode.SetNthMarkupLabel(n - 1, label)
         # Use the description to store the type of the fiducial that will be saved in
         # the GeometryTopolyData object
-        currentTypeId = self.getTypeId(self.currentTypesList)
-        currentSubTypeId = self.getSubtypeId(self.currentTypesList)
-        currentRegionId = self.getRegionId(self.currentTypesList)
-        currentArtifactId = self.getArtifactId(self.currentTypesList)
-        markupListNode.SetNthMarkupDescription(n - 1,
-                                               "{}_{}_{}".format(
-                                                   self.getEffectiveType(currentTypeId, currentSubTypeId),
-                                                   currentRegionId,
-                                                   currentArtifactId))
+        markupListNode.SetNthMarkupDescription(n - 1, self.getMarkupDescription(self.currentTypesList))
         # Markup added. Mark the current volume as state modified
         self.savedVolumes[self.currentVolumeId] = False
 
@@ -1,15 +1,17 @@
 import os
 import logging
-from shutil import copyfile
 import time
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
+from functools import partial
 
+import numpy as np
 import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
 
 from CIP.logic.SlicerUtil import SlicerUtil
 from CIP.logic import Util
 from CIP.logic import geometry_topology_data as gtd
+from CIP.logic.fiducials_journal import FiducialsJournal
 
 #
 # CIP_PointsLabelling
@@ -374,11 +376,106 @@ class CIP_PointsLabellingWidget(ScriptedLoadableModuleWidget):
 
     def __onSceneClosed__(self, arg1, arg2):
         self.currentVolumeLoaded = None
+        self.logic.compactFiducialsJournal()
+        self.logic.resetFiducialsTracking()
         self._initLogic_()
+
+
+#
+# FiducialsNodeTracker
+#
+class FiducialsNodeTracker(object):
+    """ Changes in the markups of a fiducials list node since the last save (markups added, modified and removed),
+    so that saving the fiducials just processes the markups that changed.
+    The markups are identified by their id, because the indexes change when a markup is removed
+    """
+    def __init__(self, fidListNode, volumeName):
+        """
+        :param fidListNode: fiducials list node
+        :param volumeName: name of the volume that the fiducials belong to
+        """
+        self.node = fidListNode
+        self.volumeName = volumeName
+        # Markup id: GeometryTopologyData.Point saved for that markup
+        self.points = {}
+        # Ids of all the markups in the node
+        self.markupIds = set(self.__getMarkupIds__())
+        # Markups added or modified since the last save
+        self.dirtyMarkupIds = set()
+        # Saved points whose markups were removed since the last save
+        self.removedPoints = []
+
+        self.observers = []
+        for eventName, oldEventName, callback in (("PointAddedEvent", "MarkupAddedEvent", self.__onMarkupAdded__),
+                                                  ("PointRemovedEvent", "MarkupRemovedEvent", self.__onMarkupRemoved__),
+                                                  ("PointModifiedEvent", "NthMarkupModifiedEvent",
+                                                   self.__onMarkupModified__)):
+            event = getattr(fidListNode, eventName, None)
+            if event is None:
+                event = getattr(fidListNode, oldEventName)
+            # The modified events include the index of the markup
+            observer = partial(callback)
+            observer.CallDataType = vtk.VTK_INT
+            self.observers.append(fidListNode.AddObserver(event, observer))
+
+    def popChanges(self):
+        """ Get the changes since the last call and start tracking again
+        :return: tuple with the list of saved points whose markups were removed and the set of ids of the markups
+                 added or modified
+        """
+        removedPoints, dirtyMarkupIds = self.removedPoints, self.dirtyMarkupIds
+        self.removedPoints, self.dirtyMarkupIds = [], set()
+        return removedPoints, dirtyMarkupIds
+
+    def stop(self):
+        for observer in self.observers:
+            self.node.RemoveObserver(observer)
+        self.observers = []
+
+    def __getMarkupIds__(self):
+        return [self.node.GetNthMarkupID(i) for i in range(self.node.GetNumberOfMarkups())]
+
+    def __synchronize__(self, allModified=False):
+        """ Compare the markups in the node with the tracked ones (used when the events don't say which markups
+        changed, ex: several markups removed at once)
+        :param allModified: consider that all the markups were modified
+        """
+        markupIds = set(self.__getMarkupIds__())
+        for markupId in self.markupIds - markupIds:
+            p = self.points.pop(markupId, None)
+            if p is not None:
+                self.removedPoints.append(p)
+            self.dirtyMarkupIds.discard(markupId)
+        self.dirtyMarkupIds.update(markupIds if allModified else markupIds - self.markupIds)
+        self.markupIds = markupIds
+
+    def __onMarkupAdded__(self, caller, event, callData=None):
+        # The new markups are usually at the end of the list
+        i = self.node.GetNumberOfMarkups() - 1
+        while i >= 0 and self.node.GetNthMarkupID(i) not in self.markupIds:
+            self.markupIds.add(self.node.GetNthMarkupID(i))
+            self.dirtyMarkupIds.add(self.node.GetNthMarkupID(i))
+            i -= 1
+        if len(self.markupIds) != self.node.GetNumberOfMarkups():
+            self.__synchronize__()
+
+    def __onMarkupRemoved__(self, caller, event, callData=None):
+        self.__synchronize__()
+
+    def __onMarkupModified__(self, caller, event, callData=None):
+        if callData is not None and 0 <= callData < self.node.GetNumberOfMarkups():
+            self.dirtyMarkupIds.add(self.node.GetNthMarkupID(callData))
+        else:
+            self.__synchronize__(allModified=True)
+
+
 #
 # CIP_PointsLabellingLogic
 #
 class CIP_PointsLabellingLogic(ScriptedLoadableModuleLogic):
+    # Number of records in the journal that will trigger a rewrite of the xml file
+    JOURNAL_COMPACTION_SIZE = 1000
+
     def __init__(self):
         ScriptedLoadableModuleLogic.__init__(self)
         self._params_ = None
@@ -388,6 +485,10 @@ class CIP_PointsLabellingLogic(ScriptedLoadableModuleLogic):
         self.currentTypesList = None
         self.savedVolumes = {}
         self.currentGeometryTopologyData = None
+        self.currentJournal = None      # FiducialsJournal of the file that currentGeometryTopologyData represents
+        # Fiducials list node id: FiducialsNodeTracker. Nodes whose markups are already matched with the points
+        # in currentGeometryTopologyData
+        self.fiducialsTrackers = {}
 
     @property
     def _xmlFileExtensionKey_(self):
@@ -432,6 +533,15 @@ class CIP_PointsLabellingLogic(ScriptedLoadableModuleLogic):
         raise NotImplementedError("This method should be implemented by a child class")
 
 
+    def getMarkupDescription(self, typesList):
+        """
+        Get the description that will be stored in the fiducial for the corresponding types-subtypes combination.
+        It must be parseable by getPointMetadataFromFiducialDescription
+        :param typesList: list of types-subtypes. It can be a region-type-artifact or any other combination
+        :return: description string for this fiducial
+        """
+        raise NotImplementedError("This method should be implemented by a child class")
+
     def getTypesListFromXmlPoint(self, geometryTopologyDataPoint):
         """
         Get a list of types that the module will use to operate from a Point object in a GeometryTopologyData object
@@ -442,28 +552,65 @@ class CIP_PointsLabellingLogic(ScriptedLoadableModuleLogic):
 
 
     def loadFiducialsXml(self, volumeNode, fileName):
-        """ Load from disk a list of fiducials for a particular volume node
+        """ Load from disk a list of fiducials for a particular volume node.
+        The points are grouped by types list, so that every fiducials list node is resolved just once and all its
+        markups are added in a single batch (the scene is in batch processing mode and the node modified events are
+        compressed until all the markups have been added)
         :param volumeNode: Volume (scalar node)
         :param fileName: full path of the file to load the fiducials where
         """
-        with open(fileName, "r") as f:
-            xml = f.read()
+        # The markups will be matched with the new points the next time the fiducials are saved
+        self.resetFiducialsTracking()
+        self.currentGeometryTopologyData = gtd.GeometryTopologyData.from_xml_file(fileName)
+        # Apply the changes that were saved after the last time the file was compacted
+        self.currentJournal = FiducialsJournal(fileName)
+        self.currentJournal.replay(self.currentGeometryTopologyData)
+        points = self.currentGeometryTopologyData.points
+        if len(points) == 0:
+            return
+        rasCoords = self.getPointsRASCoordinates(volumeNode, self.currentGeometryTopologyData)
 
-        self.currentGeometryTopologyData = gtd.GeometryTopologyData.from_xml(xml)
-        for point in self.currentGeometryTopologyData.points:
-            # Activate the current fiducials list based on the type list
-            typesList = self.getTypesListFromXmlPoint(point)
-            fidListNode = self.setActiveFiducialsListNode(volumeNode, typesList)
-            # Check if the coordinate system is RAS (and make the corresponding transform otherwise)
-            if self.currentGeometryTopologyData.coordinate_system == self.currentGeometryTopologyData.LPS:
-                coord = Util.lps_to_ras(point.coordinate)
-            elif self.currentGeometryTopologyData.coordinate_system == self.currentGeometryTopologyData.IJK:
-                coord = Util.ijk_to_ras(volumeNode, point.coordinate)
-            else:
-                # Try default mode (RAS)
-                coord = point.coordinate
-            # Add the fiducial
-            fidListNode.AddFiducial(coord[0], coord[1], coord[2], self.getMarkupLabel(typesList))
+        # Group the points by types list (keeping the original order)
+        groups = OrderedDict()
+        for i, point in enumerate(points):
+            groups.setdefault(tuple(self.getTypesListFromXmlPoint(point)), []).append(i)
+
+        slicer.mrmlScene.StartState(slicer.mrmlScene.BatchProcessState)
+        try:
+            for typesList, indexes in groups.items():
+                # Activate the current fiducials list based on the type list
+                fidListNode = self.setActiveFiducialsListNode(volumeNode, typesList)
+                label = self.getMarkupLabel(typesList)
+                description = self.getMarkupDescription(typesList)
+                wasModifying = fidListNode.StartModify()
+                try:
+                    for coord in rasCoords[indexes].tolist():
+                        # Add the fiducial. The label and description are set here because the "markup added"
+                        # observers will not be invoked for every fiducial
+                        n = fidListNode.AddFiducial(coord[0], coord[1], coord[2], label)
+                        fidListNode.SetNthMarkupDescription(n, description)
+                finally:
+                    fidListNode.EndModify(wasModifying)
+        finally:
+            slicer.mrmlScene.EndState(slicer.mrmlScene.BatchProcessState)
+
+    def getPointsRASCoordinates(self, volumeNode, geometryTopologyData):
+        """ Get the RAS coordinates of all the points in a GeometryTopologyData object
+        :param volumeNode: Volume (scalar node). Used when the points are in IJK coordinates
+        :param geometryTopologyData: GeometryTopologyData object
+        :return: Nx3 numpy array of RAS coordinates
+        """
+        coords = geometryTopologyData.get_points_columns()["coordinate"]
+        # Check if the coordinate system is RAS (and make the corresponding transform otherwise)
+        if geometryTopologyData.coordinate_system == geometryTopologyData.LPS:
+            coords = coords * np.array([-1.0, -1.0, 1.0])
+        elif geometryTopologyData.coordinate_system == geometryTopologyData.IJK:
+            ijkToRas = vtk.vtkMatrix4x4()
+            volumeNode.GetIJKToRASMatrix(ijkToRas)
+            m = np.array(Util.convert_vtk_matrix_to_list(ijkToRas))
+            coords = coords.dot(m[:3, :3].T) + m[:3, 3]
+        # Otherwise try default mode (RAS)
+        return coords
 
     def getPointMetadataFromFiducialDescription(self, description):
         """
@@ -475,71 +622,44 @@ class CIP_PointsLabellingLogic(ScriptedLoadableModuleLogic):
         raise NotImplementedError("This method should be implemented by a child class")
 
 
-    def saveCurrentFiducials(self, localFilePath, caseNavigatorWidget=None, callbackFunction=None, saveInRemoteRepo=False):
+    def saveCurrentFiducials(self, localFilePath, caseNavigatorWidget=None, callbackFunction=None,
+                             saveInRemoteRepo=False, compact=False):
         """ Save all the fiducials for the current volume.
         The name of the file will be VolumeName_parenchymaTraining.xml"
+        Only the points added/modified/removed since the last save (see FiducialsNodeTracker) are appended to a
+        journal next to the xml file. The xml file
+        is rewritten (and the journal moved to the history file) when the journal grows over JOURNAL_COMPACTION_SIZE
+        records, when the file is uploaded remotely or when compact==True
         :param filePath: destination file (local)
         :param caseNavigatorWidget: case navigator widget (optional)
         :param callbackFunction: function to invoke when the file has been uploaded to the server (optional)
+        :param saveInRemoteRepo: upload the file to the remote repository (it forces a compaction)
+        :param compact: force the rewrite of the xml file
         """
         volume = slicer.mrmlScene.GetNodeByID(self.currentVolumeId)
-        #fileName = volume.GetName() + Util.file_conventions_extensions[self._xmlFileExtensionKey_]
-        # If there is already a xml file in the results directory, make a copy.
-        #localFilePath = os.path.join(directory, fileName)
-        if os.path.isfile(localFilePath):
-            # Make a copy of the file for history purposes
-            copyfile(localFilePath, localFilePath + "." + time.strftime("%Y%m%d.%H%M%S"))
-
-        # Iterate over all the fiducials list nodes
-        pos = [0,0,0]
-        geometryTopologyData = gtd.GeometryTopologyData()
-        geometryTopologyData.coordinate_system = geometryTopologyData.LPS
-        # Get the transformation matrix LPS-->IJK
-        matrix = Util.get_lps_to_ijk_transformation_matrix(volume)
-        geometryTopologyData.lps_to_ijk_transformation_matrix = Util.convert_vtk_matrix_to_list(matrix)
-        # Save spacing and origin of the volume
-        geometryTopologyData.origin = volume.GetOrigin()
-        geometryTopologyData.spacing = volume.GetSpacing()
-        geometryTopologyData.dimensions = volume.GetImageData().GetDimensions()
-
-        # Get the hashtable and seed from previously loaded GeometryTopologyData object (if available)
-        if self.currentGeometryTopologyData is None:
-            hashTable = {}
-        else:
-            hashTable = self.currentGeometryTopologyData.get_hashtable()
-            geometryTopologyData.seed_id = self.currentGeometryTopologyData.seed_id
+        geometryTopologyData = self.currentGeometryTopologyData
+        if self.currentJournal is None or self.currentJournal.xmlFilePath != localFilePath \
+                or geometryTopologyData is None or geometryTopologyData.coordinate_system != geometryTopologyData.LPS:
+            # The current object does not represent the destination file. Start a new one from the current points
+            geometryTopologyData = self.__createGeometryTopologyData__(volume)
+            self.resetFiducialsTracking()
+            self.currentJournal = FiducialsJournal(localFilePath)
+            compact = True
 
         # Get a timestamp that will be used for all the points
         timestamp = gtd.GeometryTopologyData.get_timestamp()
-
-        for fidListNode in slicer.util.getNodes("{0}_fiducials_*".format(volume.GetName())).values():
-            # Get all the markups
-            for i in range(fidListNode.GetNumberOfMarkups()):
-                fidListNode.GetNthFiducialPosition(i, pos)
-                # Get the type from the description (region will always be 0)
-                desc = fidListNode.GetNthMarkupDescription(i)
-                # Switch coordinates from RAS to LPS
-                lps_coords = Util.ras_to_lps(list(pos))
-                pointMetadata = self.getPointMetadataFromFiducialDescription(desc)
-                p = gtd.Point(pointMetadata[0], pointMetadata[1], pointMetadata[2], lps_coords, description=pointMetadata[3])
-                key = p.get_hash()
-                if key in hashTable:
-                    # Add previously existing point
-                    geometryTopologyData.add_point(hashTable[key], fill_auto_fields=False)
-                else:
-                    # Add a new point with a precalculated timestamp
-                    geometryTopologyData.add_point(p, fill_auto_fields=True)
-                    p.timestamp = timestamp
-
-        # Get the xml content file
-        xml = geometryTopologyData.to_xml()
-        # Save the file
-        with open(localFilePath, 'w') as f:
-            f.write(xml)
+        addedPoints, removedPoints = self.__updateGeometryTopologyData__(volume, geometryTopologyData, timestamp)
 
         # Use the new object as the current GeometryTopologyData
         self.currentGeometryTopologyData = geometryTopologyData
 
+        if compact or saveInRemoteRepo \
+                or self.currentJournal.numberOfRecords + len(addedPoints) + len(removedPoints) > self.JOURNAL_COMPACTION_SIZE:
+            self.currentJournal.append(addedPoints, removedPoints)
+            self.currentJournal.compact(geometryTopologyData)
+        else:
+            self.currentJournal.append(addedPoints, removedPoints)
+
         # Upload to MAD if we are using the ACIL case navigator
         if saveInRemoteRepo:
              caseNavigatorWidget.uploadFile(localFilePath, callbackFunction=callbackFunction)
@@ -547,6 +667,142 @@ class CIP_PointsLabellingLogic(ScriptedLoadableModuleLogic):
         # Mark the current volume as saved
         self.savedVolumes[volume.GetName()] = True
 
+    def resetFiducialsTracking(self):
+        """ Stop tracking the changes in the fiducials list nodes. The markups will be matched again with the points
+        of the current GeometryTopologyData object the next time that the fiducials are saved
+        """
+        for tracker in self.fiducialsTrackers.values():
+            tracker.stop()
+        self.fiducialsTrackers = {}
+
+    def compactFiducialsJournal(self):
+        """ Rewrite the xml file of the current GeometryTopologyData object if there are pending changes in the journal
+        """
+        if self.currentJournal is not None and self.currentJournal.numberOfRecords > 0 \
+                and self.currentGeometryTopologyData is not None:
+            self.currentJournal.compact(self.currentGeometryTopologyData)
+
+    def __updateGeometryTopologyData__(self, volume, geometryTopologyData, timestamp):
+        """ Update a GeometryTopologyData object with the markups of the volume that changed since the last save.
+        The markups of the fiducials list nodes that are not tracked yet (ex: first save after loading a file) are
+        matched with the saved points that have the same fields. Duplicated markups are matched one by one
+        :param volume: scalar volume node
+        :param geometryTopologyData: GeometryTopologyData object with the points saved the last time
+        :param timestamp: timestamp of the new points
+        :return: tuple with the lists of added points and removed points
+        """
+        volumeName = volume.GetName()
+        addedPoints = []
+        removedPoints = []
+
+        # Fiducials list nodes removed from the scene
+        for nodeId, tracker in list(self.fiducialsTrackers.items()):
+            if tracker.volumeName == volumeName and slicer.mrmlScene.GetNodeByID(nodeId) is None:
+                removedPoints.extend(tracker.points.values())
+                tracker.stop()
+                del self.fiducialsTrackers[nodeId]
+
+        # Markups that changed in the tracked nodes
+        newNodes = []
+        for fidListNode in SlicerUtil.getNodesByPattern("{0}_fiducials_*".format(volumeName)).values():
+            tracker = self.fiducialsTrackers.get(fidListNode.GetID())
+            if tracker is None:
+                newNodes.append(fidListNode)
+                continue
+            removed, dirtyMarkupIds = tracker.popChanges()
+            removedPoints.extend(removed)
+            for markupId in dirtyMarkupIds:
+                index = fidListNode.GetMarkupIndexByID(markupId)
+                if index < 0:
+                    # Added and removed before saving
+                    continue
+                p = self.__getPointFromMarkup__(fidListNode, index)
+                previous = tracker.points.get(markupId)
+                if previous is not None:
+                    if self.__getPointKey__(previous) == self.__getPointKey__(p):
+                        continue
+                    removedPoints.append(previous)
+                tracker.points[markupId] = p
+                addedPoints.append(p)
+        for p in removedPoints:
+            geometryTopologyData.remove_point(p)
+
+        if newNodes or not any(t.volumeName == volumeName for t in self.fiducialsTrackers.values()):
+            # Match the markups of the new nodes with the points that are not matched yet (multiset of keys, so
+            # that duplicated markups are matched with duplicated points)
+            matched = set(id(p) for t in self.fiducialsTrackers.values() for p in t.points.values())
+            unmatched = defaultdict(list)
+            for p in geometryTopologyData.points:
+                if id(p) not in matched:
+                    unmatched[self.__getPointKey__(p)].append(p)
+            for fidListNode in newNodes:
+                tracker = FiducialsNodeTracker(fidListNode, volumeName)
+                self.fiducialsTrackers[fidListNode.GetID()] = tracker
+                for i in range(fidListNode.GetNumberOfMarkups()):
+                    p = self.__getPointFromMarkup__(fidListNode, i)
+                    candidates = unmatched.get(self.__getPointKey__(p))
+                    if candidates:
+                        p = candidates.pop()
+                    else:
+                        addedPoints.append(p)
+                    tracker.points[fidListNode.GetNthMarkupID(i)] = p
+            # Saved points that don't have a markup anymore
+            for points in unmatched.values():
+                for p in points:
+                    geometryTopologyData.remove_point(p)
+                    removedPoints.append(p)
+
+        for p in addedPoints:
+            # Add a new point with a precalculated timestamp
+            geometryTopologyData.add_point(p, fill_auto_fields=True)
+            p.timestamp = timestamp
+        return addedPoints, removedPoints
+
+    def __getPointFromMarkup__(self, fidListNode, index):
+        """ Create a GeometryTopologyData.Point object (LPS) from a markup
+        :param fidListNode: fiducials list node
+        :param index: index of the markup
+        :return: GeometryTopologyData.Point
+        """
+        pos = [0, 0, 0]
+        fidListNode.GetNthFiducialPosition(index, pos)
+        # Get the type from the description (region will always be 0)
+        pointMetadata = self.getPointMetadataFromFiducialDescription(fidListNode.GetNthMarkupDescription(index))
+        # Switch coordinates from RAS to LPS
+        lps_coords = Util.ras_to_lps(list(pos))
+        return gtd.Point(pointMetadata[0], pointMetadata[1], pointMetadata[2], lps_coords,
+                         description=pointMetadata[3])
+
+    @staticmethod
+    def __getPointKey__(p):
+        """ Fields of a point that are saved from the markups (the hash does not include the description)
+        """
+        return p.get_hash(), p.description
+
+    def __createGeometryTopologyData__(self, volume):
+        """ Create an empty GeometryTopologyData object (LPS) with the metadata of a volume.
+        The points of the current GeometryTopologyData object (if any) are kept, so that the points that did not
+        change preserve their ids and timestamps
+        :param volume: scalar volume node
+        :return: GeometryTopologyData object
+        """
+        geometryTopologyData = gtd.GeometryTopologyData()
+        geometryTopologyData.coordinate_system = geometryTopologyData.LPS
+        # Get the transformation matrix LPS-->IJK
+        matrix = Util.get_lps_to_ijk_transformation_matrix(volume)
+        geometryTopologyData.lps_to_ijk_transformation_matrix = Util.convert_vtk_matrix_to_list(matrix)
+        # Save spacing and origin of the volume
+        geometryTopologyData.origin = volume.GetOrigin()
+        geometryTopologyData.spacing = volume.GetSpacing()
+        geometryTopologyData.dimensions = volume.GetImageData().GetDimensions()
+
+        # Get the seed from previously loaded GeometryTopologyData object (if available)
+        if self.currentGeometryTopologyData is not None:
+            if self.currentGeometryTopologyData.coordinate_system == self.currentGeometryTopologyData.LPS:
+                for p in self.currentGeometryTopologyData.points:
+                    geometryTopologyData.add_point(p, fill_auto_fields=False)
+            geometryTopologyData.seed_id = self.currentGeometryTopologyData.seed_id
+        return geometryTopologyData
 
     def removeLastFiducial(self):
         """ Remove the last markup that was added to the scene. It will remove all the markups if the user wants
@@ -567,11 +823,15 @@ class CIP_PointsLabellingLogic(ScriptedLoadableModuleLogic):
         return self.savedVolumes[volumeName]
 
     def removeMarkupsAndNode(self, volume):
-        nodes = slicer.util.getNodes(volume.GetName() + "_*")
+        nodes = SlicerUtil.getNodesByPattern(volume.GetName() + "_*")
         for node in nodes.values():
             slicer.mrmlScene.RemoveNode(node)
         slicer.mrmlScene.RemoveNode(volume)
+        # Closing the case. Write the pending changes to the xml file
+        self.compactFiducialsJournal()
+        self.resetFiducialsTracking()
         self.currentGeometryTopologyData = None
+        self.currentJournal = None
 
 
 
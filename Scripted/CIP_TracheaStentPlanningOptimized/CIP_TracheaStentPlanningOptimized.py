@@ -11,10 +11,12 @@ import math
 import itertools
 
 import scipy.optimize as scipy_opt
+import scipy.spatial as scipy_spatial
 import vtk.util.numpy_support as nc
 from CIP.logic.SlicerUtil import SlicerUtil
 
 from CIP.logic import Util
+from CIP.logic.timer import GlobalProfiler
 
 
 #
@@ -686,6 +688,12 @@ class CIP_TracheaStentPlanningOptimizedLogic(ScriptedLoadableModuleLogic):
 
         self.thresholdFilter = None
 
+        # KD-tree over the trachea surface used by the Y stent optimization (see tracheaKDTree)
+        self.__tracheaKDTree__ = None
+        self.__tracheaKDTreeKey__ = None
+        # Cross section pipeline used by the stent plane optimization (see crossSectionFilters)
+        self.__crossSectionFilters__ = None
+
 
     def __initVars__(self):
         """ Init all the variables that are going to be used to perform all the operations
@@ -822,6 +830,7 @@ class CIP_TracheaStentPlanningOptimizedLogic(ScriptedLoadableModuleLogic):
         nodes = self.currentFiducialsListNodes[stentType]
         self.markupsLogic.SetActiveListID(nodes[fiducialIndex])
 
+    @GlobalProfiler.profile_run("TracheaSegmentation")
     def runSegmentationPipeline(self, stentTypeKey):
         """ Run the segmentation algorithm for the selected stent type
         :param stentTypeKey: T Sent or Y Stent
@@ -901,83 +910,48 @@ class CIP_TracheaStentPlanningOptimizedLogic(ScriptedLoadableModuleLogic):
 
         self.currentDistanceMean = (dd01 + dd02 + dd12) / 3
         if SlicerUtil.IsDevelopment: print(("DEBUG: preprocessing:", time.time() - start))
-        # Build the speed map for Fast Marching thresholding the original volume
-        activeVolumeArray = slicer.util.array(activeNode.GetID())
-        speedTest = (activeVolumeArray < -800).astype(np.int32)
 
-        # Create all the auxiliary nodes for results
+        # Every front stops at its own distance, so the segmentation can never go further than the biggest one.
+        # Work in a bounding box of the seeds padded with that distance (the result is the same as in the whole volume)
         t1 = time.time()
-        # lm01 = SlicerUtil.cloneVolume(activeNode, activeNode.GetName() + "_lm01")
-        # a01 = slicer.util.array(lm01.GetID())
-        # lm02 = SlicerUtil.cloneVolume(activeNode, activeNode.GetName() + "_lm02")
-        # a02 = slicer.util.array(lm02.GetID())
-        # lm12 = SlicerUtil.cloneVolume(activeNode, activeNode.GetName() + "_lm12")
-        # a12 = slicer.util.array(lm12.GetID())
-        dim = activeNode.GetImageData().GetDimensions()
-        shape = [dim[2], dim[1], dim[0]]
-        a01 = np.zeros(shape, np.int32)
-        a02 = np.zeros(shape, np.int32)
-        a12 = np.zeros(shape, np.int32)
-        # Results of the algorithm
-        self.currentResultsNode = SlicerUtil.cloneVolume(activeNode, activeNode.GetName() + "_result", addToScene=True)
+        activeVolumeArray = slicer.util.array(activeNode.GetID())
+        seeds = [pos0, pos2, pos1]
+        stoppingValues = [dd01, dd02, dd12]
+        roiOrigin, roiSize = self.__getSegmentationROI__(seeds, max(stoppingValues), spacing, activeVolumeArray.shape)
+        x0, y0, z0 = roiOrigin
+        x1, y1, z1 = (roiOrigin[i] + roiSize[i] for i in range(3))
+        roiArray = activeVolumeArray[z0:z1, y0:y1, x0:x1]
+        if SlicerUtil.IsDevelopment: print(("DEBUG: ROI size:", roiSize, time.time() - t1))
+
+        # Results of the algorithm (compact volumes that only cover the ROI)
+        t1 = time.time()
+        self.__removeSegmentationResults__()
+        self.currentResultsNode = self.__createROIVolume__(activeNode, activeNode.GetName() + "_result",
+                                                           roiOrigin, roiSize)
         self.currentResultsArray = slicer.util.array(self.currentResultsNode.GetID())
         self.currentLabelmapResults = SlicerUtil.getLabelmapFromScalar(self.currentResultsNode,
                                                                        activeNode.GetName() + "_results_lm")
         if SlicerUtil.IsDevelopment: print(("DEBUG: create aux nodes:", time.time() - t1))
+
+        # Build the speed map for Fast Marching thresholding the original volume
         # Create SimpleITK FastMarching filter with the thresholded original image as a speed map
-        sitkImage = sitk.GetImageFromArray(speedTest)
-        fastMarchingFilter = sitk.FastMarchingImageFilter()
+        sitkImage = sitk.GetImageFromArray((roiArray < -800).astype(np.int32))
         sitkImage.SetSpacing(spacing)
+        fastMarchingFilter = sitk.FastMarchingImageFilter()
 
         # Run the fast marching filters from the 3 points.
-        # Every result array will contain the "distance inverted" value (distance - value) because we will add all the arrays
-        # Filter 01
-        t1 = time.time()
-        d = dd01
-        fastMarchingFilter.SetStoppingValue(d)
-        seeds = [pos0]
-        fastMarchingFilter.SetTrialPoints(seeds)
-        output = fastMarchingFilter.Execute(sitkImage)
-        outputArray = sitk.GetArrayFromImage(output)
-        # a01[:] = 0
-        temp = outputArray <= d
-        a01[temp] = d - outputArray[temp]
-        # lm01.GetImageData().Modified()
-        if SlicerUtil.IsDevelopment: print(("DEBUG: filter 01:", time.time() - t1))
-
-        # Filter 02
-        t1 = time.time()
-        d = dd02
-        fastMarchingFilter.SetStoppingValue(d)
-        seeds = [pos2]
-        fastMarchingFilter.SetTrialPoints(seeds)
-        output = fastMarchingFilter.Execute(sitkImage)
-        outputArray = sitk.GetArrayFromImage(output)
-        # a02[:] = 0
-        temp = outputArray <= d
-        a02[temp] = d - outputArray[temp]
-        # lm02.GetImageData().Modified()
-        if SlicerUtil.IsDevelopment: print(("DEBUG: filter 02:", time.time() - t1))
-
-        # Filter 12
-        t1 = time.time()
-        d = dd12
-        fastMarchingFilter.SetStoppingValue(d)
-        seeds = [pos1]
-        fastMarchingFilter.SetTrialPoints(seeds)
-        output = fastMarchingFilter.Execute(sitkImage)
-        outputArray = sitk.GetArrayFromImage(output)
-        # a12[:] = 0
-        temp = outputArray <= d
-        a12[temp] = d - outputArray[temp]
-        # lm12.GetImageData().Modified()
-        if SlicerUtil.IsDevelopment: print(("DEBUG: filter 12:", time.time() - t1))
-
-        t1 = time.time()
-        # Sum the results of the 3 filters
-        self.currentResultsArray[:] = a01 + a02 + a12
+        # Every front adds its "distance inverted" value (distance - value) to the result, so they cannot be merged
+        # in a single front, but they are accumulated in place in the compact result array
+        self.currentResultsArray[:] = 0
+        for seed, d in zip(seeds, stoppingValues):
+            t1 = time.time()
+            fastMarchingFilter.SetStoppingValue(d)
+            fastMarchingFilter.SetTrialPoints([[seed[0] - x0, seed[1] - y0, seed[2] - z0]])
+            outputArray = sitk.GetArrayFromImage(fastMarchingFilter.Execute(sitkImage))
+            temp = outputArray <= d
+            self.currentResultsArray[temp] += (d - outputArray[temp]).astype(np.int32)
+            if SlicerUtil.IsDevelopment: print(("DEBUG: fast marching:", time.time() - t1))
         self.currentResultsNode.GetImageData().Modified()
-        if SlicerUtil.IsDevelopment: print(("DEBUG: processing results:", time.time() - t1))
 
         # Threshold to get the final labelmap
         t1 = time.time()
@@ -1000,6 +974,55 @@ class CIP_TracheaStentPlanningOptimizedLogic(ScriptedLoadableModuleLogic):
         if SlicerUtil.IsDevelopment: print(("DEBUG: total time: ", time.time() - start))
         return True
 
+    def __getSegmentationROI__(self, seeds, distance, spacing, shape):
+        """ Bounding box of the seeds padded with a physical distance and clipped to the volume
+        :param seeds: list of ijk coordinates (x, y, z)
+        :param distance: padding in mm
+        :param spacing: volume spacing (x, y, z)
+        :param shape: shape of the volume numpy array (z, y, x)
+        :return: tuple with the ijk origin (x, y, z) and the size (x, y, z) of the ROI
+        """
+        dims = (shape[2], shape[1], shape[0])
+        origin = []
+        size = []
+        for axis in range(3):
+            padding = int(math.ceil(distance / spacing[axis])) + 1
+            lower = max(min(s[axis] for s in seeds) - padding, 0)
+            upper = min(max(s[axis] for s in seeds) + padding + 1, dims[axis])
+            origin.append(lower)
+            size.append(upper - lower)
+        return origin, size
+
+    def __createROIVolume__(self, volumeNode, name, roiOrigin, roiSize):
+        """ Create a zeroed int32 scalar volume with the same orientation and spacing than volumeNode that covers
+        only a ROI of it
+        :param volumeNode: reference volume
+        :param name: name of the new node
+        :param roiOrigin: ijk origin of the ROI in volumeNode (x, y, z)
+        :param roiSize: size of the ROI (x, y, z)
+        :return: new scalar node (added to the scene)
+        """
+        roiNode = SlicerUtil.cloneVolume(volumeNode, name, cloneImageData=False, addToScene=True)
+        imageData = vtk.vtkImageData()
+        imageData.SetDimensions(roiSize)
+        imageData.AllocateScalars(vtk.VTK_INT, 1)
+        imageData.GetPointData().GetScalars().Fill(0)
+        roiNode.SetAndObserveImageData(imageData)
+        roiNode.SetOrigin(Util.ijk_to_ras(volumeNode, roiOrigin))
+        return roiNode
+
+    def __removeSegmentationResults__(self):
+        """ Remove the results of a previous segmentation (when the fiducials are moved and the segmentation is
+        run again)
+        """
+        for node in (self.currentResultsNode, self.currentLabelmapResults, self.currentTracheaModel):
+            if node is not None:
+                slicer.mrmlScene.RemoveNode(node)
+        self.currentResultsNode = None
+        self.currentResultsArray = None
+        self.currentLabelmapResults = None
+        self.currentTracheaModel = None
+
     def tracheaLabelmapThreshold(self, thresholdFactor):
         """ Update the threshold used to generate the segmentation (when the thresholdFactor is bigger, "more trachea"
         will be displayed
@@ -1110,6 +1133,7 @@ class CIP_TracheaStentPlanningOptimizedLogic(ScriptedLoadableModuleLogic):
 
 
 
+    @GlobalProfiler.profile_run("YStentOptimization")
     def automaticOptimizationYStent(self,p1, p2,p3):
         """
         Calculate optimal points and radius for the Y Stent
@@ -1257,7 +1281,7 @@ class CIP_TracheaStentPlanningOptimizedLogic(ScriptedLoadableModuleLogic):
                  )
 
         res2 = scipy_opt.minimize(self.minimum, parameters, args=(arguments), constraints=cons2, method='SLSQP',
-                                  options={'disp': True, 'ftol': 0.01, 'maxiter': 150}, callback=self.myfunc)
+                                  jac=self.minimumGradient, options={'disp': True, 'ftol': 0.01, 'maxiter': 150}, callback=self.myfunc)
 
 
         pm1=[res2.x[1], res2.x[2], res2.x[3]]
@@ -1290,19 +1314,42 @@ class CIP_TracheaStentPlanningOptimizedLogic(ScriptedLoadableModuleLogic):
     def cylinderSurfaceArea(self, norm_vector, point, tracheaFilter):
         """
         Calculate area of a cylinder based on a normal vector, a point and a butterfly subdivision filter
-        based on the current trachea model
+        based on the current trachea model.
+        The same plane, cutter and connectivity filter are reused in all the calls for the same trachea filter
         :param norm_vector:
         :param point:
         :param tracheaFilter:
         :return: area
         """
-        plane = self.plane(norm_vector, point)
-        intersection = self.intersection(tracheaFilter, plane, point)
+        plane, connectivity = self.crossSectionFilters(tracheaFilter)
+        normal = np.asarray(norm_vector, dtype=np.float64)
+        normal = normal / np.sqrt(np.sum(normal ** 2))
+        plane.SetOrigin(point)
+        plane.SetNormal(normal[0], normal[1], normal[2])
+        connectivity.SetClosestPoint(point)
+        connectivity.Update()
         result = vtk.vtkPolyData()
-        result.SetPoints(intersection.GetOutput().GetPoints())
-        result.SetLines(intersection.GetOutput().GetCells())
+        result.SetPoints(connectivity.GetOutput().GetPoints())
+        result.SetLines(connectivity.GetOutput().GetCells())
         return self.area(result, norm_vector)
 
+    def crossSectionFilters(self, tracheaFilter):
+        """
+        Plane and cutter + connectivity pipeline used to compute the cross sections of the trachea.
+        The pipeline is built only once for every trachea filter
+        :param tracheaFilter: trachea filter
+        :return: tuple with the vtkPlane and the vtkConnectivityFilter
+        """
+        if self.__crossSectionFilters__ is None or self.__crossSectionFilters__[0] is not tracheaFilter:
+            plane = vtk.vtkPlane()
+            cutter = vtk.vtkCutter()
+            cutter.SetCutFunction(plane)
+            cutter.SetInputConnection(tracheaFilter.GetOutputPort())
+            connectivity = vtk.vtkConnectivityFilter()
+            connectivity.SetInputConnection(cutter.GetOutputPort())
+            connectivity.SetExtractionModeToClosestPointRegion()
+            self.__crossSectionFilters__ = (tracheaFilter, plane, connectivity)
+        return self.__crossSectionFilters__[1:]
 
     def buildTracheaButterflySubdivisionFilter(self, tracheaModel):
         """
@@ -1358,28 +1405,46 @@ class CIP_TracheaStentPlanningOptimizedLogic(ScriptedLoadableModuleLogic):
 
     def area(self, poly, n):
         """
-        calculates the area of a polygon
+        calculates the area of a polygon (vectorized shoelace formula over the polygon segments)
         :param poly: polygon
         :param n: normal vector of the polygon
         :return: area
         """
-        aa = poly.GetLines()
-        aa.InitTraversal()
-        total = np.zeros(3, )
         if poly.GetNumberOfPoints() == 0:
             return 1000
-        for i in range(aa.GetNumberOfCells()):
-            p_idx = vtk.vtkIdList()
-            aa.GetNextCell(p_idx)
-            p1_idx = p_idx.GetId(0)
-            p2_idx = p_idx.GetId(1)
-            p1 = np.array(poly.GetPoints().GetPoint(p1_idx))
-            p2 = np.array(poly.GetPoints().GetPoint(p2_idx))
-            total = total + np.cross(p1, p2)
+        points = nc.vtk_to_numpy(poly.GetPoints().GetData()).astype(np.float64)
+        segments = self.lineSegments(poly.GetLines())
+        total = np.cross(points[segments[:, 0]], points[segments[:, 1]]).sum(axis=0)
         result = np.dot(total, n / np.linalg.norm(n))
         Result = abs(result / 2)
         return Result
 
+    def lineSegments(self, cellArray):
+        """
+        first and second point ids of every cell in a vtkCellArray
+        :param cellArray: vtkCellArray
+        :return: Nx2 numpy array of point ids
+        """
+        numberOfCells = cellArray.GetNumberOfCells()
+        if numberOfCells == 0:
+            return np.zeros((0, 2), dtype=np.int64)
+        if hasattr(cellArray, "GetOffsetsArray"):
+            # VTK >= 9
+            offsets = nc.vtk_to_numpy(cellArray.GetOffsetsArray())[:-1]
+            connectivity = nc.vtk_to_numpy(cellArray.GetConnectivityArray())
+            return np.column_stack((connectivity[offsets], connectivity[offsets + 1]))
+        # Legacy format: [n, id0, id1, ..., n, id0, id1, ...]
+        data = nc.vtk_to_numpy(cellArray.GetData())
+        if len(data) == 3 * numberOfCells:
+            # All the cells are segments
+            return data.reshape(-1, 3)[:, 1:]
+        segments = np.zeros((numberOfCells, 2), dtype=data.dtype)
+        position = 0
+        for i in range(numberOfCells):
+            segments[i] = data[position + 1:position + 3]
+            position += data[position] + 1
+        return segments
+
     def centroide(self, intersection):
         """
         calculates the centroid of the intersection
@@ -1420,11 +1485,9 @@ class CIP_TracheaStentPlanningOptimizedLogic(ScriptedLoadableModuleLogic):
         :param intersection:
         :return: polygon
         """
-
-        polygon = np.zeros([intersection.GetOutput().GetNumberOfPoints(), 3])
-        for i in range(intersection.GetOutput().GetNumberOfPoints()):
-            polygon[i] = intersection.GetOutput().GetPoints().GetPoint(i)
-        return polygon
+        if intersection.GetOutput().GetNumberOfPoints() == 0:
+            return np.zeros([0, 3])
+        return np.array(nc.vtk_to_numpy(intersection.GetOutput().GetPoints().GetData()), dtype=np.float64)
 
 
     def dist_ort(self, centroids):
@@ -1549,22 +1612,31 @@ class CIP_TracheaStentPlanningOptimizedLogic(ScriptedLoadableModuleLogic):
         variables[11] = mediumPoints[2][2]
         return variables
 
+    def tracheaKDTree(self, traq):
+        """
+        KD-tree over the points of the trachea surface. It is built only once for every trachea filter
+        (until the filter output is modified)
+        :param traq: trachea filter
+        :return: tuple with the trachea points (Nx3 numpy array) and the scipy cKDTree
+        """
+        output = traq.GetOutput()
+        key = (id(traq), output.GetMTime(), output.GetNumberOfPoints())
+        if self.__tracheaKDTreeKey__ != key:
+            points = np.array(nc.vtk_to_numpy(output.GetPoints().GetData()), dtype=np.float64)
+            self.__tracheaKDTree__ = (points, scipy_spatial.cKDTree(points))
+            self.__tracheaKDTreeKey__ = key
+        return self.__tracheaKDTree__
+
     def homologous(self, traq, p_cil):
         """
         calculates the points of the trachea that correspond to the given points of the cylinder
         :param traq: trachuea
         :param p_cil: cylinder points
-        :return: trachea points
+        :return: trachea points (Nx3 numpy array)
         """
-        loc = vtk.vtkPointLocator()
-        loc.SetDataSet(traq.GetOutput())
-        loc.BuildLocator()
-        vector = vtk.vtkPoints()
-        for i in range(len(p_cil)):
-            d = loc.FindClosestPoint(p_cil[i])
-            res = traq.GetOutput().GetPoints().GetPoint(d)
-            vector.InsertNextPoint(res)
-        return vector
+        points, tree = self.tracheaKDTree(traq)
+        indexes = tree.query(np.asarray(p_cil))[1]
+        return points[indexes]
 
     def functional(self, cil1, cil2, cil3, hom1, hom2, hom3):
         """
@@ -1578,64 +1650,78 @@ class CIP_TracheaStentPlanningOptimizedLogic(ScriptedLoadableModuleLogic):
         :return: distances
         """
         suma = 0
-        for i in range(len(cil1)):
-            punto = hom1.GetPoint(i)
-            cilind = cil1[i]
-            suma = suma + (np.sqrt(np.sum((punto[0:2] - cilind[0:2]) ** 2)))
-        for i in range(len(cil2)):
-            punto = hom2.GetPoint(i)
-            cilind = cil2[i]
-            suma = suma + (np.sqrt(np.sum((punto[0:2] - cilind[0:2]) ** 2)))
-        for i in range(len(cil3)):
-            punto = hom3.GetPoint(i)
-            cilind = cil3[i]
-            suma = suma + (np.sqrt(np.sum((punto[0:2] - cilind[0:2]) ** 2)))
+        for cil, hom in ((cil1, hom1), (cil2, hom2), (cil3, hom3)):
+            suma = suma + np.sum(np.sqrt(np.sum((hom[:, 0:2] - cil[:, 0:2]) ** 2, axis=1)))
         return suma
 
-    def minimum(self, parameters, centroid1, centroid2, centroid3, traq):
+    def cylindersPoints(self, parameters, centroid1, centroid2, centroid3):
         """
-        calculates the medium square error of the distances between cylinder and trachea
-        :param parameters: initial parameters (points and radius)
+        calculates the surface points of the 3 cylinders for a set of optimization parameters
+        :param parameters: parameters (points and radius)
         :param centroids: centroids
-        :return: error
+        :return: 3-Tuple:
+            list with the points of every cylinder (Nx3 numpy arrays)
+            isup2 value
+            isup3 value
         """
-        pm2 = [0, 0, 0]
-        pm3 = [0, 0, 0]
         rad1 = parameters[0]
         rad2 = parameters[4]
-        pm2[0] = parameters[5]
-        pm2[1] = parameters[6]
-        pm2[2] = parameters[7]
+        pm2 = np.array(parameters[5:8])
         rad3 = parameters[8]
-        pm3[0] = parameters[9]
-        pm3[1] = parameters[10]
-        pm3[2] = parameters[11]
+        pm3 = np.array(parameters[9:12])
         d2 = np.sqrt(np.sum(((centroid1[0:2] - pm2[0:2]) ** 2)))
         d3 = np.sqrt(np.sum(((centroid1[0:2] - pm3[0:2]) ** 2)))
         if d2 < d3:
             pm1 = pm2
-            self.isup2 = 1
-            self.isup3 = 0
+            isup2, isup3 = 1, 0
         else:
             pm1 = pm3
-            self.isup2 = 0
-            self.isup3 = 1
-        longitud1 = np.sqrt(np.sum((pm1[0:3] - centroid1[0:3]) ** 2))
-        ll1 = np.linspace(0, longitud1, 50)
+            isup2, isup3 = 0, 1
         ff = np.linspace(0, 200 * np.pi, 50)
-        longitud2 = np.sqrt(np.sum((pm2[0:3] - centroid2[0:3]) ** 2))
-        ll2 = np.linspace(0, longitud2, 50)
-        longitud3 = np.sqrt(np.sum((pm3[0:3] - centroid3[0:3]) ** 2))
-        ll3 = np.linspace(0, longitud3, 50)
-        points_cil1 = self.cylinder(centroid1, pm1, rad1, ll1, ff)
-        points_cil2 = self.cylinder(centroid2, pm2, rad2, ll2, ff)
-        points_cil3 = self.cylinder(centroid3, pm3, rad3, ll3, ff)
+        points = []
+        for centroid, pm, rad in ((centroid1, pm1, rad1), (centroid2, pm2, rad2), (centroid3, pm3, rad3)):
+            longitud = np.sqrt(np.sum((pm[0:3] - centroid[0:3]) ** 2))
+            points.append(self.cylinder(centroid, pm, rad, np.linspace(0, longitud, 50), ff))
+        return points, isup2, isup3
+
+    def minimum(self, parameters, centroid1, centroid2, centroid3, traq):
+        """
+        calculates the medium square error of the distances between cylinder and trachea
+        :param parameters: initial parameters (points and radius)
+        :param centroids: centroids
+        :return: error
+        """
+        (points_cil1, points_cil2, points_cil3), self.isup2, self.isup3 = \
+            self.cylindersPoints(parameters, centroid1, centroid2, centroid3)
         hom1 = self.homologous(traq, points_cil1)
         hom2 = self.homologous(traq, points_cil2)
         hom3 = self.homologous(traq, points_cil3)
         error = self.functional(points_cil1, points_cil2, points_cil3, hom1, hom2, hom3)
         return error
 
+    def minimumGradient(self, parameters, centroid1, centroid2, centroid3, traq):
+        """
+        forward finite differences gradient of "minimum". All the perturbed cylinders are evaluated with a single
+        KD-tree query. The isup2/isup3 values used by the constraints are not modified
+        :param parameters: parameters (points and radius)
+        :param centroids: centroids
+        :return: gradient (numpy array with the same length as parameters)
+        """
+        parameters = np.asarray(parameters, dtype=np.float64)
+        n = len(parameters)
+        # Same step as the default one used by scipy SLSQP
+        epsilon = np.sqrt(np.finfo(float).eps)
+        evaluations = [parameters] + [parameters + epsilon * np.eye(n)[i] for i in range(n)]
+        blocks = []
+        for params in evaluations:
+            cylinders = self.cylindersPoints(params, centroid1, centroid2, centroid3)[0]
+            blocks.append(np.vstack(cylinders))
+        allPoints = np.vstack(blocks)
+        hom = self.homologous(traq, allPoints)
+        distances = np.sqrt(np.sum((hom[:, 0:2] - allPoints[:, 0:2]) ** 2, axis=1))
+        values = distances.reshape(len(evaluations), -1).sum(axis=1)
+        return (values[1:] - values[0]) / epsilon
+
     def updateCylindersRadius(self, stentKey, newRadius1, newRadius2, newRadius3):
         """ Update the radius of the cylinders of stent "stentType"
         :param stentKey: type of stent (Y or T)
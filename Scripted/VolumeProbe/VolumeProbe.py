@@ -1,6 +1,7 @@
 import os, string
 import unittest
 import vtk, qt, ctk, slicer
+import vtk.util.numpy_support
 import numpy as np
 
 from slicer.ScriptedLoadableModule import *
@@ -199,51 +200,27 @@ class VolumeProbeWidget(ScriptedLoadableModuleWidget):
         self.layout.addStretch(1)
 
     def reportROIStats(self, pixelArray):
-        min = 0
-        max = 0
-        mean = 0
-        med = 0
-        self.histogramArray.SetNumberOfTuples(0)
-        if len(pixelArray):
-            pixels = np.array(pixelArray)
-            min = pixels.min()
-            max = pixels.max()
-            mean = pixels.mean()
-            standardDeviation = pixels.std()
-            med = self.median(pixelArray)
-            for i in range(len(pixelArray)):
-                self.histogramArray.InsertNextTuple1(pixels[i])
-
-        self.minField.setValue(min)
-        self.maxField.setValue(max)
-        self.meanField.setValue(mean)
-        self.medianField.setValue(med)
-        self.stdField.value = standardDeviation
+        """ Display the statistics of the pixels in the ROI
+        :param pixelArray: numpy array (or list) with the values of the pixels in the ROI
+        """
+        stats = VolumeProbeLogic.computeStatistics(pixelArray)
+        pixels = stats["pixels"]
+        # Bulk copy of the pixels in the histogram array (shared memory with the numpy view)
+        self.histogramArray.SetNumberOfTuples(len(pixels))
+        if len(pixels):
+            vtk.util.numpy_support.vtk_to_numpy(self.histogramArray)[:] = pixels
+        self.histogramArray.Modified()
+
+        self.minField.setValue(stats["min"])
+        self.maxField.setValue(stats["max"])
+        self.meanField.setValue(stats["mean"])
+        self.medianField.setValue(stats["median"])
+        self.stdField.value = stats["std"]
         self.histogram.numberOfBins = self.numBins.value
         # This causes crash in slicer starting end of April 2015
         # self.histogram.build()
         self.histogramView.show()
 
-    def median(self, data):
-        """Return the median (middle value) of numeric data.
-        When the number of data points is odd, return the middle data point.
-        When the number of data points is even, the median is interpolated by
-        taking the average of the two middle values:
-        >>> median([1, 3, 5])
-        3
-        >>> median([1, 3, 5, 7])
-        4.0
-        """
-        data = sorted(data)
-        n = len(data)
-        if n == 0:
-            return 0
-        if n % 2 == 1:
-            return data[n // 2]
-        else:
-            i = n // 2
-            return (data[i - 1] + data[i]) / 2
-
     def onDrawROIToggled(self):
         if self.drawROICheck.checked:
             self.roiManager = ROIManager()
@@ -335,6 +312,54 @@ class VolumeProbeLogic(ScriptedLoadableModuleLogic):
         self.lookupTable = self.colors.GetLookupTable()
         print("VolumeProbeLogic CREATED")
 
+    @staticmethod
+    def getROIPixels(imageData, center, radius, circular=True):
+        """ Get the values of the pixels of a 2D image inside a ROI.
+        Only the bounding square of the ROI is read from the image (no copy of the whole slice)
+        :param imageData: 2D vtkImageData (ex: output of the reslice of a slice layer)
+        :param center: (x, y) center of the ROI in pixels
+        :param radius: radius of the ROI in pixels (half of the side when the ROI is rectangular)
+        :param circular: circular ROI when True. Otherwise rectangular
+        :return: 1D numpy array (float64) with the values of the first component of the pixels inside the ROI
+        """
+        scalars = imageData.GetPointData().GetScalars() if imageData else None
+        if scalars is None:
+            return np.zeros(0)
+        dims = imageData.GetDimensions()
+        # numpy view of the image ordered as (y, x)
+        array = vtk.util.numpy_support.vtk_to_numpy(scalars).reshape(
+            dims[2], dims[1], dims[0], scalars.GetNumberOfComponents())[0, :, :, 0]
+        x, y = center
+        x0 = max(int(np.floor(x - radius)), 0)
+        x1 = min(int(np.ceil(x + radius)) + 1, dims[0])
+        y0 = max(int(np.floor(y - radius)), 0)
+        y1 = min(int(np.ceil(y + radius)) + 1, dims[1])
+        if x0 >= x1 or y0 >= y1:
+            return np.zeros(0)
+        roi = array[y0:y1, x0:x1]
+        jj, ii = np.ogrid[y0:y1, x0:x1]
+        if circular:
+            mask = (ii - x) ** 2 + (jj - y) ** 2 < radius * radius
+        else:
+            mask = (np.abs(ii - x) < radius) & (np.abs(jj - y) < radius)
+        return roi[mask].astype(np.float64)
+
+    @staticmethod
+    def computeStatistics(pixels):
+        """ Compute the statistics of a set of pixels
+        :param pixels: numpy array (or list) of values
+        :return: dictionary with the pixels (numpy array), min, max, mean, std and median
+        """
+        pixels = np.asarray(pixels, dtype=np.float64).ravel()
+        stats = {"pixels": pixels, "min": 0, "max": 0, "mean": 0, "std": 0, "median": 0}
+        if len(pixels):
+            stats["min"] = pixels.min()
+            stats["max"] = pixels.max()
+            stats["mean"] = pixels.mean()
+            stats["std"] = pixels.std()
+            stats["median"] = np.median(pixels)
+        return stats
+
 
 class ViewWatcher(object):
     """A helper class to manage observers on slice views"""
@@ -499,6 +524,9 @@ class ViewWatcher(object):
 class ROIManager(ViewWatcher):
     """Track the mouse and show a reveal view"""
 
+    # Minimum time between two renders of the ROI (~60 Hz)
+    RENDER_INTERVAL_MS = 16
+
     def __init__(self, parent=None, width=400, height=400, showWidget=False, scale=False):
         super(ROIManager, self).__init__()
         self.width = width
@@ -565,7 +593,20 @@ class ROIManager(ViewWatcher):
         property_.SetColor(1, 1, 0)
         property_.SetLineWidth(1)
 
+        # Mouse events are coalesced to the display refresh rate
+        self.renderTimer = qt.QTimer()
+        self.renderTimer.setSingleShot(True)
+        self.renderTimer.setInterval(self.RENDER_INTERVAL_MS)
+        self.renderTimer.connect('timeout()', self.__onRenderTimeout__)
+
+        # Cache of the layers converted to QImage (see layerQImages)
+        self.__layerImagesKey__ = None
+        self.__layerImages__ = None
+
     def tearDown(self):
+        self.renderTimer.stop()
+        self.__layerImagesKey__ = None
+        self.__layerImages__ = None
         # clean up widget
         self.frame = None
         self.probeWidget = None
@@ -585,19 +626,13 @@ class ROIManager(ViewWatcher):
         self.probeWidget = probeWidget
 
     def onSliceWidgetEvent(self, event):
-        if self.drawOverlay:
-            overlayPixmap = self.overlayPixmap(self.xy)
-
-        # widget
-        if self.showWidget:
-            self.label.setPixmap(overlayPixmap)
-
         # actor
         self.renderWindow = self.sliceView.renderWindow()
         self.renderer = self.renderWindow.GetRenderers().GetItemAsObject(0)
 
         # if event == "LeaveEvent" or not self.layerVolumeNodes['F']:
         if event == "LeaveEvent":
+            self.renderTimer.stop()
             if self.drawOverlay:
                 self.renderer.RemoveActor(self.actor2D)
             self.renderer.RemoveActor(self.actor)
@@ -609,27 +644,39 @@ class ROIManager(ViewWatcher):
             self.renderer.AddActor2D(self.actor)
             if self.layerVolumeNodes['F'] and (self.layerVolumeNodes['F'] != self.layerVolumeNodes['B']):
                 self.cursorOff(self.sliceWidget)
-        else:
-            if self.drawOverlay:
-                self.mrmlUtils.qImageToVtkImageData(overlayPixmap.toImage(), self.vtkImage)
-                if vtk.VTK_MAJOR_VERSION <= 5:
-                    self.imageMapper.SetInput(self.vtkImage)
-                else:
-                    self.imageMapper.SetInputData(self.vtkImage)
-                    x, y = self.xy
-                    self.actor2D.SetPosition(x - self.width / 2, y - self.height / 2)
-
-            # draw ROI
-            x, y = self.xy
-            self.circle.GeneratePolylineOn()
-            self.circle.GeneratePolygonOff()
-            self.circle.SetRadius(self.ROIRadius)
-            self.circle.SetCenter(x, y, 0)
-            self.circle.Update()
-
-            self.computeROIStats(self.xy, self.ROIRadius)
+        elif not self.renderTimer.isActive():
+            # Coalesce the mouse/slice events. The ROI is drawn with the last position when the timer expires
+            self.renderTimer.start()
 
-            self.sliceView.forceRender()
+    def __onRenderTimeout__(self):
+        """ Draw the ROI (and the overlay) for the last position received. Called at most once per refresh interval
+        """
+        if self.sliceView is None or self.renderer is None:
+            return
+        if self.drawOverlay:
+            overlayPixmap = self.overlayPixmap(self.xy)
+            # widget
+            if self.showWidget:
+                self.label.setPixmap(overlayPixmap)
+            self.mrmlUtils.qImageToVtkImageData(overlayPixmap.toImage(), self.vtkImage)
+            if vtk.VTK_MAJOR_VERSION <= 5:
+                self.imageMapper.SetInput(self.vtkImage)
+            else:
+                self.imageMapper.SetInputData(self.vtkImage)
+                x, y = self.xy
+                self.actor2D.SetPosition(x - self.width / 2, y - self.height / 2)
+
+        # draw ROI
+        x, y = self.xy
+        self.circle.GeneratePolylineOn()
+        self.circle.GeneratePolygonOff()
+        self.circle.SetRadius(self.ROIRadius)
+        self.circle.SetCenter(x, y, 0)
+        self.circle.Update()
+
+        self.computeROIStats(self.xy, self.ROIRadius)
+
+        self.sliceView.forceRender()
 
     def computeROIStats(self, xy, radius):
         """compute stats for an image inside ROI
@@ -642,18 +689,7 @@ class ROIManager(ViewWatcher):
         if not bgVTKImage:
             bgVTKImage = self.layerLogics['L'].GetReslice().GetOutput()
 
-        x, y = xy
-        radius2 = radius * radius
-        roiPixels = []
-
-        if bgVTKImage:
-            dims = bgVTKImage.GetDimensions()
-            for i in range(dims[0]):
-                for j in range(dims[1]):
-                    dist2 = (i - x) * (i - x) + (j - y) * (j - y)
-                    if dist2 < radius2:
-                        value = bgVTKImage.GetScalarComponentAsDouble(i, j, 0, 0);
-                        roiPixels.append(value)
+        roiPixels = VolumeProbeLogic.getROIPixels(bgVTKImage, xy, radius)
 
         self.probeWidget.reportROIStats(roiPixels)
 
@@ -662,12 +698,7 @@ class ROIManager(ViewWatcher):
         at xy with the fg drawn over the bg"""
 
         # Get QImages for the two layers
-        bgVTKImage = self.layerLogics['B'].GetImageData()
-        fgVTKImage = self.layerLogics['F'].GetImageData()
-        bgQImage = qt.QImage()
-        fgQImage = qt.QImage()
-        slicer.qMRMLUtils().vtkImageDataToQImage(bgVTKImage, bgQImage)
-        slicer.qMRMLUtils().vtkImageDataToQImage(fgVTKImage, fgQImage)
+        bgQImage, fgQImage = self.layerQImages()
 
         # get the geometry of the focal point (xy) and images
         # noting that vtk has the origin at the bottom left and qt has
@@ -727,6 +758,31 @@ class ROIManager(ViewWatcher):
 
         return compositePixmap
 
+    def layerQImages(self):
+        """ Background and foreground layers converted to QImage.
+        The conversion is cached and only repeated when the slice (position, orientation, field of view), the
+        volumes in the layers or their window/level change, not when only the mouse moves
+        :return: tuple with the background and the foreground QImages
+        """
+        key = [self.sliceNode.GetID(), self.sliceNode.GetMTime()]
+        for layer in ('B', 'F'):
+            volumeNode = self.layerVolumeNodes.get(layer)
+            displayNode = volumeNode.GetDisplayNode() if volumeNode else None
+            imageData = self.layerLogics[layer].GetImageData()
+            key.extend((volumeNode.GetID() if volumeNode else None,
+                        displayNode.GetMTime() if displayNode else None,
+                        imageData.GetMTime() if imageData else None))
+        key = tuple(key)
+        if key != self.__layerImagesKey__:
+            images = []
+            for layer in ('B', 'F'):
+                qImage = qt.QImage()
+                self.mrmlUtils.vtkImageDataToQImage(self.layerLogics[layer].GetImageData(), qImage)
+                images.append(qImage)
+            self.__layerImages__ = tuple(images)
+            self.__layerImagesKey__ = key
+        return self.__layerImages__
+
     def scalePixmap(self, pixmap):
         # extract the center of the pixmap and then zoom
         halfWidth = self.width / 2